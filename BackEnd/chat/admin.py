@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Room, Message, User
+from django.conf import settings
+from django.db.models.functions import Length
+from .models import MessageArchiveSegment, Room, Message, User
+from .search import search_message_ids
 
 class CustomUserAdmin(UserAdmin):
     list_display = ('id', 'username', 'name', 'email', 'is_staff', 'is_superuser', 'get_groups')
@@ -13,32 +16,56 @@ class CustomUserAdmin(UserAdmin):
     get_groups.short_description = 'Groups'
 
 class RoomAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'created_by', 'created_at', 'has_password', 'message_count')
+    list_display = ('id', 'name', 'created_by', 'created_at', 'has_password', 'message_count', 'last_message_at')
     list_filter = ('created_at', 'created_by')
     search_fields = ('name', 'created_by__username')
     ordering = ('-created_at',)
-    readonly_fields = ('created_at',)
+    list_select_related = ('created_by',)
+    readonly_fields = ('created_at', 'message_count', 'message_seq', 'last_message_at', 'last_message_preview', 'last_message_user')
     
     def has_password(self, obj):
         return bool(obj.password)
     has_password.boolean = True
     has_password.short_description = 'Password Protected'
-    
-    def message_count(self, obj):
-        return obj.messages.count()
-    message_count.short_description = 'Messages'
 
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('id', 'content_preview', 'user', 'room', 'created_at')
     list_filter = ('created_at', 'room', 'user')
-    search_fields = ('content', 'user__username', 'room__name')
+    search_fields = ('user__username', 'room__name')
     ordering = ('-created_at',)
     readonly_fields = ('created_at',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Content is matched through the full-text index, not an icontains scan
+        matches, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            ids, _ = search_message_ids(search_term, limit=settings.CHAT_SEARCH_MAX_RESULTS, all_rooms=True)
+            matches |= queryset.filter(id__in=ids)
+        return matches, may_have_duplicates
     
     def content_preview(self, obj):
         return obj.content[:50] + ('...' if len(obj.content) > 50 else '')
     content_preview.short_description = 'Content'
 
+class MessageArchiveSegmentAdmin(admin.ModelAdmin):
+    list_display = ('id', 'room', 'first_created_at', 'last_created_at', 'message_count', 'compressed_size', 'archived_at')
+    list_filter = ('room',)
+    ordering = ('-archived_at',)
+    exclude = ('data',)
+    readonly_fields = ('room', 'first_created_at', 'first_id', 'last_created_at', 'last_id', 'message_count', 'archived_at')
+
+    def get_queryset(self, request):
+        # List the segments without loading their data
+        return super().get_queryset(request).defer('data').annotate(data_size=Length('data'))
+
+    def compressed_size(self, obj):
+        return obj.data_size
+    compressed_size.short_description = 'Bytes'
+
+    def has_add_permission(self, request):
+        return False
+
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(Room, RoomAdmin)
-admin.site.register(Message, MessageAdmin) 
\ No newline at end of file
+admin.site.register(Message, MessageAdmin)
+admin.site.register(MessageArchiveSegment, MessageArchiveSegmentAdmin) 
\ No newline at end of file
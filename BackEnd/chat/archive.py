@@ -0,0 +1,167 @@
+import json
+import logging
+import zlib
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .history_cache import get_recent_messages
+from .models import Message, MessageArchiveSegment, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'RETENTION_DAYS': 180,
+    'SEGMENT_SIZE': 1000,
+    'COMPRESSION_LEVEL': 6,
+}
+
+
+def get_archive_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CHAT_ARCHIVE', {}))
+    return config
+
+
+def encode_segment(messages):
+    rows = [[m.id, m.user_id, m.content, m.created_at.isoformat()] for m in messages]
+    raw = json.dumps(rows, separators=(',', ':')).encode()
+    return zlib.compress(raw, get_archive_settings()['COMPRESSION_LEVEL'])
+
+
+def decode_segment(segment):
+    """Return a segment's messages as ``(created_at, id, user_id, content)``."""
+    rows = json.loads(zlib.decompress(segment.data))
+    return [(parse_datetime(created_at), pk, user_id, content) for pk, user_id, content, created_at in rows]
+
+
+def archive_room(room_id, cutoff, segment_size=None):
+    """
+    Move a room's messages created before ``cutoff`` out of the message table
+    into segments of ``segment_size`` messages, oldest first, one transaction
+    per segment. Returns the number of messages archived.
+    """
+    segment_size = segment_size or get_archive_settings()['SEGMENT_SIZE']
+    archived = 0
+    while True:
+        # The batch is locked (on SQLite the transaction holds the write lock
+        # from its start) so it can't change between being read and deleted
+        with transaction.atomic():
+            batch = list(
+                Message.objects.filter(room_id=room_id, created_at__lt=cutoff)
+                .select_for_update()
+                .order_by('created_at', 'id')[:segment_size]
+            )
+            if not batch:
+                break
+            first, last = batch[0], batch[-1]
+            MessageArchiveSegment.objects.create(
+                room_id=room_id,
+                first_created_at=first.created_at,
+                first_id=first.id,
+                last_created_at=last.created_at,
+                last_id=last.id,
+                message_count=len(batch),
+                data=encode_segment(batch),
+            )
+            # Only the rows written to the segment: a message committed into the
+            # same time range meanwhile waits for the next batch. Plain SQL, as
+            # QuerySet.delete() would send post_delete for every message and
+            # archived messages still count towards the room's stats and read
+            # markers
+            ids = [message.id for message in batch]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {Message._meta.db_table} WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                    ids,
+                )
+        archived += len(batch)
+
+    if archived:
+        recent_messages = get_recent_messages()
+        if recent_messages is not None:
+            try:
+                recent_messages.invalidate(room_id)
+            except Exception as e:
+                logger.error(f'Error invalidating recent message cache: {str(e)}')
+    return archived
+
+
+def _before(prefix, created_at, pk):
+    return Q(**{f'{prefix}_created_at__lt': created_at}) | Q(**{f'{prefix}_created_at': created_at, f'{prefix}_id__lt': pk})
+
+
+def _after(prefix, created_at, pk):
+    return Q(**{f'{prefix}_created_at__gt': created_at}) | Q(**{f'{prefix}_created_at': created_at, f'{prefix}_id__gt': pk})
+
+
+def read_archive(room_id, before, position=None, bound=None, limit=50):
+    """
+    Read up to ``limit`` archived messages of a room strictly past the
+    ``(created_at, id)`` ``position`` (from the newest when None), walking
+    back in time when ``before`` is true and forward otherwise, and stopping
+    short of ``bound``. Only the segments overlapping that range are opened.
+    Returns unsaved ``Message`` instances with their authors loaded.
+    """
+    rows = []
+    for segment in _segments(room_id, before, position, bound).iterator(chunk_size=4):
+        rows.extend(_rows_inside(segment, before, position, bound))
+        if len(rows) >= limit:
+            break
+    rows = _first_rows(rows, before, limit)
+    users = User.objects.in_bulk({row[2] for row in rows if row[2] is not None})
+    return _messages(room_id, rows, users)
+
+
+async def aread_archive(room_id, before, position=None, bound=None, limit=50):
+    """read_archive() on the async ORM."""
+    rows = []
+    async for segment in _segments(room_id, before, position, bound).aiterator(chunk_size=4):
+        rows.extend(_rows_inside(segment, before, position, bound))
+        if len(rows) >= limit:
+            break
+    rows = _first_rows(rows, before, limit)
+    users = await User.objects.ain_bulk({row[2] for row in rows if row[2] is not None})
+    return _messages(room_id, rows, users)
+
+
+def _segments(room_id, before, position, bound):
+    segments = MessageArchiveSegment.objects.filter(room_id=room_id)
+    if before:
+        if position is not None:
+            segments = segments.filter(_before('first', *position))
+        if bound is not None:
+            segments = segments.filter(_after('last', *bound))
+        return segments.order_by('-last_created_at', '-last_id')
+    if position is not None:
+        segments = segments.filter(_after('last', *position))
+    if bound is not None:
+        segments = segments.filter(_before('first', *bound))
+    return segments.order_by('first_created_at', 'first_id')
+
+
+def _rows_inside(segment, before, position, bound):
+    rows = []
+    for row in decode_segment(segment):
+        key = row[:2]
+        if before:
+            inside = (position is None or key < position) and (bound is None or key > bound)
+        else:
+            inside = (position is None or key > position) and (bound is None or key < bound)
+        if inside:
+            rows.append(row)
+    return rows
+
+
+def _first_rows(rows, before, limit):
+    rows.sort(reverse=before)
+    return rows[:limit]
+
+
+def _messages(room_id, rows, users):
+    return [
+        Message(id=pk, room_id=room_id, user=users.get(user_id), content=content, created_at=created_at)
+        for created_at, pk, user_id, content in rows
+    ]
@@ -11,7 +11,7 @@ class CustomAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
         # Check if user is already authenticated by checking _user attribute
         if hasattr(request, '_user') and request._user is not None:
-            logger.info(f"User authenticated: {request._user.username}")
+            logger.debug(f"User authenticated: {request._user.username}")
             return (request._user, None)
         return None 
 
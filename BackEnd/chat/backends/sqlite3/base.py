@@ -0,0 +1,25 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    The SQLite backend with the ``transaction_mode`` option of Django 5.1.
+    ``IMMEDIATE`` takes the write lock when an atomic block begins, waiting
+    out busy_timeout if needed. A deferred transaction that reads first
+    fails at once with "database is locked" when it then tries to write
+    while another connection is writing.
+    """
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        mode = kwargs.pop('transaction_mode', None)
+        if mode is not None and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f'transaction_mode must be one of {", ".join(TRANSACTION_MODES)}')
+        return kwargs
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        self.cursor().execute(f'BEGIN {mode.upper()}' if mode else 'BEGIN')
@@ -0,0 +1,98 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class LRUCache:
+    """
+    Small thread-safe LRU mapping with an optional per-entry time-to-live.
+
+    Entries live in process memory only, so other workers are not notified of
+    invalidations; a ``ttl`` bounds how long such a stale entry can survive.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._data[key]
+            except KeyError:
+                return default
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_value(self, value):
+        with self._lock:
+            for key in [k for k, (v, _) in self._data.items() if v == value]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# Room name -> primary key, shared by every consumer in this process
+room_id_cache = LRUCache(
+    maxsize=getattr(settings, 'CHAT_ROOM_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'CHAT_ROOM_CACHE_TTL', 300),
+)
+
+
+# Room id -> password hash ('' for open rooms), used to verify room access
+# grants without loading the room
+room_password_cache = LRUCache(
+    maxsize=getattr(settings, 'CHAT_ROOM_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'CHAT_ROOM_CACHE_TTL', 300),
+)
+
+
+# User id -> User snapshot for token authentication, invalidated when the
+# user is saved or deleted
+user_cache = LRUCache(
+    maxsize=getattr(settings, 'CHAT_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'CHAT_USER_CACHE_TTL', 60),
+)
+
+
+def get_cached_user(user_id):
+    """
+    Return the user with ``user_id``, or None if it does not exist. Callers
+    get their own copy so request code can't mutate the shared snapshot.
+    """
+    from .models import User
+
+    if not getattr(settings, 'CHAT_USER_CACHE_ENABLED', True):
+        return User.objects.filter(id=user_id).first()
+    user = user_cache.get(user_id)
+    if user is None:
+        user = User.objects.filter(id=user_id).first()
+        if user is None:
+            return None
+        user_cache.set(user_id, user)
+    return copy.copy(user)
@@ -1,58 +1,71 @@
 import json
 import logging
-import jwt
+import time
+import uuid
+from datetime import timedelta
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .cache import get_cached_user, room_id_cache
+from .db_executor import chat_database_sync_to_async, get_db_executor, get_db_executor_settings
+from .grants import aroom_access_allowed
+from .metrics import registry
+from .outbound import (
+    SLOW_CONSUMER_CLOSE_CODE, OutboundBatcher, OutboundQueue, get_batching_settings, get_send_queue_settings,
+)
+from .pagination import AFTER, seek
+from .persistence import BufferFull, PendingMessage, get_write_behind_settings, get_write_buffer
 
 logger = logging.getLogger(__name__)
 
+# Password-protected room joined without a valid access grant
+ROOM_ACCESS_DENIED_CLOSE_CODE = 4003
+# Server overloaded; the client should reconnect after the hinted delay
+TRY_AGAIN_LATER_CLOSE_CODE = 1013
+
+
+def message_key(nonce, message_id):
+    # Write-behind messages are broadcast before they have an id, so their
+    # nonce identifies them in every frame; other messages go by id
+    return nonce or message_id
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
+    outbound = None
+    send_queue = None
+    replayed_keys = frozenset()
+    replayed_max_id = 0
+
     async def connect(self):
         try:
             # Get room name from URL
             self.room_name = self.scope['url_route']['kwargs']['room_name']
             self.room_group_name = f'chat_{self.room_name}'
 
-            # Get token from query string
-            query_string = self.scope.get('query_string', b'').decode()
-            query_params = dict(param.split('=') for param in query_string.split('&') if param)
-            token = query_params.get('token')
-
-            if not token:
-                logger.warning("No token provided")
+            # The user was authenticated from the token by JWTAuthMiddleware
+            self.user = self.scope.get('user')
+            if self.user is None or not self.user.is_authenticated:
+                logger.warning("Missing or invalid token")
                 await self.close(code=1008)  # Policy violation
                 return
 
-            # Verify token and get user
-            try:
-                logger.info(f"Decoding token: {token[:20]}...")
-                # Decode token without verification first to get the user_id
-                decoded_token = jwt.decode(token, options={"verify_signature": False})
-                user_id = decoded_token.get('user_id')
-                
-                if not user_id:
-                    logger.warning("No user_id in token")
-                    await self.close(code=1008)  # Policy violation
-                    return
-
-                self.user = await self.get_user(user_id)
-                if not self.user:
-                    logger.warning(f"User not found for id: {user_id}")
-                    await self.close(code=1008)  # Policy violation
-                    return
-                logger.info(f"Found user: {self.user.username}")
-            except Exception as e:
-                logger.error(f"Error validating token: {str(e)}", exc_info=True)
-                await self.close(code=1008)  # Policy violation
+            if await self.reject_if_overloaded():
                 return
 
             # Get or create room
-            room_created = await self.get_or_create_room()
-            if not room_created:
+            self.room_id = await self.get_or_create_room()
+            if not self.room_id:
                 logger.error("Failed to create/get room")
                 await self.close(code=1011)  # Internal error
                 return
 
+            if not await self.has_room_access():
+                logger.warning(f'Missing or invalid room grant: {self.user.username} to {self.room_name}')
+                await self.close(code=ROOM_ACCESS_DENIED_CLOSE_CODE)
+                return
+
             # Join room group
             await self.channel_layer.group_add(
                 self.room_group_name,
@@ -60,15 +73,75 @@ class ChatConsumer(AsyncWebsocketConsumer):
             )
 
             await self.accept()
+
+            batching = get_batching_settings()
+            if batching['ENABLED']:
+                self.outbound = OutboundBatcher(
+                    self.send_text,
+                    window=batching['WINDOW'],
+                    max_batch=batching['MAX_BATCH'],
+                )
+
+            # A client's lag is only known from its acks (see OutboundQueue),
+            # so clients that don't send them are written to directly
+            send_queue = get_send_queue_settings()
+            acks = parse_qs(self.scope.get('query_string', b'').decode()).get('ack', [''])[0] == '1'
+            if send_queue['ENABLED'] and acks:
+                self.send_queue = OutboundQueue(
+                    self.outbound.push if self.outbound is not None else self.send_text,
+                    max_size=send_queue['MAX_SIZE'],
+                    max_unacked=send_queue['MAX_UNACKED'],
+                    policy=send_queue['POLICY'],
+                    on_overflow=self.disconnect_slow_consumer,
+                )
+                self.send_queue.start()
+
+            connect_started = self.scope.get('connect_started')
+            if connect_started is not None:
+                registry.histogram('ws.connect_ms').observe((time.perf_counter() - connect_started) * 1000)
             logger.info(f'WebSocket connected: {self.user.username} to {self.room_name}')
 
+            # Replay what the client missed; live events wait in the channel
+            # until connect returns, so nothing slips between the two
+            last_id = parse_qs(self.scope.get('query_string', b'').decode()).get('last_id', [''])[0]
+            if last_id.isdigit():
+                await self.replay_missed(int(last_id))
+
         except Exception as e:
             logger.error(f"Error in connect: {str(e)}", exc_info=True)
             await self.close(code=1011)  # Internal error
             # Don't raise StopConsumer here, let the framework handle it
             return
 
+    async def reject_if_overloaded(self):
+        # Admission control: while the database queue is too deep, turn new
+        # connections away with a retry hint instead of queueing more work
+        config = get_db_executor_settings()
+        executor = get_db_executor()
+        if not config['ADMISSION_CONTROL'] or executor is None or not executor.overloaded(config['MAX_QUEUE_DEPTH']):
+            return False
+        registry.counter('ws.connects_rejected').inc()
+        logger.warning(f'Rejecting connect to {self.room_name}: database queue depth {executor.depth}')
+        await self.accept()
+        await self.send(text_data=json.dumps({'type': 'retry', 'retry_after': config['RETRY_AFTER']}))
+        await self.close(code=TRY_AGAIN_LATER_CLOSE_CODE)
+        return True
+
+    async def has_room_access(self):
+        grant = parse_qs(self.scope.get('query_string', b'').decode()).get('grant', [''])[0]
+        return await aroom_access_allowed(self.room_id, self.user.id, grant)
+
     async def disconnect(self, close_code):
+        if self.send_queue is not None:
+            logger.info(f'Closing send queue for {self.channel_name}: {len(self.send_queue)} queued, {self.send_queue.dropped} dropped')
+            self.send_queue.close()
+        if self.outbound is not None:
+            self.outbound.close()
+        if get_write_behind_settings()['ENABLED']:
+            try:
+                await get_write_buffer().flush()
+            except Exception as e:
+                logger.error(f'Error flushing buffered messages: {str(e)}')
         try:
             # Leave room group
             await self.channel_layer.group_discard(
@@ -89,63 +162,251 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 if not content:
                     return
 
+                if get_write_behind_settings()['ENABLED']:
+                    await self.broadcast_write_behind(content)
+                    return
+
                 # Save message to database
-                message = await self.save_message(content)
+                try:
+                    message = await self.save_message(content)
+                except Exception as e:
+                    logger.error(f'Error saving message from {self.user.username}: {str(e)}')
+                    await self.send(text_data=json.dumps({
+                        'type': 'error',
+                        'error': 'Message could not be saved',
+                    }))
+                    return
                 
                 # Send message to room group
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'chat_message',
-                        'message': {
-                            'id': message.id,
-                            'content': message.content,
-                            'user': {
-                                'id': message.user.id,
-                                'username': message.user.username
-                            },
-                            'timestamp': message.created_at.isoformat()
-                        }
-                    }
-                )
+                await self.broadcast({
+                    'id': message.id,
+                    'content': message.content,
+                    'user': {
+                        'id': self.user.id,
+                        'username': self.user.username
+                    },
+                    'timestamp': message.created_at.isoformat()
+                })
+            elif message_type == 'read':
+                # The client has seen everything posted to the room so far
+                await self.mark_read()
+            elif message_type == 'ack':
+                # Frames received by the client so far, control frames included
+                frames = data.get('frames')
+                if self.send_queue is not None and isinstance(frames, int):
+                    self.send_queue.ack(frames)
         except Exception as e:
             logger.error(f'Error in receive: {str(e)}')
 
+    async def broadcast_write_behind(self, content):
+        # Broadcast first and let the write buffer persist the message in a batch
+        nonce = uuid.uuid4().hex
+        created_at = timezone.now()
+        try:
+            get_write_buffer().enqueue(PendingMessage(
+                room_id=self.room_id,
+                user_id=self.user.id,
+                content=content,
+                created_at=created_at,
+                nonce=nonce,
+                reply_channel=self.channel_name,
+            ))
+        except BufferFull as e:
+            logger.warning(f'Rejecting message from {self.user.username}: {str(e)}')
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'error': 'Server is busy, message was not sent',
+                'nonce': nonce,
+            }))
+            return
+
+        await self.broadcast({
+            'id': None,
+            'nonce': nonce,
+            'content': content,
+            'user': {
+                'id': self.user.id,
+                'username': self.user.username
+            },
+            'timestamp': created_at.isoformat()
+        })
+
+    async def broadcast(self, message):
+        # Encode the frame once here instead of once per recipient
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'chat_message',
+                'id': message['id'],
+                'nonce': message.get('nonce'),
+                'text': json.dumps(message),
+            }
+        )
+
+    async def persist_failed(self, event):
+        try:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'error': 'Message could not be saved',
+                'nonce': event['nonce'],
+            }))
+        except Exception as e:
+            logger.error(f'Error in persist_failed: {str(e)}')
+
     async def chat_message(self, event):
         try:
-            # Send message to WebSocket
-            await self.send(text_data=json.dumps(event['message']))
+            # Skip live events already delivered by the resume replay
+            message_id = event.get('id', event.get('message', {}).get('id'))
+            if self.replayed_keys:
+                key = message_key(event.get('nonce'), message_id)
+                if key in self.replayed_keys:
+                    self.replayed_keys.discard(key)
+                    return
+                if message_id is not None and message_id > self.replayed_max_id:
+                    # Live frames have passed the replayed range
+                    self.replayed_keys = frozenset()
+
+            # Send the pre-encoded frame; 'message' events come from older senders
+            text = event.get('text')
+            if text is None:
+                text = json.dumps(event['message'])
+            if self.send_queue is not None:
+                self.send_queue.put(text, message_id)
+            elif self.outbound is not None:
+                await self.outbound.push(text)
+            else:
+                await self.send(text_data=text)
         except Exception as e:
             logger.error(f'Error in chat_message: {str(e)}')
 
-    @database_sync_to_async
-    def get_user(self, user_id):
+    async def replay_missed(self, last_id):
+        """
+        Send what the client missed after ``last_id`` in chunks. Ids are not
+        in commit order (concurrent transactions, write-behind batches), so
+        the replay starts ``CHAT_RESUME_LOOKBACK`` seconds before that
+        message was created rather than at its id; the client drops what it
+        already has by message key, and live events for replayed messages
+        are dropped here the same way until live frames pass the replayed
+        range. A ``last_id`` that is unknown or archived gets a ``resync``.
+        """
+        chunk_size = getattr(settings, 'CHAT_RESUME_CHUNK_SIZE', 100)
+        max_messages = getattr(settings, 'CHAT_RESUME_MAX_MESSAGES', 1000)
+        position = await self.resume_position(last_id)
+        if position is None:
+            # Unknown or archived: the gap can't be replayed over the socket
+            await self.send(text_data=json.dumps({'type': 'resync', 'last_id': last_id}))
+            logger.info(f'Asking {self.user.username} to resync in {self.room_name}: message {last_id} is unknown or archived')
+            return
+        replayed_keys = set()
+        replayed = 0
+        while replayed < max_messages:
+            limit = min(chunk_size, max_messages - replayed)
+            chunk, position = await self.get_messages_since(position, limit)
+            if not chunk:
+                break
+            await self.send(text_data=json.dumps(chunk))
+            replayed_keys.update(message_key(frame.get('nonce'), frame['id']) for frame in chunk)
+            self.replayed_max_id = max(self.replayed_max_id, *(frame['id'] for frame in chunk))
+            replayed += len(chunk)
+            if len(chunk) < limit:
+                break
+        else:
+            # Too far behind to replay over the socket; the client reloads history
+            await self.send(text_data=json.dumps({'type': 'resync', 'last_id': position[1]}))
+        self.replayed_keys = replayed_keys
+        logger.info(f'Replayed {replayed} messages after {last_id} to {self.user.username} in {self.room_name}')
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+        # Every frame counts towards the client's acks, not just queued ones
+        if self.send_queue is not None and (text_data is not None or bytes_data is not None):
+            self.send_queue.count_sent()
+
+    async def send_text(self, text):
+        await self.send(text_data=text)
+
+    async def disconnect_slow_consumer(self, last_id):
+        # Tell the client where to resume from, then drop the connection
         try:
-            # Import User model here to avoid AppRegistryNotReady error
-            from .models import User
-            return User.objects.get(id=user_id)
+            logger.warning(f'Disconnecting slow consumer {self.channel_name} in {self.room_name}')
+            self.send_queue.close()
+            if self.outbound is not None:
+                await self.outbound.flush()
+            await self.send(text_data=json.dumps({'type': 'resume', 'last_id': last_id}))
+            await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
         except Exception as e:
-            logger.warning(f'User not found for id: {user_id}: {str(e)}')
-            return None
+            logger.error(f'Error disconnecting slow consumer: {str(e)}')
 
-    @database_sync_to_async
+    @chat_database_sync_to_async
     def get_or_create_room(self):
+        room_id = room_id_cache.get(self.room_name)
+        if room_id is not None:
+            return room_id
         try:
             # Import Room model here to avoid AppRegistryNotReady error
             from .models import Room
             room, created = Room.objects.get_or_create(name=self.room_name)
-            return True
+            room_id_cache.set(self.room_name, room.id)
+            return room.id
         except Exception as e:
             logger.error(f"Error getting/creating room: {str(e)}")
-            return False
+            return None
+
+    @chat_database_sync_to_async
+    def resume_position(self, last_id):
+        from .models import Message, MessageArchiveSegment
+        messages = Message.objects.filter(room_id=self.room_id)
+        created_at = messages.filter(id=last_id).values_list('created_at', flat=True).first()
+        if created_at is None:
+            if MessageArchiveSegment.objects.filter(room_id=self.room_id, first_id__lte=last_id).exists():
+                return None
+            # Deleted: resume from the newest message before it instead
+            created_at = messages.filter(id__lte=last_id).order_by('-id').values_list('created_at', flat=True).first()
+            if created_at is None:
+                return None
+        lookback = getattr(settings, 'CHAT_RESUME_LOOKBACK', 10)
+        return (created_at - timedelta(seconds=lookback), 0)
+
+    @chat_database_sync_to_async
+    def get_messages_since(self, position, limit):
+        """Return up to ``limit`` frames after ``(created_at, id)`` and the last one's position."""
+        from .models import Message
+        rows = Message.objects.filter(room_id=self.room_id)
+        rows = seek(rows, *position, AFTER) if position is not None else rows.order_by('created_at', 'id')
+        rows = list(rows.values('id', 'nonce', 'content', 'created_at', 'user_id', 'user__username')[:limit])
+        frames = []
+        for row in rows:
+            frame = {
+                'id': row['id'],
+                'content': row['content'],
+                'user': {
+                    'id': row['user_id'],
+                    'username': row['user__username']
+                },
+                'timestamp': row['created_at'].isoformat()
+            }
+            if row['nonce']:
+                frame['nonce'] = row['nonce']
+            frames.append(frame)
+        return frames, ((rows[-1]['created_at'], rows[-1]['id']) if rows else position)
+
+    @chat_database_sync_to_async
+    def mark_read(self):
+        from .read_markers import mark_read
+        mark_read(self.user.id, self.room_id)
 
-    @database_sync_to_async
+    @chat_database_sync_to_async
     def save_message(self, content):
         # Import models here to avoid AppRegistryNotReady error
-        from .models import Room, Message
-        room = Room.objects.get(name=self.room_name)
-        return Message.objects.create(
-            room=room,
-            user=self.user,
-            content=content
-        ) 
\ No newline at end of file
+        from .models import Message
+        # Resolve the author before the transaction: on SQLite a transaction
+        # that reads first can't be upgraded to a write while another
+        # connection writes ("database is locked", busy_timeout or not)
+        user = get_cached_user(self.user.id)
+        # The room's stats are updated in the same transaction (chat.signals)
+        with transaction.atomic():
+            return Message.objects.create(
+                room_id=self.room_id,
+                user=user,
+                content=content
+            ) 
\ No newline at end of file
@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .metrics import registry
+
+DEFAULTS = {
+    'ENABLED': True,
+    'WORKERS': 8,
+    'ADMISSION_CONTROL': False,
+    'MAX_QUEUE_DEPTH': 100,
+    'RETRY_AFTER': 2,
+}
+
+
+def get_db_executor_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CHAT_DB_EXECUTOR', {}))
+    return config
+
+
+class DatabaseExecutor:
+    """
+    Thread pool that the chat consumers run their database calls on.
+
+    Unlike asgiref's shared default executor its size is configured and its
+    queue is visible: ``depth`` counts calls waiting for a thread, and every
+    call records how long it waited and ran under ``db.<name>.wait_ms`` and
+    ``db.<name>.run_ms``. Connections are cleaned up around each call the way
+    ``database_sync_to_async`` does.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = workers
+        self.depth = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat-db')
+        self._depth_gauge = registry.gauge('db.queue_depth')
+
+    async def run(self, fn, *args, **kwargs):
+        name = getattr(fn, '__name__', 'call')
+        submitted = time.perf_counter()
+        self._adjust_depth(1)
+        context = contextvars.copy_context()
+
+        def call():
+            started = time.perf_counter()
+            self._adjust_depth(-1)
+            registry.histogram(f'db.{name}.wait_ms').observe((started - submitted) * 1000)
+            close_old_connections()
+            try:
+                return context.run(fn, *args, **kwargs)
+            finally:
+                close_old_connections()
+                registry.histogram(f'db.{name}.run_ms').observe((time.perf_counter() - started) * 1000)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def _adjust_depth(self, amount):
+        with self._lock:
+            self.depth += amount
+            self._depth_gauge.set(self.depth)
+
+    def overloaded(self, max_depth):
+        return self.depth > max_depth
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_db_executor():
+    """Return the process-wide executor, or None when it is disabled."""
+    global _executor
+    config = get_db_executor_settings()
+    if not config['ENABLED']:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = DatabaseExecutor(workers=config['WORKERS'])
+        return _executor
+
+
+def chat_database_sync_to_async(fn):
+    """
+    Like ``database_sync_to_async`` but runs ``fn`` on the chat database
+    executor, falling back to asgiref's executor when it is disabled.
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        executor = get_db_executor()
+        if executor is None:
+            return await database_sync_to_async(fn)(*args, **kwargs)
+        return await executor.run(fn, *args, **kwargs)
+
+    return wrapper
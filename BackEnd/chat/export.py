@@ -0,0 +1,92 @@
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .archive import decode_segment
+from .models import Message, MessageArchiveSegment, User
+from .pagination import AFTER, encode_cursor, seek
+
+
+def get_export_chunk_size():
+    return getattr(settings, 'CHAT_EXPORT_CHUNK_SIZE', 2000)
+
+
+def export_rows(room_id, position=None):
+    """
+    Yield a room's messages oldest first as plain dicts, starting after the
+    ``(created_at, id)`` ``position`` when given: archived segments first
+    (see chat.archive), then the message table read with a chunked
+    iterator. Only one segment or chunk is held in memory at a time, and
+    every row carries the cursor to resume right after it.
+    """
+    segments = MessageArchiveSegment.objects.filter(room_id=room_id)
+    if position is not None:
+        created_at, pk = position
+        segments = segments.filter(last_created_at__gte=created_at).exclude(last_created_at=created_at, last_id__lte=pk)
+    for segment_id in segments.order_by('first_created_at', 'first_id').values_list('id', flat=True):
+        rows = decode_segment(MessageArchiveSegment.objects.get(id=segment_id))
+        users = User.objects.in_bulk({row[2] for row in rows if row[2] is not None})
+        for created_at, pk, user_id, content in rows:
+            if position is not None and (created_at, pk) <= position:
+                continue
+            user = users.get(user_id)
+            yield export_row(room_id, pk, user_id, user.username if user else None, content, created_at)
+
+    messages = Message.objects.filter(room_id=room_id)
+    if position is not None:
+        messages = seek(messages, *position, AFTER)
+    else:
+        messages = messages.order_by('created_at', 'id')
+    rows = messages.values_list('id', 'user_id', 'user__username', 'content', 'created_at')
+    for pk, user_id, username, content, created_at in rows.iterator(chunk_size=get_export_chunk_size()):
+        yield export_row(room_id, pk, user_id, username, content, created_at)
+
+
+def export_row(room_id, pk, user_id, username, content, created_at):
+    return {
+        'id': pk,
+        'room': room_id,
+        'user': {'id': user_id, 'username': username} if user_id is not None else None,
+        'content': content,
+        'created_at': created_at.isoformat(),
+        'cursor': encode_cursor(created_at, pk, AFTER),
+    }
+
+
+def ndjson_chunks(rows, compress=False, lines_per_chunk=500):
+    """Encode rows as NDJSON in chunks of bytes, gzip-compressed if asked."""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    lines = []
+
+    def encode(text):
+        data = text.encode()
+        return compressor.compress(data) if compressor else data
+
+    for row in rows:
+        lines.append(json.dumps(row, separators=(',', ':')) + '\n')
+        if len(lines) >= lines_per_chunk:
+            chunk = encode(''.join(lines))
+            lines = []
+            if chunk:
+                yield chunk
+    chunk = encode(''.join(lines))
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+
+async def aiterate(iterator):
+    """
+    Serve a synchronous iterator to an async consumer one item at a time.
+    Django buffers a sync iterator whole before streaming it under ASGI.
+    """
+    done = object()
+    step = sync_to_async(lambda: next(iterator, done))
+    while True:
+        item = await step()
+        if item is done:
+            return
+        yield item
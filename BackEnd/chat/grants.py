@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core import signing
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .cache import room_password_cache
+from .db_executor import chat_database_sync_to_async
+
+GRANT_SALT = 'chat.room-access'
+
+
+def get_grant_ttl():
+    return getattr(settings, 'CHAT_ROOM_GRANT_TTL', 12 * 60 * 60)
+
+
+def password_fingerprint(password_hash):
+    # Ties a grant to the password it was issued for, so changing the
+    # password revokes every outstanding grant
+    return salted_hmac(GRANT_SALT, password_hash or '').hexdigest()[:16]
+
+
+def issue_room_grant(room, user_id):
+    """Sign a short-lived grant letting ``user_id`` into a password-protected room."""
+    return signing.dumps(
+        {'r': room.id, 'u': user_id, 'p': password_fingerprint(room.password)},
+        salt=GRANT_SALT,
+        compress=True,
+    )
+
+
+def verify_room_grant(grant, room_id, user_id, password_hash):
+    """Check a grant with an HMAC rather than re-running the password hasher."""
+    if not grant:
+        return False
+    try:
+        payload = signing.loads(grant, salt=GRANT_SALT, max_age=get_grant_ttl())
+    except signing.BadSignature:
+        return False
+    return (
+        payload.get('r') == room_id
+        and payload.get('u') == user_id
+        and constant_time_compare(payload.get('p', ''), password_fingerprint(password_hash))
+    )
+
+
+def get_room_password(room_id):
+    """Return the room's password hash ('' when it has none), cached by room id."""
+    from .models import Room
+
+    password = room_password_cache.get(room_id)
+    if password is None:
+        password = Room.objects.filter(id=room_id).values_list('password', flat=True).first() or ''
+        room_password_cache.set(room_id, password)
+    return password
+
+
+def room_access_allowed(room_id, user_id, grant):
+    password = get_room_password(room_id)
+    return not password or verify_room_grant(grant, room_id, user_id, password)
+
+
+async def aroom_access_allowed(room_id, user_id, grant):
+    # A cached password hash answers without leaving the event loop
+    password = room_password_cache.get(room_id)
+    if password is None:
+        password = await chat_database_sync_to_async(get_room_password)(room_id)
+    return not password or verify_room_grant(grant, room_id, user_id, password)
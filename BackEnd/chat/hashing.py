@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, make_password
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WORKERS': 4,
+    'MAX_QUEUE': 32,
+    'ITERATIONS': PBKDF2PasswordHasher.iterations,
+    'RETRY_AFTER': 1,
+}
+
+
+def get_hashing_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CHAT_PASSWORD_HASHING', {}))
+    return config
+
+
+class ConfiguredPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 at the cost set in ``CHAT_PASSWORD_HASHING['ITERATIONS']``. It keeps
+    the ``pbkdf2_sha256`` algorithm name, so existing hashes still verify and
+    are upgraded to the configured cost on the next successful login.
+    """
+
+    @property
+    def iterations(self):
+        return get_hashing_settings()['ITERATIONS']
+
+
+class HashingPoolSaturated(Exception):
+    pass
+
+
+class PasswordHashingPool:
+    """
+    Bounded pool that password hashing is offloaded to.
+
+    At most ``workers`` hashes run at once and at most ``max_queue`` more may
+    wait; beyond that ``submit`` raises ``HashingPoolSaturated`` straight away
+    so the caller can answer 429 instead of stalling its worker. Threads are
+    enough here because hashlib's PBKDF2 releases the GIL while it runs.
+    """
+
+    def __init__(self, workers=4, max_queue=32):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chat-hash')
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._queued = registry.gauge('auth.hash_pool.queued')
+        self._active = registry.gauge('auth.hash_pool.active')
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            registry.counter('auth.hash_pool.rejected').inc()
+            raise HashingPoolSaturated()
+        self._queued.inc()
+        submitted = time.perf_counter()
+        try:
+            return self._executor.submit(self._run, submitted, fn, *args)
+        except Exception:
+            self._queued.dec()
+            self._slots.release()
+            raise
+
+    def _run(self, submitted, fn, *args):
+        self._queued.dec()
+        self._active.inc()
+        started = time.perf_counter()
+        registry.histogram('auth.hash_pool.wait_ms').observe((started - submitted) * 1000)
+        try:
+            return fn(*args)
+        finally:
+            registry.histogram('auth.hash_pool.hash_ms').observe((time.perf_counter() - started) * 1000)
+            self._active.dec()
+            self._slots.release()
+
+    def call(self, fn, *args):
+        """Run ``fn`` on the pool and wait for it from synchronous code."""
+        return self.submit(fn, *args).result()
+
+    async def run(self, fn, *args):
+        """Run ``fn`` on the pool without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config = get_hashing_settings()
+            _pool = PasswordHashingPool(workers=config['WORKERS'], max_queue=config['MAX_QUEUE'])
+        return _pool
+
+
+def verify_password(raw_password, encoded):
+    """
+    Return ``(valid, new_encoded)``. ``new_encoded`` is set when the stored
+    hash was made at a different cost than configured and has been redone.
+    """
+    upgraded = []
+    valid = check_password(raw_password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return valid, upgraded[0] if upgraded else None
+
+
+def hash_password(raw_password):
+    """Hash a password on the bounded pool, blocking the caller."""
+    return get_hashing_pool().call(make_password, raw_password)
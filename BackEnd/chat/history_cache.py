@@ -0,0 +1,238 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'SIZE': 200,
+    'MAX_ROOMS': 1000,
+    'MAX_BYTES': 32 * 1024 * 1024,
+    'TTL': 5,
+    'REDIS_URL': None,
+    'REDIS_TTL': 3600,
+}
+
+
+def get_recent_messages_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CHAT_RECENT_MESSAGES', {}))
+    return config
+
+
+class LocalRecentMessages:
+    """
+    Per-room ring buffers of the newest serialized messages, in process memory.
+
+    A buffer only exists once it has been filled from the database, and from
+    then on every write appends to it, so it always holds the room's newest
+    messages. Each room has a write sequence number: a fill computed from a
+    database read that raced with a write is discarded rather than stored.
+    Rooms are evicted least recently used first to stay under ``max_rooms``
+    and ``max_bytes``.
+
+    Only writes made by this process reach its buffers, so with several
+    workers a buffer misses the others' messages. A buffer is therefore
+    refilled from the database ``ttl`` seconds after it was filled, however
+    often it was appended to; use RedisRecentMessages to share buffers.
+    """
+
+    blocking = False
+
+    def __init__(self, size=200, max_rooms=1000, max_bytes=32 * 1024 * 1024, ttl=5):
+        self.size = size
+        self.max_rooms = max_rooms
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._rooms = OrderedDict()
+        self._seq = {}
+        self._lock = threading.Lock()
+
+    def get(self, room_id, limit):
+        """
+        Return ``(messages, exhaustive)`` for the newest ``limit`` messages,
+        or None when the buffer cannot answer; ``exhaustive`` means there is
+        no older history.
+        """
+        with self._lock:
+            entry = self._rooms.get(room_id)
+            if entry is None:
+                return None
+            if entry['expires_at'] is not None and entry['expires_at'] < time.monotonic():
+                self._drop(room_id)
+                return None
+            buffer, complete = entry['messages'], entry['complete']
+            if limit > self.size or (len(buffer) < limit and not complete):
+                return None
+            self._rooms.move_to_end(room_id)
+            return [message for message, _ in list(buffer)[-limit:]], complete and len(buffer) <= limit
+
+    def begin_fill(self, room_id):
+        with self._lock:
+            return self._seq.get(room_id, 0)
+
+    def fill(self, room_id, messages, token, complete):
+        with self._lock:
+            if self._seq.get(room_id, 0) != token:
+                return False
+            self._drop(room_id)
+            buffer = deque(maxlen=self.size)
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            entry = {'messages': buffer, 'complete': complete, 'bytes': 0, 'expires_at': expires_at}
+            self._rooms[room_id] = entry
+            for message in messages[-self.size:]:
+                self._push(entry, message)
+            self._evict()
+            return True
+
+    def append(self, room_id, message):
+        with self._lock:
+            self._seq[room_id] = self._seq.get(room_id, 0) + 1
+            entry = self._rooms.get(room_id)
+            if entry is not None:
+                self._push(entry, message)
+                self._evict()
+
+    def invalidate(self, room_id):
+        with self._lock:
+            self._seq[room_id] = self._seq.get(room_id, 0) + 1
+            self._drop(room_id)
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self.bytes = 0
+
+    def _push(self, entry, message):
+        buffer = entry['messages']
+        size = len(json.dumps(message, default=str))
+        if len(buffer) == buffer.maxlen:
+            _, evicted = buffer[0]
+            entry['bytes'] -= evicted
+            self.bytes -= evicted
+            # The oldest message falls out, so older history is now elsewhere
+            entry['complete'] = False
+        buffer.append((message, size))
+        entry['bytes'] += size
+        self.bytes += size
+
+    def _drop(self, room_id):
+        entry = self._rooms.pop(room_id, None)
+        if entry is not None:
+            self.bytes -= entry['bytes']
+
+    def _evict(self):
+        while self._rooms and (len(self._rooms) > self.max_rooms or self.bytes > self.max_bytes):
+            room_id, entry = self._rooms.popitem(last=False)
+            self.bytes -= entry['bytes']
+
+
+class RedisRecentMessages:
+    """
+    The same ring buffers kept in Redis lists, shared by every worker.
+
+    Writers use RPUSHX so they never create a partial buffer, and fills are
+    applied in a WATCH/MULTI transaction against the room's write sequence.
+    """
+
+    blocking = True
+
+    def __init__(self, url, size=200, ttl=3600):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.size = size
+        self.ttl = ttl
+
+    def _keys(self, room_id):
+        base = f'chat:recent:{room_id}'
+        return base, f'{base}:complete', f'{base}:seq'
+
+    def get(self, room_id, limit):
+        if limit > self.size:
+            return None
+        key, complete_key, _ = self._keys(room_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.lrange(key, -limit, -1)
+        pipe.llen(key)
+        pipe.get(complete_key)
+        items, length, complete = pipe.execute()
+        if not length or (length < limit and complete != b'1'):
+            return None
+        exhaustive = complete == b'1' and length <= limit
+        return [json.loads(item) for item in items], exhaustive
+
+    def begin_fill(self, room_id):
+        return self.client.get(self._keys(room_id)[2])
+
+    def fill(self, room_id, messages, token, complete):
+        import redis
+
+        key, complete_key, seq_key = self._keys(room_id)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(seq_key)
+                if pipe.get(seq_key) != token:
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                if messages:
+                    pipe.rpush(key, *[json.dumps(m, default=str) for m in messages[-self.size:]])
+                pipe.set(complete_key, b'1' if complete else b'0', ex=self.ttl)
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def append(self, room_id, message):
+        key, complete_key, seq_key = self._keys(room_id)
+        pipe = self.client.pipeline()
+        pipe.incr(seq_key)
+        pipe.rpushx(key, json.dumps(message, default=str))
+        pipe.ltrim(key, -self.size, -1)
+        pipe.llen(key)
+        pipe.expire(seq_key, self.ttl)
+        _, _, _, length, _ = pipe.execute()
+        if length >= self.size:
+            self.client.set(complete_key, b'0', ex=self.ttl)
+
+    def invalidate(self, room_id):
+        key, complete_key, seq_key = self._keys(room_id)
+        pipe = self.client.pipeline()
+        pipe.incr(seq_key)
+        pipe.expire(seq_key, self.ttl)
+        pipe.delete(key, complete_key)
+        pipe.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter('chat:recent:*'):
+            self.client.delete(key)
+
+
+_recent_messages = None
+
+
+def get_recent_messages():
+    """Return the configured recent-message cache, or None when disabled."""
+    global _recent_messages
+    config = get_recent_messages_settings()
+    if not config['ENABLED']:
+        return None
+    if _recent_messages is None:
+        if config['REDIS_URL']:
+            _recent_messages = RedisRecentMessages(
+                config['REDIS_URL'], size=config['SIZE'], ttl=config['REDIS_TTL'],
+            )
+        else:
+            _recent_messages = LocalRecentMessages(
+                size=config['SIZE'], max_rooms=config['MAX_ROOMS'], max_bytes=config['MAX_BYTES'],
+                ttl=config['TTL'],
+            )
+    return _recent_messages
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import random
+import string
+import time
+from collections import deque
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelQueue:
+    """
+    The pending messages of one local channel, oldest first, each with its
+    expiry time, and the number of receivers waiting on them.
+    """
+
+    def __init__(self):
+        self.messages = deque()
+        self.receivers = 0
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def put(self, expires_at, message):
+        self.messages.append((expires_at, message))
+        self._ready.set()
+
+    async def get(self):
+        self.receivers += 1
+        try:
+            while not self.messages:
+                self._ready.clear()
+                await self._ready.wait()
+            return self.messages.popleft()[1]
+        finally:
+            self.receivers -= 1
+
+    def expire(self, now):
+        """Drop the messages that expired before ``now`` and return how many."""
+        expired = 0
+        while self.messages and self.messages[0][0] < now:
+            self.messages.popleft()
+            expired += 1
+        return expired
+
+
+class LocalFanoutChannelLayer(BaseChannelLayer):
+    """
+    Channel layer that delivers to consumers of this process in memory and
+    uses an inner layer (normally Redis) only to reach other processes.
+
+    The process subscribes a single worker channel to the inner layer for
+    every group that has local members, so a group send costs one inner
+    message per remote worker instead of one per member. Channels created by
+    this layer are ``<worker channel>.<token>``, which lets any process route
+    a direct send to the owning worker.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, inner, expiry=60, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        if isinstance(inner, dict):
+            inner = import_string(inner['BACKEND'])(**inner.get('CONFIG', {}))
+        self.inner = inner
+        self._reset()
+
+    def _reset(self):
+        self.worker_channel = None
+        self.channels = {}
+        self.groups = {}
+        self._loop = None
+        self._reader = None
+        self._start_lock = None
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self._ensure_started()
+
+        if self._is_local(channel):
+            self._put(channel, message)
+        elif '!' in channel and '.' in channel.rsplit('!', 1)[1]:
+            worker_channel = channel.rsplit('.', 1)[0]
+            await self.inner.send(worker_channel, {'__fanout_target__': channel, 'message': message})
+        else:
+            await self.inner.send(channel, message)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        await self._ensure_started()
+        self._clean_expired()
+
+        queue = self.channels.setdefault(channel, ChannelQueue())
+        try:
+            return await queue.get()
+        finally:
+            if not queue and not queue.receivers and self.channels.get(channel) is queue:
+                del self.channels[channel]
+
+    async def new_channel(self, prefix='specific.'):
+        await self._ensure_started()
+        token = ''.join(random.choice(string.ascii_letters) for _ in range(12))
+        return f'{self.worker_channel}.{token}'
+
+    async def flush(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        self._reset()
+        await self.inner.flush()
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self._ensure_started()
+        self.groups.setdefault(group, {})[channel] = time.time()
+        # Refresh the worker subscription on every join so it never expires
+        # while the group still has local members
+        await self.inner.group_add(group, self.worker_channel)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        members = self.groups.get(group)
+        if members is None:
+            return
+        members.pop(channel, None)
+        if not members:
+            del self.groups[group]
+            if self.worker_channel is not None:
+                await self.inner.group_discard(group, self.worker_channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Group name not valid'
+        await self._ensure_started()
+        self._deliver_to_group(group, message)
+        await self.inner.group_send(group, {
+            '__fanout_group__': group,
+            '__fanout_origin__': self.worker_channel,
+            'message': message,
+        })
+
+    # Local delivery
+
+    def _is_local(self, channel):
+        return self.worker_channel is not None and channel.startswith(self.worker_channel + '.')
+
+    def _put(self, channel, message):
+        queue = self.channels.setdefault(channel, ChannelQueue())
+        if len(queue) >= self.get_capacity(channel):
+            raise ChannelFull(channel)
+        queue.put(time.time() + self.expiry, dict(message))
+
+    def _deliver_to_group(self, group, message):
+        for channel in list(self.groups.get(group, ())):
+            try:
+                self._put(channel, message)
+            except ChannelFull:
+                pass
+
+    def _clean_expired(self):
+        now = time.time()
+        for channel, queue in list(self.channels.items()):
+            if not queue.expire(now):
+                continue
+            # A channel that lets messages expire has no consumer left
+            for members in self.groups.values():
+                members.pop(channel, None)
+            # Only a queue emptied by expiry goes; empty queues that
+            # receivers are waiting on stay where later messages find them
+            if not queue and not queue.receivers:
+                del self.channels[channel]
+
+    # Inner layer reader
+
+    async def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Queues and the reader task are bound to the loop that made them
+            if self._reader is not None:
+                self._reader.cancel()
+            self._reset()
+            self._loop = loop
+            self._start_lock = asyncio.Lock()
+        if self._reader is not None:
+            return
+        async with self._start_lock:
+            if self._reader is None:
+                self.worker_channel = await self.inner.new_channel(prefix='fanout.')
+                self._reader = asyncio.ensure_future(self._read_inner())
+
+    async def _read_inner(self):
+        while True:
+            try:
+                envelope = await self.inner.receive(self.worker_channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'Error receiving from inner channel layer: {str(e)}')
+                await asyncio.sleep(1)
+                continue
+
+            if '__fanout_group__' in envelope:
+                # Local members already got messages this worker sent itself
+                if envelope.get('__fanout_origin__') != self.worker_channel:
+                    self._deliver_to_group(envelope['__fanout_group__'], envelope['message'])
+            elif '__fanout_target__' in envelope:
+                try:
+                    self._put(envelope['__fanout_target__'], envelope['message'])
+                except ChannelFull:
+                    logger.warning(f"Dropping message for full channel {envelope['__fanout_target__']}")
@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from chat.archive import archive_room, get_archive_settings
+from chat.models import Message, MessageArchiveSegment
+
+
+class Command(BaseCommand):
+    help = (
+        'Move messages older than the retention period into compressed per-room '
+        'archive segments. Room history pagination keeps serving them; they are '
+        'no longer found by message search. Safe to run periodically.'
+    )
+
+    def add_arguments(self, parser):
+        config = get_archive_settings()
+        parser.add_argument('--older-than-days', type=int, default=config['RETENTION_DAYS'])
+        parser.add_argument('--segment-size', type=int, default=config['SEGMENT_SIZE'])
+        parser.add_argument('--room', type=int, action='append', dest='rooms', help='Only this room id (repeatable)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+
+    def handle(self, *args, **options):
+        if options['older_than_days'] < 1 or options['segment_size'] < 1:
+            raise CommandError('--older-than-days and --segment-size must be positive')
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        queryset = Message.objects.filter(created_at__lt=cutoff)
+        if options['rooms']:
+            queryset = queryset.filter(room_id__in=options['rooms'])
+        room_ids = list(queryset.order_by().values_list('room_id', flat=True).distinct())
+
+        if options['dry_run']:
+            self.stdout.write(f'{queryset.count()} messages in {len(room_ids)} rooms are older than {cutoff:%Y-%m-%d}')
+            return
+
+        started = time.perf_counter()
+        total = 0
+        for room_id in room_ids:
+            archived = archive_room(room_id, cutoff, options['segment_size'])
+            total += archived
+            self.stdout.write(f'room {room_id}: archived {archived} messages')
+
+        stored = MessageArchiveSegment.objects.aggregate(messages=Sum('message_count'), size=Sum(Length('data')))
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {total} messages from {len(room_ids)} rooms in {time.perf_counter() - started:.1f}s; '
+            f"the archive holds {stored['messages'] or 0} messages in {(stored['size'] or 0) / 1024:.0f} KiB"
+        ))
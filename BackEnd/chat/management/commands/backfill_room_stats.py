@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import Room
+from chat.room_stats import refresh_room_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the message count and last message of rooms from their '
+        'messages, e.g. after upgrading or bulk-loading messages.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rooms updated per transaction')
+        parser.add_argument('--room', type=int, action='append', dest='rooms', help='Only this room id (repeatable)')
+
+    def handle(self, *args, **options):
+        queryset = Room.objects.order_by('id')
+        if options['rooms']:
+            queryset = queryset.filter(id__in=options['rooms'])
+        room_ids = list(queryset.values_list('id', flat=True))
+
+        started = time.perf_counter()
+        batch_size = options['batch_size']
+        for start in range(0, len(room_ids), batch_size):
+            batch = room_ids[start:start + batch_size]
+            with transaction.atomic():
+                refresh_room_stats(batch)
+            self.stdout.write(f'{start + len(batch)}/{len(room_ids)} rooms')
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled stats of {len(room_ids)} rooms in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import threading
+import time
+
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from chat.metrics import percentile
+from chat.models import Message, Room, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Load the ASGI application with concurrent REST reads and WebSocket chat '
+        'traffic, once through the sync viewsets and once through the async read '
+        'endpoints. The benchmark user and room are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--http-clients', type=int, default=20)
+        parser.add_argument('--ws-clients', type=int, default=20)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per run')
+        parser.add_argument('--send-interval', type=float, default=0.2,
+                            help='Seconds between messages from each WebSocket client')
+        parser.add_argument('--messages', type=int, default=500, help='History to seed the room with')
+
+    def handle(self, *args, **options):
+        from chat_project.asgi import application
+
+        if User.objects.filter(username='bench_async_user').exists():
+            raise CommandError('bench_async_user already exists; remove it or finish the previous run')
+        user = User.objects.create(username='bench_async_user')
+        room = Room.objects.create(name='bench_async', created_by=user)
+        try:
+            Message.objects.bulk_create(
+                [Message(room=room, user=user, content=f'message {i}') for i in range(options['messages'])],
+                batch_size=5000,
+            )
+            token = str(RefreshToken.for_user(user).access_token)
+            paths = ['/api/rooms/', f'/api/rooms/{room.id}/', f'/api/messages/?room_id={room.id}', '/api/users/me/']
+
+            self.stdout.write(
+                f"{options['http_clients']} HTTP clients, {options['ws_clients']} WebSocket clients, "
+                f"{options['duration']:.0f}s per run"
+            )
+            self.stdout.write(
+                f"{'reads':<6} {'req/s':>8} {'p50':>9} {'p99':>9} {'ws sent/s':>10} {'ws recv/s':>10} "
+                f"{'connect p99':>12} {'peak threads':>13}"
+            )
+            for label, enabled in (('sync', False), ('async', True)):
+                with override_settings(CHAT_ASYNC_READ_API=enabled):
+                    result = asyncio.run(self.run(application, token, room, paths, options))
+                self.stdout.write(
+                    f"{label:<6} {result['requests'] / options['duration']:>8.1f} "
+                    f"{percentile(result['latencies'], 50):>7.1f}ms {percentile(result['latencies'], 99):>7.1f}ms "
+                    f"{result['sent'] / options['duration']:>10.1f} {result['received'] / options['duration']:>10.1f} "
+                    f"{percentile(result['connects'], 99):>10.1f}ms {result['threads']:>13}"
+                )
+        finally:
+            room.delete()
+            user.delete()
+
+    async def run(self, application, token, room, paths, options):
+        result = {'requests': 0, 'latencies': [], 'sent': 0, 'received': 0, 'connects': [], 'threads': 0}
+        deadline = time.perf_counter() + options['duration']
+
+        async def http_client(offset):
+            headers = [(b'authorization', f'Bearer {token}'.encode())]
+            i = offset
+            while time.perf_counter() < deadline:
+                path, _, query = paths[i % len(paths)].partition('?')
+                i += 1
+                started = time.perf_counter()
+                communicator = HttpCommunicator(application, 'GET', f'{path}?{query}' if query else path, headers=headers)
+                response = await communicator.get_response(timeout=30)
+                if response['status'] != 200:
+                    raise CommandError(f"GET {path} returned {response['status']}")
+                result['latencies'].append((time.perf_counter() - started) * 1000)
+                result['requests'] += 1
+
+        async def ws_client():
+            started = time.perf_counter()
+            communicator = WebsocketCommunicator(application, f'/ws/chat/{room.name}/?token={token}')
+            connected, _ = await communicator.connect(timeout=30)
+            if not connected:
+                raise CommandError('WebSocket connect was rejected')
+            result['connects'].append((time.perf_counter() - started) * 1000)
+
+            async def receive():
+                while True:
+                    frame = json.loads(await communicator.receive_from(timeout=30))
+                    result['received'] += len(frame) if isinstance(frame, list) else 1
+
+            receiver = asyncio.ensure_future(receive())
+            try:
+                while time.perf_counter() < deadline:
+                    await communicator.send_to(text_data=json.dumps({'type': 'chat_message', 'content': 'load'}))
+                    result['sent'] += 1
+                    await asyncio.sleep(options['send_interval'])
+            finally:
+                receiver.cancel()
+                await communicator.disconnect()
+
+        async def sample_threads():
+            while time.perf_counter() < deadline:
+                result['threads'] = max(result['threads'], threading.active_count())
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(
+            sample_threads(),
+            *[http_client(i) for i in range(options['http_clients'])],
+            *[ws_client() for _ in range(options['ws_clients'])],
+        )
+        result['latencies'].sort()
+        result['connects'].sort()
+        return result
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from chat.cache import user_cache
+from chat.models import User
+
+
+class Command(BaseCommand):
+    help = 'Measure authenticated API requests/sec with and without the user snapshot cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--path', default='/api/rooms/')
+        parser.add_argument('--username', help='User to authenticate as (defaults to the first user)')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['username']:
+            users = users.filter(username=options['username'])
+        user = users.order_by('id').first()
+        if user is None:
+            raise CommandError('No user to authenticate as; create one first')
+
+        token = str(RefreshToken.for_user(user).access_token)
+        client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        for label, enabled in (('uncached', False), ('cached', True)):
+            user_cache.clear()
+            with override_settings(CHAT_USER_CACHE_ENABLED=enabled):
+                rate, queries = self.run(client, options['path'], options['requests'])
+            self.stdout.write(f'{label:<9} {rate:10.1f} req/s  {queries:5.2f} queries/request')
+
+    def run(self, client, path, requests):
+        # Warm up URL resolution, serializers and the cache
+        response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(f'GET {path} returned {response.status_code}')
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(requests):
+                client.get(path)
+            elapsed = time.perf_counter() - started
+        return requests / elapsed, len(queries) / requests
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.consumers import ChatConsumer
+
+
+class Command(BaseCommand):
+    help = 'Compare CPU time per room broadcast for per-recipient and encode-once frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=1000)
+        parser.add_argument('--broadcasts', type=int, default=100)
+        parser.add_argument('--content-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        message = {
+            'id': 1,
+            'content': 'x' * options['content_size'],
+            'user': {'id': 1, 'username': 'bench'},
+            'timestamp': timezone.now().isoformat(),
+        }
+        legacy_event = {'type': 'chat_message', 'message': message}
+
+        results = asyncio.run(self.run(legacy_event, message, options['recipients'], options['broadcasts']))
+
+        self.stdout.write(f"{options['recipients']} recipients, {options['broadcasts']} broadcasts")
+        for label, cpu in results:
+            per_broadcast_ms = cpu / options['broadcasts'] * 1000
+            self.stdout.write(f'{label:<14} {per_broadcast_ms:8.3f} ms CPU per broadcast')
+        legacy_cpu, encoded_cpu = results[0][1], results[1][1]
+        if encoded_cpu:
+            self.stdout.write(self.style.SUCCESS(f'speedup        {legacy_cpu / encoded_cpu:8.2f}x'))
+
+    async def run(self, legacy_event, message, recipients, broadcasts):
+        consumers = []
+        for _ in range(recipients):
+            consumer = ChatConsumer()
+            consumer.send = self.discard
+            consumers.append(consumer)
+
+        results = []
+        for label, make_event in (
+            ('per-recipient', lambda: legacy_event),
+            ('encode-once', lambda: {'type': 'chat_message', 'id': message['id'], 'text': json.dumps(message)}),
+        ):
+            start = time.process_time()
+            for _ in range(broadcasts):
+                # The sender builds the event once; every recipient runs its handler
+                event = make_event()
+                for consumer in consumers:
+                    await consumer.chat_message(event)
+            results.append((label, time.process_time() - start))
+        return results
+
+    async def discard(self, text_data=None, bytes_data=None, close=False):
+        pass
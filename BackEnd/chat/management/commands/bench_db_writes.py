@@ -0,0 +1,90 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.db.backends.signals import connection_created
+
+from chat.cache import get_cached_user
+from chat.metrics import percentile
+from chat.models import Message, Room, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure chat message write throughput on the configured database profile '
+        '(CHAT_DB_PROFILE) with concurrent writer threads, each saving messages the '
+        'way ChatConsumer.save_message does. The benchmark user and room are deleted '
+        'afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--messages', type=int, default=500, help='Messages per writer')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username='bench_db_user').exists():
+            raise CommandError('bench_db_user already exists; remove it or finish the previous run')
+        user = User.objects.create(username='bench_db_user')
+        room = Room.objects.create(name='bench_db_writes', created_by=user)
+
+        opened = []
+        connection_created.connect(lambda sender, connection, **kwargs: opened.append(connection), weak=False,
+                                   dispatch_uid='bench_db_writes')
+        try:
+            self.describe()
+            latencies, errors = [], []
+            lock = threading.Lock()
+
+            def writer():
+                timings = []
+                try:
+                    for i in range(options['messages']):
+                        # One connection lifecycle per message, as on the chat DB executor
+                        close_old_connections()
+                        started = time.perf_counter()
+                        Message.objects.create(room_id=room.id, user=get_cached_user(user.id), content=f'write {i}')
+                        timings.append((time.perf_counter() - started) * 1000)
+                        close_old_connections()
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    connection.close()
+                    with lock:
+                        latencies.extend(timings)
+
+            threads = [threading.Thread(target=writer) for _ in range(options['writers'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            connection_created.disconnect(dispatch_uid='bench_db_writes')
+            room.delete()
+            user.delete()
+
+        latencies.sort()
+        self.stdout.write(
+            f"{len(latencies)} messages from {options['writers']} writers in {elapsed:.2f}s: "
+            f'{len(latencies) / elapsed:.1f} msg/s, p50 {percentile(latencies, 50):.2f}ms, '
+            f'p99 {percentile(latencies, 99):.2f}ms, {len(opened)} connections opened'
+        )
+        if errors:
+            raise CommandError(f'{len(errors)} writers failed, first error: {errors[0]}')
+
+    def describe(self):
+        database = settings.DATABASES['default']
+        line = f"profile {getattr(settings, 'CHAT_DB_PROFILE', 'sqlite')}: {connection.vendor}, CONN_MAX_AGE={database.get('CONN_MAX_AGE', 0)}"
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal_mode = cursor.fetchone()[0]
+                cursor.execute('PRAGMA synchronous')
+                synchronous = cursor.fetchone()[0]
+            line += f', journal_mode={journal_mode}, synchronous={synchronous}'
+        elif connection.vendor == 'postgresql':
+            line += f", CONN_HEALTH_CHECKS={database.get('CONN_HEALTH_CHECKS', False)}"
+        self.stdout.write(line)
@@ -0,0 +1,73 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from chat.metrics import percentile
+from chat.models import Message, Room, User
+from chat.pagination import BEFORE, encode_cursor
+from chat.views import MessageViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure message history page latency as a room grows. Data is seeded '
+        'inside a transaction that is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.factory = APIRequestFactory()
+        self.view = MessageViewSet.as_view({'get': 'list'})
+
+        with transaction.atomic():
+            self.user = User.objects.create(username='bench_history_user')
+            room = Room.objects.create(name='bench_history', created_by=self.user)
+            seeded = 0
+            start_at = timezone.now() - timedelta(days=365)
+
+            self.stdout.write(f"{'messages':>10} {'latest p50':>12} {'latest p99':>12} {'deep p50':>10} {'deep p99':>10}")
+            for size in sorted(options['sizes']):
+                Message.objects.bulk_create(
+                    [
+                        Message(room=room, user=self.user, content=f'message {i}',
+                                created_at=start_at + timedelta(seconds=i))
+                        for i in range(seeded, size)
+                    ],
+                    batch_size=5000,
+                )
+                seeded = size
+
+                middle = Message.objects.filter(room=room).order_by('created_at', 'id')[size // 2]
+                deep_cursor = encode_cursor(middle.created_at, middle.id, BEFORE)
+
+                latest = self.measure(room, None, options['page_size'], options['repeat'])
+                deep = self.measure(room, deep_cursor, options['page_size'], options['repeat'])
+                self.stdout.write(
+                    f'{size:>10} {percentile(latest, 50):>10.2f}ms {percentile(latest, 99):>10.2f}ms '
+                    f'{percentile(deep, 50):>8.2f}ms {percentile(deep, 99):>8.2f}ms'
+                )
+
+            transaction.set_rollback(True)
+
+    def measure(self, room, cursor, page_size, repeat):
+        params = {'room_id': room.id, 'page_size': page_size}
+        if cursor:
+            params['cursor'] = cursor
+        timings = []
+        for _ in range(repeat):
+            request = self.factory.get('/api/messages/', params)
+            force_authenticate(request, user=self.user)
+            started = time.perf_counter()
+            response = self.view(request)
+            response.render()
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.status_code
+        return sorted(timings)
@@ -0,0 +1,299 @@
+import gc
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from chat.cache import get_cached_user, room_password_cache, user_cache
+from chat.grants import get_room_password
+from chat.history_cache import get_recent_messages
+from chat.metrics import percentile
+from chat.models import Message, MessageArchiveSegment, Room, RoomReadMarker, User
+from chat.pagination import BEFORE, encode_cursor
+from chat.room_stats import refresh_room_stats
+
+PREFIX = 'bench_rest_'
+
+# Per endpoint: the most SQL queries a request may run, and the p99
+# latency it must stay under on the default dataset. Query budgets are
+# exact for the current code; latency budgets are about 20% over the
+# slowest p99 seen on SQLite and can be scaled with --latency-factor for
+# slower machines. The room list is not paginated and serializes every
+# room: p50 3.5-5s and p99 up to 6.2s for 10k rooms. Override either in
+# settings.CHAT_BENCH_REST_BUDGETS, e.g. {'rooms.list': {'p99_ms': 9000}}.
+BUDGETS = {
+    'rooms.list': {'queries': 2, 'p99_ms': 7500},
+    'rooms.list.activity': {'queries': 2, 'p99_ms': 7500},
+    'rooms.retrieve': {'queries': 2, 'p99_ms': 50},
+    'rooms.unread': {'queries': 1, 'p99_ms': 500},
+    'rooms.read': {'queries': 1, 'p99_ms': 50},
+    'messages.latest': {'queries': 2, 'p99_ms': 50},
+    'messages.deep': {'queries': 2, 'p99_ms': 50},
+    'messages.search': {'queries': 2, 'p99_ms': 250},
+    'users.me': {'queries': 1, 'p99_ms': 25},
+}
+
+
+def get_budgets():
+    budgets = {name: dict(budget) for name, budget in BUDGETS.items()}
+    for name, budget in getattr(settings, 'CHAT_BENCH_REST_BUDGETS', {}).items():
+        budgets.setdefault(name, {}).update(budget)
+    return budgets
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a large dataset (users, rooms and messages named bench_rest_*) into '
+        'the configured database and measure latency and SQL query count of the '
+        'RoomViewSet, MessageViewSet and UserViewSet.me endpoints through the full '
+        'middleware stack. Fails when an endpoint exceeds its query or latency '
+        'budget (see BUDGETS). Seeded data is kept for the next run, which only '
+        'tops it up; --flush removes it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--rooms', type=int, default=10000)
+        parser.add_argument('--messages', type=int, default=5000000)
+        parser.add_argument('--password-rooms', type=float, default=0.1, help='Share of password-protected rooms')
+        parser.add_argument('--repeat', type=int, default=30, help='Measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=3, help='Unmeasured requests per endpoint first')
+        parser.add_argument('--endpoints', nargs='+', choices=sorted(BUDGETS), help='Only measure these')
+        parser.add_argument('--latency-factor', type=float, default=1.0, help='Scale every latency budget')
+        parser.add_argument('--async-reads', action='store_true',
+                            help='Serve GETs through the async read endpoints instead of the viewsets')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated data')
+        parser.add_argument('--flush', action='store_true', help='Delete the seeded data and exit')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            self.flush()
+            return
+        self.random = random.Random(options['seed'])
+        self.seed(options)
+
+        user = User.objects.get(username=f'{PREFIX}user_0')
+        self.user_id = user.id
+        self.client = Client(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        endpoints = self.endpoints()
+        if options['endpoints']:
+            endpoints = [endpoint for endpoint in endpoints if endpoint[0] in options['endpoints']]
+        budgets = get_budgets()
+
+        self.stdout.write(
+            f"{Room.objects.count()} rooms, {Message.objects.count()} messages, {User.objects.count()} users; "
+            f"{'async' if options['async_reads'] else 'viewset'} reads"
+        )
+        self.stdout.write(
+            f"{'endpoint':<20} {'queries':>8} {'budget':>7} {'p50':>10} {'p99':>10} {'budget':>10}  result"
+        )
+        failures = []
+        with override_settings(CHAT_ASYNC_READ_API=options['async_reads']):
+            for name, method, path, data in endpoints:
+                queries, timings = self.measure(method, path, data, options['warmup'], options['repeat'])
+                budget = budgets.get(name, {})
+                query_budget = budget.get('queries')
+                latency_budget = budget['p99_ms'] * options['latency_factor'] if 'p99_ms' in budget else None
+                p99 = percentile(timings, 99)
+                problems = []
+                if query_budget is not None and queries > query_budget:
+                    problems.append(f'{queries} queries > {query_budget}')
+                if latency_budget is not None and p99 > latency_budget:
+                    problems.append(f'p99 {p99:.1f}ms > {latency_budget:.0f}ms')
+                failures.extend(f'{name}: {problem}' for problem in problems)
+                self.stdout.write(
+                    f"{name:<20} {queries:>8} {query_budget if query_budget is not None else '-':>7} "
+                    f"{percentile(timings, 50):>8.1f}ms {p99:>8.1f}ms "
+                    f"{f'{latency_budget:.0f}ms' if latency_budget is not None else '-':>10}  "
+                    + (self.style.ERROR('over budget') if problems else self.style.SUCCESS('ok'))
+                )
+        if failures:
+            raise CommandError('Endpoints over budget:\n  ' + '\n  '.join(failures))
+
+    def endpoints(self):
+        # The busiest open room, and a cursor halfway back through its history
+        room = Room.objects.filter(name__startswith=PREFIX, password__isnull=True).order_by('-message_count').first()
+        self.room_id = room.id
+        middle = Message.objects.filter(room=room).order_by('-created_at', '-id')[room.message_count // 2]
+        word = Message.objects.filter(room=room).order_by('-created_at', '-id')[10].content.split()[-1]
+        return [
+            ('rooms.list', 'get', '/api/rooms/', None),
+            ('rooms.list.activity', 'get', '/api/rooms/', {'ordering': 'activity'}),
+            ('rooms.retrieve', 'get', f'/api/rooms/{room.id}/', None),
+            ('rooms.unread', 'get', '/api/rooms/unread/', None),
+            ('rooms.read', 'post', f'/api/rooms/{room.id}/read/', None),
+            ('messages.latest', 'get', '/api/messages/', {'room_id': room.id}),
+            ('messages.deep', 'get', '/api/messages/', {
+                'room_id': room.id, 'cursor': encode_cursor(middle.created_at, middle.id, BEFORE),
+            }),
+            ('messages.search', 'get', '/api/messages/search/', {'q': word, 'room_id': room.id}),
+            ('users.me', 'get', '/api/users/me/', None),
+        ]
+
+    def measure(self, method, path, data, warmup, repeat):
+        """Return the most queries any measured request ran, and sorted latencies."""
+        queries = 0
+        timings = []
+        for i in range(warmup + repeat):
+            # Don't charge a request for earlier requests' garbage: with 30
+            # samples, one collection pause would be the p99
+            gc.collect()
+            self.warm_caches()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = getattr(self.client, method)(path, data)
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code >= 400:
+                raise CommandError(f'{method.upper()} {path} returned {response.status_code}: {response.content[:200]!r}')
+            if i >= warmup:
+                queries = max(queries, len(captured))
+                timings.append(elapsed)
+        return queries, sorted(timings)
+
+    def warm_caches(self):
+        # The user snapshot and room password caches expire (CHAT_USER_CACHE_TTL,
+        # CHAT_ROOM_CACHE_TTL) during slow endpoints, and a hit does not renew
+        # an entry; refill both before every request so a refill is never
+        # charged to the endpoint
+        user_cache.discard(self.user_id)
+        room_password_cache.discard(self.room_id)
+        get_cached_user(self.user_id)
+        get_room_password(self.room_id)
+
+    def seed(self, options):
+        started = time.perf_counter()
+        users = self.seed_users(options['users'])
+        rooms = self.seed_rooms(options['rooms'], users, options['password_rooms'])
+        added = self.seed_messages(options['messages'], rooms, users)
+        if added:
+            self.stdout.write('Updating room stats...')
+            room_ids = sorted(rooms)
+            for start in range(0, len(room_ids), 500):
+                refresh_room_stats(room_ids[start:start + 500])
+            recent_messages = get_recent_messages()
+            if recent_messages is not None:
+                for room_id in room_ids:
+                    recent_messages.invalidate(room_id)
+        self.seed_read_markers(users[0], rooms)
+        self.stdout.write(f'Dataset ready in {time.perf_counter() - started:.1f}s')
+
+    def seed_users(self, total):
+        existing = User.objects.filter(username__startswith=f'{PREFIX}user_').count()
+        if existing < total:
+            self.stdout.write(f'Seeding {total - existing} users...')
+            # One slow hash shared by every seeded user
+            password = make_password('bench-rest-password')
+            group = Group.objects.get_or_create(name='user')[0]
+            for start in range(existing, total, 5000):
+                with transaction.atomic():
+                    created = User.objects.bulk_create([
+                        User(username=f'{PREFIX}user_{i}', password=password, name=f'Bench user {i}')
+                        for i in range(start, min(start + 5000, total))
+                    ])
+                    if created and created[0].pk is None:
+                        created = User.objects.filter(username__in=[user.username for user in created])
+                    User.groups.through.objects.bulk_create([
+                        User.groups.through(user_id=user.pk, group_id=group.id) for user in created
+                    ])
+        return list(User.objects.filter(username__startswith=f'{PREFIX}user_').order_by('id').values_list('id', flat=True))
+
+    def seed_rooms(self, total, users, password_share):
+        existing = Room.objects.filter(name__startswith=f'{PREFIX}room_').count()
+        if existing < total:
+            self.stdout.write(f'Seeding {total - existing} rooms...')
+            password = make_password('bench-rest-room')
+            for start in range(existing, total, 5000):
+                Room.objects.bulk_create([
+                    Room(
+                        name=f'{PREFIX}room_{i}',
+                        created_by_id=self.random.choice(users),
+                        # The busiest room (room 0) stays open for the measurements
+                        password=password if i and self.random.random() < password_share else None,
+                    )
+                    for i in range(start, min(start + 5000, total))
+                ])
+        return list(Room.objects.filter(name__startswith=f'{PREFIX}room_').order_by('id').values_list('id', flat=True))
+
+    def seed_messages(self, total, rooms, users):
+        existing = Message.objects.filter(room_id__in=Room.objects.filter(name__startswith=PREFIX)).count()
+        if existing >= total:
+            return 0
+        self.stdout.write(f'Seeding {total - existing} messages...')
+        # Skewed towards the first rooms, as real traffic is: room 0 gets the
+        # most messages. Timestamps climb evenly over the last year.
+        adapt = connection.ops.adapt_datetimefield_value
+        start_at = timezone.now() - timedelta(days=365)
+        step = timedelta(days=365) / total
+        words = ['hello', 'meeting', 'deploy', 'lunch', 'review', 'release', 'coffee', 'weekend', 'ticket', 'build']
+        started = time.perf_counter()
+        for start in range(existing, total, 10000):
+            rows = [
+                (
+                    rooms[int(len(rooms) * self.random.random() ** 3)],
+                    self.random.choice(users),
+                    f'message {i} about {self.random.choice(words)} {self.random.choice(words)}',
+                    adapt(start_at + step * i),
+                )
+                for i in range(start, min(start + 10000, total))
+            ]
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {Message._meta.db_table} (room_id, user_id, content, created_at) VALUES (%s, %s, %s, %s)',
+                    rows,
+                )
+            done = start + len(rows)
+            if done % 500000 < 10000 or done == total:
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'{done} messages, {(done - existing) / elapsed:.0f}/s')
+        return total - existing
+
+    def seed_read_markers(self, user_id, rooms):
+        # The measuring user has read half of the rooms, so unread counts join both ways
+        if RoomReadMarker.objects.filter(user_id=user_id).exists():
+            return
+        seqs = dict(Room.objects.filter(id__in=rooms[::2]).values_list('id', 'message_seq'))
+        RoomReadMarker.objects.bulk_create([
+            RoomReadMarker(user_id=user_id, room_id=room_id, read_seq=seq // 2) for room_id, seq in seqs.items()
+        ], batch_size=5000)
+
+    def flush(self):
+        room_ids = list(Room.objects.filter(name__startswith=PREFIX).values_list('id', flat=True))
+        self.stdout.write(f'Deleting {len(room_ids)} rooms and their messages...')
+        for start in range(0, len(room_ids), 500):
+            chunk = room_ids[start:start + 500]
+            with transaction.atomic():
+                for model in (Message, MessageArchiveSegment, RoomReadMarker):
+                    self.delete_rows(model, 'room', chunk)
+                Room.objects.filter(id__in=chunk).delete()
+        users = User.objects.filter(username__startswith=PREFIX)
+        self.stdout.write(f'Deleting {users.count()} users...')
+        for start in range(0, users.count(), 5000):
+            user_ids = list(users.order_by('id').values_list('id', flat=True)[:5000])
+            with transaction.atomic():
+                self.delete_rows(Message, 'user', user_ids)
+                User.objects.filter(id__in=user_ids).delete()
+        recent_messages = get_recent_messages()
+        if recent_messages is not None:
+            for room_id in room_ids:
+                recent_messages.invalidate(room_id)
+        self.stdout.write(self.style.SUCCESS('Benchmark data removed'))
+
+    def delete_rows(self, model, field, ids):
+        # Plain SQL: QuerySet.delete() collects every row for signals and
+        # cascades, and millions of messages would not fit in memory
+        column = connection.ops.quote_name(model._meta.get_field(field).column)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)} "
+                f"WHERE {column} IN ({', '.join(['%s'] * len(ids))})",
+                ids,
+            )
@@ -0,0 +1,71 @@
+import itertools
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from chat.metrics import percentile
+from chat.models import Message, Room, User
+from chat.search import search_messages
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure full-text message search latency on a seeded table. Data is '
+        'seeded inside a transaction that is rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000000)
+        parser.add_argument('--rooms', type=int, default=100)
+        parser.add_argument('--vocabulary', type=int, default=50000, help='Distinct words to draw content from')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        # Zipf-like word frequencies, as in real chat: a few very common words
+        # and a long tail of rare ones
+        words = [f'w{i}' for i in range(options['vocabulary'])]
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+
+        with transaction.atomic():
+            user = User.objects.create(username='bench_search_user')
+            rooms = [Room.objects.create(name=f'bench_search_{i}', created_by=user) for i in range(options['rooms'])]
+            started = time.perf_counter()
+            now = timezone.now()
+            batch = []
+            for i in range(options['messages']):
+                content = ' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 15)))
+                batch.append(Message(room=rooms[i % len(rooms)], user=user, content=content, created_at=now))
+                if len(batch) == 10000:
+                    Message.objects.bulk_create(batch)
+                    batch = []
+            Message.objects.bulk_create(batch)
+            self.stdout.write(f"Seeded {options['messages']} messages in {time.perf_counter() - started:.1f}s")
+
+            queries = [
+                ('common word', words[0], None),
+                ('mid word', words[100], None),
+                ('rare word', words[-1], None),
+                ('two words', f'{words[5]} {words[50]}', None),
+                ('prefix', 'w123', None),
+                ('short prefix', 'w1', None),
+                ('common, one room', words[0], rooms[0].id),
+                ('rare, one room', words[-1], rooms[0].id),
+            ]
+            self.stdout.write(f"{'query':<18} {'p50':>9} {'p99':>9} {'hits':>5}")
+            for label, text, room_id in queries:
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    hits, _ = search_messages(text, room_id=room_id, limit=options['page_size'] + 1)
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                self.stdout.write(
+                    f'{label:<18} {percentile(timings, 50):>7.2f}ms {percentile(timings, 99):>7.2f}ms {len(hits):>5}'
+                )
+
+            transaction.set_rollback(True)
@@ -0,0 +1,404 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse
+
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from chat.metrics import percentile, registry
+from chat.models import Room, User
+from chat.persistence import get_write_behind_settings
+from chat.outbound import get_batching_settings
+
+ROOM_PREFIX = 'bench_ws_'
+IN_MEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def rss_bytes(pid='self'):
+    """Resident memory of a process from /proc, or None where unavailable."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class InProcessClient:
+    """A WebSocket client talking to the ASGI application in this process."""
+
+    def __init__(self, application, path):
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self, timeout):
+        connected, code = await self.communicator.connect(timeout=timeout)
+        if not connected:
+            raise ConnectionRefusedError(f'closed with {code}')
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def receive(self):
+        while True:
+            try:
+                return await self.communicator.receive_from(timeout=60)
+            except asyncio.TimeoutError:
+                continue
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+    def buffered(self):
+        # Frames the application sent that this client hasn't read
+        return self.communicator.output_queue.qsize()
+
+
+_protocol_class = None
+
+
+def autobahn_protocol():
+    global _protocol_class
+    if _protocol_class is None:
+        from autobahn.asyncio.websocket import WebSocketClientProtocol
+
+        class Protocol(WebSocketClientProtocol):
+            def onOpen(self):
+                if not self.client.opened.done():
+                    self.client.opened.set_result(None)
+
+            def onMessage(self, payload, is_binary):
+                self.client.frames.put_nowait(payload.decode())
+
+            def onClose(self, was_clean, code, reason):
+                if not self.client.opened.done():
+                    self.client.opened.set_exception(ConnectionRefusedError(f'closed with {code}'))
+                self.client.frames.put_nowait(None)
+
+        _protocol_class = Protocol
+    return _protocol_class
+
+
+class ServerClient:
+    """A WebSocket client talking to a running server (e.g. Daphne) over TCP."""
+
+    def __init__(self, base_url, path):
+        self.url = base_url.rstrip('/') + path
+        self.protocol = None
+
+    async def connect(self, timeout):
+        from autobahn.asyncio.websocket import WebSocketClientFactory
+
+        loop = asyncio.get_running_loop()
+        self.opened = loop.create_future()
+        self.frames = asyncio.Queue()
+        factory = WebSocketClientFactory(self.url)
+        protocol_class = autobahn_protocol()
+        client = self
+
+        def build():
+            protocol = protocol_class()
+            protocol.factory = factory
+            protocol.client = client
+            return protocol
+
+        parsed = urlparse(self.url)
+        _, self.protocol = await asyncio.wait_for(
+            loop.create_connection(build, parsed.hostname, parsed.port or 80), timeout,
+        )
+        await asyncio.wait_for(self.opened, timeout)
+
+    async def send(self, text):
+        self.protocol.sendMessage(text.encode())
+
+    async def receive(self):
+        frame = await self.frames.get()
+        if frame is None:
+            raise ConnectionError('connection closed')
+        return frame
+
+    def buffered(self):
+        # Held in the server's and the kernel's buffers, not visible here
+        return None
+
+    async def close(self):
+        if self.protocol is not None:
+            self.protocol.sendClose(code=1000)
+            await asyncio.sleep(0)
+            self.protocol.transport.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Load ChatConsumer with many rooms and clients and report connect latency, '
+        'end-to-end delivery latency, message rates and memory per connection. '
+        'Scenarios: connect-storm (everyone connects at once), steady (chat traffic '
+        'spread over --rooms rooms) and hot-room (one crowded room). Runs in '
+        'process on the in-memory channel layer by default, or against a running '
+        'server with --url, or a Daphne started for the run with --spawn-daphne. '
+        'Clients acknowledge the frames they receive (?ack=1) unless --no-acks is '
+        'given; --stalled adds clients to the hot room that never read, to measure '
+        'the send queue\'s slow-consumer policy. '
+        'Memory per connection is the growth in resident memory of the serving '
+        'process while connecting, so scenarios after the first reuse freed memory '
+        'and read low; run one scenario at a time for that figure. Benchmark rooms '
+        'and the benchmark user are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', choices=('connect-storm', 'steady', 'hot-room', 'all'), default='all')
+        parser.add_argument('--rooms', type=int, default=10)
+        parser.add_argument('--clients', type=int, default=20, help='Clients per room in the steady scenario')
+        parser.add_argument('--storm-clients', type=int, default=1000, help='Connections opened at once in connect-storm')
+        parser.add_argument('--hot-clients', type=int, default=500, help='Clients in the hot room')
+        parser.add_argument('--senders', type=int, default=2, help='Sending clients per room')
+        parser.add_argument('--stalled', type=int, default=0, help='Hot-room clients that never read or ack')
+        parser.add_argument('--no-acks', action='store_true', help="Don't acknowledge frames (no send queue)")
+        parser.add_argument('--rate', type=float, default=2.0, help='Messages per second from each sender')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of traffic per scenario')
+        parser.add_argument('--connect-timeout', type=float, default=30.0)
+        parser.add_argument('--layer', choices=('memory', 'configured'), default='memory',
+                            help='Channel layer for in-process and spawned runs')
+        target = parser.add_mutually_exclusive_group()
+        target.add_argument('--url', help='Base URL of a running server, e.g. ws://127.0.0.1:8003')
+        target.add_argument('--spawn-daphne', type=int, metavar='PORT', help='Start Daphne on this port for the run')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username='bench_ws_user').exists():
+            raise CommandError('bench_ws_user already exists; remove it or finish the previous run')
+        user = User.objects.create(username='bench_ws_user')
+        self.token = str(RefreshToken.for_user(user).access_token)
+        self.options = options
+        self.server = None
+        chat_logger = logging.getLogger('chat')
+        log_level = chat_logger.level
+        if options['verbosity'] < 2:
+            # Per-connection log lines would dominate an in-process run
+            chat_logger.setLevel(logging.WARNING)
+        try:
+            if options['spawn_daphne']:
+                self.server = self.start_daphne(options['spawn_daphne'])
+                self.base_url = f"ws://127.0.0.1:{options['spawn_daphne']}"
+                self.run_scenarios()
+            elif options['url']:
+                self.base_url = options['url']
+                self.run_scenarios()
+            elif options['layer'] == 'memory':
+                with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS):
+                    self.run_scenarios()
+            else:
+                self.run_scenarios()
+        finally:
+            if self.server is not None:
+                self.server.terminate()
+                self.server.wait(timeout=10)
+            Room.objects.filter(name__startswith=ROOM_PREFIX).delete()
+            user.delete()
+            chat_logger.setLevel(log_level)
+
+    def start_daphne(self, port):
+        env = dict(os.environ)
+        if self.options['layer'] == 'memory':
+            env['CHAT_CHANNEL_LAYER'] = 'memory'
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(port), 'chat_project.asgi:application'],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'Daphne exited with code {server.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'Daphne did not listen on port {port} within 30s')
+
+    def run_scenarios(self):
+        from chat_project.asgi import application
+
+        self.application = application
+        options = self.options
+        self.describe()
+        self.stdout.write(
+            f"{'scenario':<14} {'conns':>6} {'failed':>6} {'conn/s':>8} {'conn p50':>9} {'conn p99':>9} "
+            f"{'sent/s':>8} {'recv/s':>9} {'e2e p50':>9} {'e2e p99':>9} {'KiB/conn':>9} {'errors':>6}"
+        )
+        if options['scenario'] in ('connect-storm', 'all'):
+            rooms = max(1, options['rooms'])
+            per_room = [options['storm_clients'] // rooms + (i < options['storm_clients'] % rooms) for i in range(rooms)]
+            self.report('connect-storm', asyncio.run(self.run([(f'{ROOM_PREFIX}storm_{i}', n, 0) for i, n in enumerate(per_room)], 0)))
+        if options['scenario'] in ('steady', 'all'):
+            layout = [(f'{ROOM_PREFIX}steady_{i}', options['clients'], options['senders']) for i in range(options['rooms'])]
+            self.report('steady', asyncio.run(self.run(layout, options['duration'])))
+        if options['scenario'] in ('hot-room', 'all'):
+            layout = [(f'{ROOM_PREFIX}hot', options['hot_clients'], options['senders'])]
+            self.report('hot-room', asyncio.run(self.run(layout, options['duration'], options['stalled'])))
+
+    def describe(self):
+        if self.server is not None:
+            target = f'Daphne pid {self.server.pid} at {self.base_url}'
+        elif self.options['url']:
+            target = self.options['url']
+        else:
+            target = 'in process'
+        layer = settings.CHANNEL_LAYERS['default']['BACKEND'].rsplit('.', 1)[-1]
+        self.stdout.write(
+            f"target: {target}, layer: {self.options['layer'] if not self.options['url'] else 'server'} ({layer} configured here), "
+            f"write-behind: {get_write_behind_settings()['ENABLED']}, batching: {get_batching_settings()['ENABLED']}"
+        )
+
+    def client(self, room_name):
+        path = f'/ws/chat/{room_name}/?token={self.token}' + ('' if self.options['no_acks'] else '&ack=1')
+        if self.options['url'] or self.server is not None:
+            return ServerClient(self.base_url, path)
+        return InProcessClient(self.application, path)
+
+    async def run(self, layout, duration, stalled=0):
+        """
+        Connect every client of ``layout`` (``(room, clients, senders)``)
+        at once, then have the senders of each room chat for ``duration``
+        seconds while every client measures delivery latency. ``stalled``
+        more clients join the first room and never read.
+        """
+        result = {'connects': [], 'failed': 0, 'sent': 0, 'received': 0, 'latencies': [], 'errors': 0}
+        drops_before = registry.counter('ws.send_queue.dropped').value
+        disconnects_before = registry.counter('ws.send_queue.slow_disconnects').value
+        memory_pid = self.server.pid if self.server is not None else ('self' if not self.options['url'] else None)
+        memory_before = rss_bytes(memory_pid) if memory_pid else None
+
+        async def connect(room_name):
+            client = self.client(room_name)
+            started = time.perf_counter()
+            try:
+                await client.connect(self.options['connect_timeout'])
+            except (ConnectionError, OSError, asyncio.TimeoutError):
+                result['failed'] += 1
+                return None
+            result['connects'].append((time.perf_counter() - started) * 1000)
+            return client
+
+        # The first client creates each room, as in real use; the rest storm in
+        for room_name, _, _ in layout:
+            first = await connect(room_name)
+            if first is not None:
+                await first.close()
+        result['connects'].clear()
+        result['failed'] = 0
+        started = time.perf_counter()
+        rooms = await asyncio.gather(*[
+            asyncio.gather(*[connect(room_name) for _ in range(clients)]) for room_name, clients, _ in layout
+        ])
+        connect_elapsed = time.perf_counter() - started
+        connected = [[client for client in clients if client is not None] for clients in rooms]
+        stalled_clients = [
+            client for client in await asyncio.gather(*[connect(layout[0][0]) for _ in range(stalled)])
+            if client is not None
+        ]
+        memory_after = rss_bytes(memory_pid) if memory_pid else None
+        total = sum(len(clients) for clients in connected)
+        result['connect_rate'] = len(result['connects']) / connect_elapsed if connect_elapsed else 0
+        if memory_before is not None and memory_after is not None and total:
+            result['memory_per_connection'] = (memory_after - memory_before) / total
+        result['connections'] = total
+
+        receivers = [asyncio.ensure_future(self.receive(client, result)) for clients in connected for client in clients]
+        if duration:
+            deadline = time.perf_counter() + duration
+            await asyncio.gather(*[
+                self.chat(client, deadline, result)
+                for clients, (_, _, senders) in zip(connected, layout)
+                for client in clients[:senders]
+            ])
+            # Let the last messages arrive
+            await asyncio.sleep(1)
+        for receiver in receivers:
+            receiver.cancel()
+        if stalled_clients:
+            buffered = [client.buffered() for client in stalled_clients]
+            result['stalled'] = {
+                'clients': len(stalled_clients),
+                'buffered': max(buffered) if None not in buffered else None,
+                # Counted in this process only
+                'dropped': registry.counter('ws.send_queue.dropped').value - drops_before,
+                'disconnects': registry.counter('ws.send_queue.slow_disconnects').value - disconnects_before,
+            }
+        await asyncio.gather(
+            *[client.close() for clients in connected for client in clients],
+            *[client.close() for client in stalled_clients],
+            return_exceptions=True,
+        )
+        result['duration'] = duration
+        result['connects'].sort()
+        result['latencies'].sort()
+        return result
+
+    async def chat(self, client, deadline, result):
+        interval = 1 / self.options['rate']
+        await asyncio.sleep(random.random() * interval)
+        while time.perf_counter() < deadline:
+            # The send time travels in the content, read by every receiver
+            content = f'bench {time.perf_counter_ns()}'
+            await client.send(json.dumps({'type': 'chat_message', 'content': content}))
+            result['sent'] += 1
+            await asyncio.sleep(interval)
+
+    async def receive(self, client, result):
+        frames = 0
+        try:
+            while True:
+                frame = json.loads(await client.receive())
+                now = time.perf_counter_ns()
+                frames += 1
+                if frames % 20 == 0 and not self.options['no_acks']:
+                    await client.send(json.dumps({'type': 'ack', 'frames': frames}))
+                for message in frame if isinstance(frame, list) else [frame]:
+                    if message.get('type') in ('error', 'resync'):
+                        result['errors'] += 1
+                    content = message.get('content', '')
+                    if content.startswith('bench '):
+                        result['received'] += 1
+                        result['latencies'].append((now - int(content[6:])) / 1e6)
+        except asyncio.CancelledError:
+            pass
+        except ConnectionError:
+            result['errors'] += 1
+
+    def report(self, label, result):
+        duration = result['duration']
+
+        def rate(count):
+            return f'{count / duration:>8.1f}' if duration else f"{'-':>8}"
+
+        def ms(values, pct):
+            return f'{percentile(values, pct):>7.1f}ms' if values else f"{'-':>9}"
+
+        memory = result.get('memory_per_connection')
+        self.stdout.write(
+            f"{label:<14} {result['connections']:>6} {result['failed']:>6} {result['connect_rate']:>8.1f} "
+            f"{ms(result['connects'], 50)} {ms(result['connects'], 99)} {rate(result['sent'])} "
+            f"{rate(result['received']):>9} {ms(result['latencies'], 50)} {ms(result['latencies'], 99)} "
+            f"{(f'{memory / 1024:>9.1f}' if memory is not None else f'{chr(45):>9}')} {result['errors']:>6}"
+        )
+        stalled = result.get('stalled')
+        if stalled:
+            buffered = stalled['buffered'] if stalled['buffered'] is not None else 'unknown'
+            counters = '' if self.options['url'] or self.server is not None else (
+                f", {stalled['dropped']} frames dropped, {stalled['disconnects']} slow consumers disconnected"
+            )
+            self.stdout.write(
+                f"  {stalled['clients']} stalled clients: up to {buffered} frames buffered for one{counters}"
+            )
@@ -0,0 +1,57 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import NotFound
+
+from chat.export import export_rows, ndjson_chunks
+from chat.models import Room
+from chat.pagination import AFTER, decode_cursor
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream the full history of a room, archived messages included, as NDJSON '
+        'with constant memory use. Every line carries the cursor to resume after it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('room', help='Room id or name')
+        parser.add_argument('--output', '-o', default='-', help='File to write, - for stdout')
+        parser.add_argument('--gzip', action='store_true', help='Gzip-compress the output')
+        parser.add_argument('--cursor', help='Resume after the line carrying this cursor')
+
+    def handle(self, *args, **options):
+        lookup = {'id': int(options['room'])} if options['room'].isdigit() else {'name': options['room']}
+        room = Room.objects.filter(**lookup).first()
+        if room is None:
+            raise CommandError(f"Room {options['room']} does not exist")
+
+        position = None
+        if options['cursor']:
+            try:
+                created_at, pk, direction = decode_cursor(options['cursor'])
+            except NotFound:
+                direction = None
+            if direction != AFTER:
+                raise CommandError('Invalid cursor')
+            position = (created_at, pk)
+
+        rows = 0
+
+        def counted(iterable):
+            nonlocal rows
+            for row in iterable:
+                rows += 1
+                yield row
+
+        started = time.perf_counter()
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'ab' if position else 'wb')
+        try:
+            for chunk in ndjson_chunks(counted(export_rows(room.id, position)), compress=options['gzip']):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        elapsed = time.perf_counter() - started
+        self.stderr.write(f'Exported {rows} messages of room {room.id} in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)')
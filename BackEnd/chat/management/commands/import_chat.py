@@ -0,0 +1,284 @@
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from chat.history_cache import get_recent_messages
+from chat.models import Message, Room, User
+from chat.room_stats import refresh_room_stats
+
+KINDS = ('user', 'room', 'message')
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-import users, rooms and messages from NDJSON or CSV, streamed and '
+        'inserted in batches. NDJSON lines name their kind with "type" (user, room, '
+        'message); lines without one are messages, so export_chat output can be '
+        'imported as is. Users and rooms are referenced by username and room name.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Input file (.ndjson, .jsonl or .csv, optionally .gz), - for stdin')
+        parser.add_argument('--format', choices=('ndjson', 'csv'), help='Defaults to the file extension')
+        parser.add_argument('--kind', choices=KINDS, help='Record kind of every CSV row')
+        parser.add_argument('--room', help='Put every message into this room, e.g. for export_chat output')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--create-missing', action='store_true',
+                            help='Create users and rooms that messages refer to but that do not exist')
+        parser.add_argument('--hash-workers', type=int, default=4,
+                            help='Threads hashing raw_password values; precomputed password hashes are stored as is')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('csv' if options['path'].removesuffix('.gz').endswith('.csv') else 'ndjson')
+        if fmt == 'csv' and not options['kind']:
+            raise CommandError('CSV input needs --kind')
+        self.batch_size = options['batch_size']
+        self.create_missing = options['create_missing']
+        self.default_room = options['room']
+        self.hasher = ThreadPoolExecutor(max_workers=options['hash_workers'])
+
+        # Foreign keys are resolved through these maps, never per row
+        self.user_ids = dict(User.objects.values_list('username', 'id'))
+        self.room_ids = dict(Room.objects.values_list('name', 'id'))
+        self.user_group = Group.objects.get_or_create(name='user')[0]
+        self.pending = {kind: [] for kind in KINDS}
+        self.counts = {kind: 0 for kind in KINDS}
+        self.skipped = 0
+        self.touched_rooms = set()
+
+        started = time.perf_counter()
+        stream = self.open(options['path'])
+        try:
+            for line_number, record in enumerate(self.records(stream, fmt, options['kind']), start=1):
+                try:
+                    self.add(self.parse(record))
+                except (KeyError, TypeError, ValueError) as e:
+                    self.skip(f'record {line_number}: {e!r}')
+                if line_number % 100000 == 0:
+                    self.report(started, line_number)
+            self.flush_all()
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            self.hasher.shutdown()
+
+        self.stdout.write('Updating room stats...')
+        room_ids = sorted(self.touched_rooms)
+        for start in range(0, len(room_ids), 500):
+            refresh_room_stats(room_ids[start:start + 500])
+        recent_messages = get_recent_messages()
+        if recent_messages is not None:
+            for room_id in room_ids:
+                recent_messages.invalidate(room_id)
+
+        elapsed = time.perf_counter() - started
+        total = sum(self.counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.counts['user']} users, {self.counts['room']} rooms and {self.counts['message']} "
+            f'messages in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s), '
+            f'skipped {self.skipped} records'
+        ))
+
+    def open(self, path):
+        if path == '-':
+            return sys.stdin
+        if path.endswith('.gz'):
+            return io.TextIOWrapper(gzip.open(path, 'rb'), encoding='utf-8', newline='')
+        return open(path, encoding='utf-8', newline='')
+
+    def records(self, stream, fmt, kind):
+        """
+        Yield CSV rows as dicts and NDJSON lines as text; lines are decoded by
+        parse() so a malformed one is skipped like any other bad record.
+        """
+        if fmt == 'csv':
+            for row in csv.DictReader(stream):
+                yield {'type': kind, **row}
+            return
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield line
+
+    def parse(self, record):
+        if isinstance(record, str):
+            record = json.loads(record)
+        if not isinstance(record, dict):
+            raise ValueError(f'expected a JSON object, got {type(record).__name__}')
+        return record
+
+    def skip(self, reason):
+        self.skipped += 1
+        if self.skipped <= 20:
+            self.stderr.write(f'Skipping {reason}')
+        elif self.skipped == 21:
+            self.stderr.write('Further skipped records are only counted')
+
+    def report(self, started, records):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{records} records read, {records / elapsed:.0f}/s')
+
+    def add(self, record):
+        kind = record.get('type') or 'message'
+        if kind == 'user':
+            self.add_user(record)
+        elif kind == 'room':
+            self.add_room(record)
+        elif kind == 'message':
+            self.add_message(record)
+        else:
+            raise ValueError(f'unknown record type {kind!r}')
+
+    def add_user(self, record):
+        username = record['username']
+        if username in self.user_ids:
+            return
+        password = record.get('password')
+        if password:
+            # Precomputed hashes are stored as is; only their format is checked
+            identify_hasher(password)
+        user = User(
+            username=username,
+            password=password or '',
+            name=record.get('name') or '',
+            email=record.get('email') or '',
+            bio=record.get('bio') or '',
+        )
+        user._raw_password = None if password else record.get('raw_password')
+        self.user_ids[username] = None
+        self.pending['user'].append(user)
+        if len(self.pending['user']) >= self.batch_size:
+            self.flush_users()
+
+    def add_room(self, record):
+        name = record['name']
+        if name in self.room_ids:
+            return
+        password = record.get('password') or None
+        if password:
+            identify_hasher(password)
+        creator = record.get('created_by') or None
+        if creator is not None:
+            creator = self.resolve_user(creator)
+        self.room_ids[name] = None
+        self.pending['room'].append((Room(name=name, password=password), creator))
+        if len(self.pending['room']) >= self.batch_size:
+            self.flush_rooms()
+
+    def add_message(self, record):
+        user = record.get('user')
+        if isinstance(user, dict):
+            # export_chat lines
+            user = user.get('username')
+        room = self.default_room or record['room']
+        if not isinstance(room, str):
+            raise ValueError('rooms are referenced by name; import export_chat output with --room')
+        created_at = record.get('created_at') or None
+        if created_at is not None:
+            created_at = parse_datetime(created_at)
+            if created_at is None:
+                raise ValueError(f"invalid created_at {record['created_at']!r}")
+            if timezone.is_naive(created_at):
+                created_at = timezone.make_aware(created_at)
+        self.pending['message'].append((
+            room, self.resolve_user(user) if user else None, record['content'], created_at or timezone.now(),
+        ))
+        if len(self.pending['message']) >= self.batch_size:
+            self.flush_messages()
+
+    def resolve_user(self, username):
+        if username not in self.user_ids:
+            if not self.create_missing:
+                raise ValueError(f'unknown user {username!r}')
+            self.add_user({'username': username})
+        return username
+
+    def flush_all(self):
+        self.flush_users()
+        self.flush_rooms()
+        self.flush_messages()
+
+    def flush_users(self):
+        users, self.pending['user'] = self.pending['user'], []
+        if not users:
+            return
+        raw = [user for user in users if user._raw_password]
+        for user, encoded in zip(raw, self.hasher.map(make_password, [user._raw_password for user in raw])):
+            user.password = encoded
+        for user in users:
+            if not user.password:
+                user.password = make_password(None)
+        with transaction.atomic():
+            created = User.objects.bulk_create(users)
+            self.map_ids(User, created, 'username', self.user_ids)
+            User.groups.through.objects.bulk_create([
+                User.groups.through(user_id=self.user_ids[user.username], group_id=self.user_group.id)
+                for user in created
+            ])
+        self.counts['user'] += len(created)
+
+    def flush_rooms(self):
+        rooms, self.pending['room'] = self.pending['room'], []
+        if not rooms:
+            return
+        if any(creator is not None and self.user_ids[creator] is None for _, creator in rooms):
+            self.flush_users()
+        for room, creator in rooms:
+            room.created_by_id = self.user_ids[creator] if creator is not None else None
+        with transaction.atomic():
+            created = Room.objects.bulk_create([room for room, _ in rooms])
+            self.map_ids(Room, created, 'name', self.room_ids)
+        self.counts['room'] += len(created)
+
+    def flush_messages(self):
+        pending, self.pending['message'] = self.pending['message'], []
+        if not pending:
+            return
+        # Messages may refer to users and rooms that are still batched
+        self.flush_users()
+        missing = {room for room, _, _, _ in pending if room not in self.room_ids}
+        if missing:
+            if not self.create_missing:
+                for room, _, _, _ in pending:
+                    if room in missing:
+                        self.skip(f'message of unknown room {room!r}')
+                pending = [p for p in pending if p[0] not in missing]
+            else:
+                for name in missing:
+                    self.room_ids[name] = None
+                    self.pending['room'].append((Room(name=name), None))
+        self.flush_rooms()
+
+        # Plain parameter rows instead of model instances: building and
+        # preparing a Message per row costs more than inserting it
+        adapt = connection.ops.adapt_datetimefield_value
+        rows = [
+            (self.room_ids[room], self.user_ids[user] if user is not None else None, content, adapt(created_at))
+            for room, user, content, created_at in pending
+        ]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {Message._meta.db_table} (room_id, user_id, content, created_at) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+        self.touched_rooms.update(row[0] for row in rows)
+        self.counts['message'] += len(rows)
+
+    def map_ids(self, model, created, key, ids):
+        # Backends that can't return ids from a bulk insert are looked up
+        if created and created[0].pk is None:
+            names = [getattr(obj, key) for obj in created]
+            ids.update(model.objects.filter(**{f'{key}__in': names}).values_list(key, 'id'))
+        else:
+            ids.update((getattr(obj, key), obj.pk) for obj in created)
@@ -0,0 +1,113 @@
+import threading
+from collections import deque
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """
+    Running count/sum plus a window of the most recent samples, which is
+    what the percentiles are computed from.
+    """
+
+    def __init__(self, window=2048):
+        self.count = 0
+        self.total = 0.0
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self._samples.append(value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        return percentile(samples, p)
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+        return {
+            'count': self.count,
+            'mean': round(self.mean, 3),
+            'p50': round(percentile(samples, 50), 3),
+            'p90': round(percentile(samples, 90), 3),
+            'p99': round(percentile(samples, 99), 3),
+            'max': round(samples[-1], 3) if samples else 0.0,
+        }
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(p / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name):
+        return self._get(name, Gauge)
+
+    def histogram(self, name):
+        return self._get(name, Histogram)
+
+    def snapshot(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+
+# Process-wide metrics, exposed to staff at /api/metrics/
+registry = Registry()
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_merge_20250421_1425'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'created_at', 'id'], name='chat_msg_room_created_idx'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+from django.db import migrations
+
+# Keep in step with chat.search, which queries these structures
+
+SQLITE_FORWARD = [
+    # Contentless FTS5 index of message content and room. Its rowid is the
+    # negated message id, so walking the index in rowid order visits the
+    # newest messages first. Prefix indexes on two and three characters keep
+    # short search-as-you-type prefixes from merging thousands of term lists.
+    # The triggers keep it current on every write
+    """
+    CREATE VIRTUAL TABLE chat_message_fts USING fts5(
+        content, room_id, content='', prefix='2 3', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message BEGIN
+        INSERT INTO chat_message_fts(rowid, content, room_id) VALUES (-new.id, new.content, new.room_id);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content, room_id)
+        VALUES ('delete', -old.id, old.content, old.room_id);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF content, room_id ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content, room_id)
+        VALUES ('delete', -old.id, old.content, old.room_id);
+        INSERT INTO chat_message_fts(rowid, content, room_id) VALUES (-new.id, new.content, new.room_id);
+    END
+    """,
+    'INSERT INTO chat_message_fts(rowid, content, room_id) SELECT -id, content, room_id FROM chat_message',
+]
+
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS chat_message_fts_update',
+    'DROP TRIGGER IF EXISTS chat_message_fts_delete',
+    'DROP TRIGGER IF EXISTS chat_message_fts_insert',
+    'DROP TABLE IF EXISTS chat_message_fts',
+]
+
+POSTGRES_FORWARD = [
+    # An expression index is maintained by Postgres itself as rows change;
+    # built concurrently so existing tables stay writable meanwhile
+    "CREATE INDEX CONCURRENTLY chat_message_content_fts ON chat_message USING GIN (to_tsvector('english', content))",
+]
+
+POSTGRES_REVERSE = [
+    'DROP INDEX CONCURRENTLY IF EXISTS chat_message_content_fts',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('chat', '0006_message_room_created_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_for_vendor({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def seed_message_seq(apps, schema_editor):
+    # Rooms start their sequence at the messages they already have
+    Room = apps.get_model('chat', 'Room')
+    Room.objects.update(message_seq=models.F('message_count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_room_activity_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='message_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(seed_message_seq, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='RoomReadMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read_seq', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to='chat.room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_markers', to='chat.user')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='roomreadmarker',
+            constraint=models.UniqueConstraint(fields=('user', 'room'), name='chat_read_marker_user_room'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_read_markers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_created_at', models.DateTimeField()),
+                ('first_id', models.BigIntegerField()),
+                ('last_created_at', models.DateTimeField()),
+                ('last_id', models.BigIntegerField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='chat.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'first_created_at', 'first_id'], name='chat_archive_room_first_idx'), models.Index(fields=['room', 'last_created_at', 'last_id'], name='chat_archive_room_last_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='nonce',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+    ]
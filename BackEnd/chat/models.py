@@ -38,6 +38,26 @@ class Room(models.Model):
     password = models.CharField(max_length=128, blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='created_rooms')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Activity stats, maintained by chat.room_stats as messages are written
+    message_count = models.PositiveIntegerField(default=0)
+    # Messages ever posted; unlike message_count it never goes down, so read
+    # markers can store how far into it a user has read
+    message_seq = models.PositiveBigIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_message_preview = models.CharField(max_length=100, blank=True, default='')
+    last_message_user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    STATS_FIELDS = ('message_count', 'message_seq', 'last_message_at', 'last_message_preview', 'last_message_user')
+
+    def save(self, *args, **kwargs):
+        # Stats only change through chat.room_stats' UPDATEs, so saving a room
+        # loaded a while ago must not write back counts that have moved since
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.STATS_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
@@ -53,9 +73,55 @@ class Message(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='messages')
     content = models.TextField()
     created_at = models.DateTimeField(default=timezone.now)
+    # Set for messages broadcast before they were saved (write-behind), whose
+    # live frames carry no id; clients recognise them by it instead
+    nonce = models.CharField(max_length=32, null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.user.username}: {self.content[:50]}"
 
     class Meta:
-        ordering = ['created_at'] 
\ No newline at end of file
+        ordering = ['created_at']
+        indexes = [
+            # Keyset pagination of a room's history (see chat.pagination)
+            models.Index(fields=['room', 'created_at', 'id'], name='chat_msg_room_created_idx'),
+        ] 
+
+class RoomReadMarker(models.Model):
+    """How far into a room's ``message_seq`` a user has read."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='read_markers')
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='read_markers')
+    read_seq = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} read {self.room_id} up to {self.read_seq}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'room'], name='chat_read_marker_user_room'),
+        ]
+
+class MessageArchiveSegment(models.Model):
+    """
+    Compressed, append-only block of a room's archived messages (see
+    chat.archive). The first/last positions index which segments a history
+    page has to open.
+    """
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='archive_segments')
+    first_created_at = models.DateTimeField()
+    first_id = models.BigIntegerField()
+    last_created_at = models.DateTimeField()
+    last_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.room_id}: {self.message_count} messages up to {self.last_created_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'first_created_at', 'first_id'], name='chat_archive_room_first_idx'),
+            models.Index(fields=['room', 'last_created_at', 'last_id'], name='chat_archive_room_last_idx'),
+        ]
@@ -0,0 +1,259 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+BATCHING_DEFAULTS = {
+    'ENABLED': False,
+    'WINDOW': 0.015,
+    'MAX_BATCH': 50,
+}
+
+QUEUE_DEFAULTS = {
+    'ENABLED': True,
+    'MAX_SIZE': 1000,
+    'MAX_UNACKED': 200,
+    'POLICY': 'drop_oldest',
+}
+
+DROP_OLDEST = 'drop_oldest'
+COALESCE = 'coalesce'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+# Close code sent to clients that fell too far behind (application range)
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+def get_batching_settings():
+    config = dict(BATCHING_DEFAULTS)
+    config.update(getattr(settings, 'CHAT_OUTBOUND_BATCHING', {}))
+    return config
+
+
+def get_send_queue_settings():
+    config = dict(QUEUE_DEFAULTS)
+    config.update(getattr(settings, 'CHAT_SEND_QUEUE', {}))
+    if config['POLICY'] not in POLICIES:
+        raise ValueError(f"CHAT_SEND_QUEUE['POLICY'] must be one of {', '.join(POLICIES)}")
+    return config
+
+
+class OutboundBatcher:
+    """
+    Coalesces pre-encoded chat frames for one WebSocket connection.
+
+    A frame that arrives after the connection has been quiet for ``window``
+    seconds is sent straight away. Frames that follow within the window are
+    collected and sent together as one JSON array frame, either when the
+    window closes or when ``max_batch`` frames are waiting.
+    """
+
+    def __init__(self, send, window=0.015, max_batch=50):
+        self._send = send
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._last_flush = 0.0
+        self._timer = None
+        self._batch_sizes = registry.histogram('ws.outbound.batch_size')
+        self._frames = registry.counter('ws.outbound.frames')
+        self._messages = registry.counter('ws.outbound.messages')
+
+    async def push(self, text):
+        now = time.monotonic()
+        if not self._pending and now - self._last_flush >= self.window:
+            # Idle connection: deliver immediately
+            self._pending.append(text)
+            await self.flush()
+            return
+
+        self._pending.append(text)
+        if len(self._pending) >= self.max_batch:
+            await self.flush()
+        elif self._timer is None:
+            delay = max(0.0, self._last_flush + self.window - now)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    async def flush(self):
+        self._cancel_timer()
+        frames, self._pending = self._pending, []
+        if not frames:
+            return
+        self._last_flush = time.monotonic()
+        self._batch_sizes.observe(len(frames))
+        self._frames.inc()
+        self._messages.inc(len(frames))
+        if len(frames) == 1:
+            await self._send(frames[0])
+        else:
+            # Frames are already JSON, so the batch is joined rather than re-encoded
+            await self._send('[' + ','.join(frames) + ']')
+
+    def close(self):
+        self._cancel_timer()
+        self._pending = []
+
+    def _on_timer(self):
+        self._timer = None
+        asyncio.ensure_future(self._flush_logged())
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f'Error flushing outbound batch: {str(e)}')
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class OutboundQueue:
+    """
+    Bounded per-connection queue between the channel layer and the socket.
+
+    ``put`` never blocks, so a slow client cannot hold up its channel; a
+    writer task drains the queue in order. Writing to the socket can't tell
+    a slow client from a fast one: the server (Daphne's Twisted transport)
+    buffers whatever is written without limit. Instead the client reports
+    how many frames it has received (``ack``), and the writer stops once
+    ``max_unacked`` frames are unacknowledged, so a stalled client's frames
+    wait here. Every frame sent on the connection, queued or not, must be
+    counted with ``count_sent``. When the queue is full the policy decides
+    what happens:
+
+    - ``drop_oldest``: discard the oldest queued frame.
+    - ``coalesce``: replace everything queued with one ``resync`` frame that
+      tells the client to fetch what it missed after ``last_id``.
+    - ``disconnect``: send a ``resume`` hint with ``last_id`` and close the
+      connection with ``SLOW_CONSUMER_CLOSE_CODE``.
+    """
+
+    def __init__(self, send, max_size=1000, policy=DROP_OLDEST, on_overflow=None, max_unacked=200):
+        self._send = send
+        self.max_size = max_size
+        self.max_unacked = max_unacked
+        self.policy = policy
+        self._on_overflow = on_overflow
+        self._queue = deque()
+        self._wakeup = asyncio.Event()
+        self._acked_event = asyncio.Event()
+        self._writer = None
+        self._closed = False
+        # The queued resync frame, if any; replacing it loses no messages
+        self._resync = None
+        self.last_id = None
+        self.dropped = 0
+        self.sent = 0
+        self.acked = 0
+        self._depth = registry.gauge('ws.send_queue.depth')
+        self._max_depth = registry.histogram('ws.send_queue.depth_on_put')
+        self._unacked = registry.histogram('ws.send_queue.unacked_on_put')
+        self._drops = registry.counter('ws.send_queue.dropped')
+        self._disconnects = registry.counter('ws.send_queue.slow_disconnects')
+
+    def __len__(self):
+        return len(self._queue)
+
+    @property
+    def unacked(self):
+        return self.sent - self.acked
+
+    def count_sent(self, frames=1):
+        self.sent += frames
+
+    def ack(self, received):
+        """Record that the client has received ``received`` frames in total."""
+        # Never past what was sent: a client can't open the window by lying
+        received = min(received, self.sent)
+        if received > self.acked:
+            self.acked = received
+            self._acked_event.set()
+
+    def start(self):
+        self._writer = asyncio.ensure_future(self._write_loop())
+
+    def put(self, text, message_id=None):
+        if self._closed:
+            return
+        if len(self._queue) >= self.max_size and not self._overflow():
+            return
+        self._queue.append((message_id, text))
+        self._depth.inc()
+        self._max_depth.observe(len(self._queue))
+        self._unacked.observe(self.unacked)
+        self._wakeup.set()
+
+    def close(self):
+        self._closed = True
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        self._depth.dec(len(self._queue))
+        self._queue.clear()
+
+    def _overflow(self):
+        """Apply the overflow policy; returns whether the new frame is kept."""
+        if self.policy == DROP_OLDEST:
+            self._queue.popleft()
+            self._depth.dec()
+            self._count_drops(1)
+            return True
+
+        dropped = len(self._queue)
+        if self._queue and self._queue[0] is self._resync:
+            dropped -= 1
+        self._queue.clear()
+        self._depth.dec(dropped)
+        self._count_drops(dropped)
+
+        if self.policy == COALESCE:
+            self._resync = (None, json.dumps({'type': 'resync', 'last_id': self.last_id}))
+            self._queue.append(self._resync)
+            self._depth.inc()
+            # The frame that overflowed is covered by the resync as well
+            self._count_drops(1)
+            return False
+
+        self._closed = True
+        self._disconnects.inc()
+        self._count_drops(1)
+        if self._on_overflow is not None:
+            asyncio.ensure_future(self._on_overflow(self.last_id))
+        return False
+
+    def _count_drops(self, count):
+        self.dropped += count
+        self._drops.inc(count)
+
+    async def _write_loop(self):
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            while self.unacked >= self.max_unacked:
+                self._acked_event.clear()
+                await self._acked_event.wait()
+            if not self._queue:
+                # Emptied by an overflow while waiting for acks
+                continue
+            message_id, text = self._queue.popleft()
+            self._depth.dec()
+            try:
+                await self._send(text)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f'Error writing queued frame: {str(e)}')
+                continue
+            if message_id is not None:
+                self.last_id = message_id
@@ -0,0 +1,243 @@
+import base64
+import json
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .archive import aread_archive, read_archive
+
+BEFORE = 'before'
+AFTER = 'after'
+
+
+def encode_cursor(created_at, pk, direction):
+    raw = json.dumps([created_at.isoformat(), pk, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk, direction = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        created_at = parse_datetime(created_at)
+        if created_at is None or not isinstance(pk, int) or direction not in (BEFORE, AFTER):
+            raise ValueError(cursor)
+        return created_at, pk, direction
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise NotFound('Invalid cursor')
+
+
+def seek(queryset, created_at, pk, direction):
+    """
+    Restrict ``queryset`` to the rows strictly before or after the
+    ``(created_at, id)`` position and order it walking away from it.
+    """
+    if direction == BEFORE:
+        return (
+            queryset.filter(created_at__lte=created_at)
+            .exclude(created_at=created_at, id__gte=pk)
+            .order_by('-created_at', '-id')
+        )
+    return (
+        queryset.filter(created_at__gte=created_at)
+        .exclude(created_at=created_at, id__lte=pk)
+        .order_by('created_at', 'id')
+    )
+
+
+class MessageKeysetPagination(BasePagination):
+    """
+    Keyset pagination over ``(created_at, id)``.
+
+    Without a cursor the newest page is returned. Each page lists its results
+    oldest first and links to the ``older`` and ``newer`` neighbouring pages
+    with opaque cursors, so the cost of a page does not depend on how deep
+    into the history it is.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'CHAT_MESSAGE_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'CHAT_MESSAGE_MAX_PAGE_SIZE', 200)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, position, page_size = self._seek(queryset, request)
+        rows = list(queryset[:page_size + 1])
+        room_id = request.query_params.get('room_id', '')
+        if room_id.isdigit():
+            bound = self._archive_bound(rows, page_size + 1)
+            archived = read_archive(int(room_id), self.direction == BEFORE, position, bound, page_size + 1)
+            rows = self._merge_archived(rows, archived, page_size + 1)
+        return self._set_page(rows, page_size)
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset() on the async ORM, for the async history view."""
+        queryset, position, page_size = self._seek(queryset, request)
+        rows = [row async for row in queryset[:page_size + 1]]
+        room_id = request.query_params.get('room_id', '')
+        if room_id.isdigit():
+            bound = self._archive_bound(rows, page_size + 1)
+            archived = await aread_archive(int(room_id), self.direction == BEFORE, position, bound, page_size + 1)
+            rows = self._merge_archived(rows, archived, page_size + 1)
+        return self._set_page(rows, page_size)
+
+    def _seek(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        cursor = request.query_params.get(self.cursor_query_param)
+        self.has_cursor = bool(cursor)
+        if not cursor:
+            self.direction = BEFORE
+            return queryset.order_by('-created_at', '-id'), None, self.get_page_size(request)
+        created_at, pk, self.direction = decode_cursor(cursor)
+        return seek(queryset, created_at, pk, self.direction), (created_at, pk), self.get_page_size(request)
+
+    def _set_page(self, rows, page_size):
+        self.has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if self.direction == BEFORE:
+            rows.reverse()
+        self.page = rows
+        return rows
+
+    # The room's archived messages (see chat.archive) that fall within the
+    # page are merged in, so history reads cross from the message table into
+    # the archive without the client noticing
+
+    def _archive_bound(self, rows, limit):
+        # A full page of live rows only leaves room for archived messages
+        # between the cursor and the last of them
+        return self._position(rows[-1]) if len(rows) >= limit else None
+
+    def _merge_archived(self, rows, archived, limit):
+        if not archived:
+            return rows
+        rows = sorted(rows + archived, key=self._position, reverse=self.direction == BEFORE)
+        return rows[:limit]
+
+    def paginate_cached(self, request, results, has_more):
+        """Set up the newest page from already serialized messages."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.direction = BEFORE
+        self.has_cursor = False
+        self.has_more = has_more
+        self.page = results
+        return results
+
+    def get_older_link(self):
+        if not self.page:
+            return None
+        if self.direction == BEFORE and not self.has_more:
+            return None
+        created_at, pk = self._position(self.page[0])
+        return self._link(encode_cursor(created_at, pk, BEFORE))
+
+    def get_newer_link(self):
+        if not self.page or not self.has_cursor:
+            return None
+        if self.direction == AFTER and not self.has_more:
+            return None
+        created_at, pk = self._position(self.page[-1])
+        return self._link(encode_cursor(created_at, pk, AFTER))
+
+    def _position(self, item):
+        if isinstance(item, dict):
+            return parse_datetime(item['created_at']), item['id']
+        return item.created_at, item.id
+
+    def _link(self, cursor):
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'older': self.get_older_link(),
+            'newer': self.get_newer_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'older': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'newer': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class MessageSearchPagination(BasePagination):
+    """
+    Page-numbered pagination of ranked search results.
+
+    Matches are not counted: one extra result is fetched to tell whether a
+    ``next`` page exists, and paging stops after ``max_results`` matches.
+    ``truncated`` tells the client that only the newest matches were ranked
+    (see chat.search), so older, possibly better ones are missing.
+    """
+
+    page_query_param = 'page'
+    page_size_query_param = 'page_size'
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'CHAT_SEARCH_PAGE_SIZE', 20)
+        self.max_page_size = getattr(settings, 'CHAT_SEARCH_MAX_PAGE_SIZE', 100)
+        self.max_results = getattr(settings, 'CHAT_SEARCH_MAX_RESULTS', 1000)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_search(self, search, request):
+        """Run ``search(limit, offset)``, returning ``(rows, truncated)``, for the requested page."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        size = self.get_page_size(request)
+        try:
+            self.number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound('Invalid page')
+        offset = (self.number - 1) * size
+        if self.number < 1 or offset >= self.max_results:
+            raise NotFound('Invalid page')
+
+        rows, self.truncated = search(size + 1, offset)
+        self.has_next = len(rows) > size and offset + size < self.max_results
+        return rows[:size]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.page_query_param, self.number + 1)
+
+    def get_previous_link(self):
+        if self.number == 1:
+            return None
+        if self.number == 2:
+            return remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(self.base_url, self.page_query_param, self.number - 1)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'truncated': self.truncated,
+            'results': data,
+        })
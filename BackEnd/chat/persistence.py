@@ -0,0 +1,170 @@
+import asyncio
+import atexit
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from .db_executor import chat_database_sync_to_async
+from .history_cache import get_recent_messages
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 0.05,
+    'MAX_QUEUE': 10000,
+}
+
+
+def get_write_behind_settings():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'CHAT_WRITE_BEHIND', {}))
+    return config
+
+
+class BufferFull(Exception):
+    pass
+
+
+class PendingMessage:
+    __slots__ = ('room_id', 'user_id', 'content', 'created_at', 'nonce', 'reply_channel')
+
+    def __init__(self, room_id, user_id, content, created_at, nonce, reply_channel):
+        self.room_id = room_id
+        self.user_id = user_id
+        self.content = content
+        self.created_at = created_at
+        self.nonce = nonce
+        self.reply_channel = reply_channel
+
+
+class MessageWriteBuffer:
+    """
+    Process-wide write-behind queue for chat messages.
+
+    Consumers broadcast a message right away and hand it to this buffer, which
+    persists queued messages with a single ``bulk_create`` once ``batch_size``
+    messages are waiting or ``flush_interval`` seconds have passed. Senders of
+    messages that could not be written are notified on their reply channel.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=0.05, max_queue=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._pending = []
+        self._in_flight = 0
+        self._timer = None
+        self._flush_lock = None
+
+    def __len__(self):
+        return len(self._pending) + self._in_flight
+
+    def enqueue(self, pending):
+        if len(self) >= self.max_queue:
+            raise BufferFull(f'Write-behind queue is full ({self.max_queue} messages)')
+        self._pending.append(pending)
+        if len(self._pending) >= self.batch_size:
+            self._cancel_timer()
+            asyncio.ensure_future(self.flush())
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.flush_interval, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        self._cancel_timer()
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                self._in_flight += len(batch)
+                try:
+                    orphaned = await chat_database_sync_to_async(self._write)(batch)
+                    if orphaned:
+                        await self._report_failure(orphaned)
+                except Exception as e:
+                    logger.error(f'Failed to persist {len(batch)} buffered messages: {str(e)}', exc_info=True)
+                    await self._report_failure(batch)
+                finally:
+                    self._in_flight -= len(batch)
+
+    def flush_sync(self):
+        """Write whatever is still queued; used at interpreter shutdown."""
+        self._cancel_timer()
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            self._write(batch)
+            logger.info(f'Flushed {len(batch)} buffered messages on shutdown')
+        except Exception as e:
+            logger.error(f'Lost {len(batch)} buffered messages on shutdown: {str(e)}', exc_info=True)
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _write(self, batch):
+        from .models import Room, Message
+        from .room_stats import record_batch
+        room_ids = set(
+            Room.objects.filter(id__in={p.room_id for p in batch}).values_list('id', flat=True)
+        )
+        orphaned = [p for p in batch if p.room_id not in room_ids]
+        if orphaned:
+            logger.warning(f'Dropping {len(orphaned)} buffered messages for deleted rooms')
+        with transaction.atomic():
+            messages = Message.objects.bulk_create([
+                Message(
+                    room_id=p.room_id,
+                    user_id=p.user_id,
+                    content=p.content,
+                    created_at=p.created_at,
+                    nonce=p.nonce,
+                )
+                for p in batch if p.room_id in room_ids
+            ])
+            # One stats update per room for the whole batch
+            record_batch(messages)
+        # bulk_create sends no post_save, so drop the affected ring buffers
+        recent_messages = get_recent_messages()
+        if recent_messages is not None:
+            for room_id in room_ids:
+                recent_messages.invalidate(room_id)
+        return orphaned
+
+    async def _report_failure(self, batch):
+        channel_layer = get_channel_layer()
+        for pending in batch:
+            if not pending.reply_channel:
+                continue
+            try:
+                await channel_layer.send(pending.reply_channel, {
+                    'type': 'persist_failed',
+                    'nonce': pending.nonce,
+                })
+            except Exception as e:
+                logger.error(f'Error reporting failed write to {pending.reply_channel}: {str(e)}')
+
+
+_buffer = None
+
+
+def get_write_buffer():
+    global _buffer
+    if _buffer is None:
+        config = get_write_behind_settings()
+        _buffer = MessageWriteBuffer(
+            batch_size=config['BATCH_SIZE'],
+            flush_interval=config['FLUSH_INTERVAL'],
+            max_queue=config['MAX_QUEUE'],
+        )
+        atexit.register(_buffer.flush_sync)
+    return _buffer
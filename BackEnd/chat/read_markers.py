@@ -0,0 +1,44 @@
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, F, FilteredRelation, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import Room, RoomReadMarker
+
+
+def mark_read(user_id, room_id):
+    """
+    Mark everything posted to a room so far as read by a user. An existing
+    marker is moved forward (never back) by one UPDATE.
+    """
+    seq = Subquery(Room.objects.filter(id=room_id).values('message_seq')[:1])
+    markers = RoomReadMarker.objects.filter(user_id=user_id, room_id=room_id)
+    if markers.update(read_seq=Greatest(F('read_seq'), seq)):
+        return True
+    current = Room.objects.filter(id=room_id).values_list('message_seq', flat=True).first()
+    if current is None:
+        return False
+    try:
+        with transaction.atomic():
+            RoomReadMarker.objects.create(user_id=user_id, room_id=room_id, read_seq=current)
+    except IntegrityError:
+        # Created concurrently by another connection of the same user
+        markers.update(read_seq=Greatest(F('read_seq'), seq))
+    return True
+
+
+def with_unread_counts(queryset, user_id):
+    """
+    Annotate rooms with ``unread_count`` for a user: the room's sequence
+    minus the user's read marker, joined in the same query. Rooms the user
+    never read count every message as unread. Deleted messages can't make
+    the count exceed the room's current message count.
+    """
+    return queryset.annotate(
+        user_marker=FilteredRelation('read_markers', condition=Q(read_markers__user_id=user_id)),
+    ).annotate(
+        unread_count=Least(
+            Greatest(F('message_seq') - Coalesce(F('user_marker__read_seq'), 0), 0),
+            F('message_count'),
+            output_field=BigIntegerField(),
+        ),
+    )
@@ -0,0 +1,86 @@
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Substr
+
+from .models import Message, MessageArchiveSegment, Room
+
+PREVIEW_LENGTH = Room._meta.get_field('last_message_preview').max_length
+
+
+def record_messages(room_id, count, latest):
+    """
+    Count ``count`` new messages in a room whose newest is ``latest``, with a
+    single UPDATE. The increment is done by the database, so concurrent
+    writers never lose counts, and the last message only moves forward.
+    """
+    newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=latest.created_at)
+
+    def if_newer(value, field):
+        return Case(When(newer, then=Value(value)), default=F(field), output_field=Room._meta.get_field(field))
+
+    Room.objects.filter(id=room_id).update(
+        message_count=F('message_count') + count,
+        message_seq=F('message_seq') + count,
+        last_message_at=if_newer(latest.created_at, 'last_message_at'),
+        last_message_preview=if_newer(latest.content[:PREVIEW_LENGTH], 'last_message_preview'),
+        last_message_user=if_newer(latest.user_id, 'last_message_user'),
+    )
+
+
+def record_batch(messages):
+    """``record_messages`` for a batch of messages across rooms."""
+    by_room = {}
+    for message in messages:
+        by_room.setdefault(message.room_id, []).append(message)
+    for room_id, room_messages in by_room.items():
+        latest = max(room_messages, key=lambda message: message.created_at)
+        record_messages(room_id, len(room_messages), latest)
+
+
+def record_deleted(message):
+    Room.objects.filter(id=message.room_id).update(message_count=Greatest(F('message_count') - 1, 0))
+    if Room.objects.filter(id=message.room_id, last_message_at__lte=message.created_at).exists():
+        refresh_last_message([message.room_id])
+
+
+def record_edited(message):
+    if Room.objects.filter(id=message.room_id, last_message_at=message.created_at).exists():
+        refresh_last_message([message.room_id])
+
+
+def last_message_fields():
+    latest = Message.objects.filter(room=OuterRef('pk')).order_by('-created_at', '-id')
+    return {
+        'last_message_at': Subquery(latest.values('created_at')[:1]),
+        'last_message_preview': Coalesce(Substr(Subquery(latest.values('content')[:1]), 1, PREVIEW_LENGTH), Value('')),
+        'last_message_user': Subquery(latest.values('user_id')[:1]),
+    }
+
+
+def refresh_last_message(room_ids):
+    Room.objects.filter(id__in=room_ids).update(**last_message_fields())
+
+
+def refresh_room_stats(room_ids):
+    """Recompute every stat of the given rooms from their messages."""
+    count = (
+        Message.objects.filter(room=OuterRef('pk'))
+        .order_by()
+        .values('room')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    # Archived messages (see chat.archive) still belong to the room
+    archived = (
+        MessageArchiveSegment.objects.filter(room=OuterRef('pk'))
+        .order_by()
+        .values('room')
+        .annotate(count=Sum('message_count'))
+        .values('count')
+    )
+    count = Coalesce(Subquery(count), 0) + Coalesce(Subquery(archived), 0)
+    Room.objects.filter(id__in=room_ids).update(
+        message_count=count,
+        # The sequence only moves forward, or read markers would point past it
+        message_seq=Greatest(F('message_seq'), count),
+        **last_message_fields(),
+    )
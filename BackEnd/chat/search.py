@@ -0,0 +1,131 @@
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Message
+
+# Text search configuration of the Postgres expression index; must match
+# migration 0007_message_search_index
+POSTGRES_CONFIG = 'english'
+
+OPEN_ROOMS = "(r.password IS NULL OR r.password = '')"
+
+WORD = re.compile(r'\w+')
+
+
+def search_terms(text):
+    return [term.lower() for term in WORD.findall(text)]
+
+
+def fts5_query(terms, room_id=None):
+    """
+    Build an FTS5 query that can't be a syntax error: every word becomes a
+    quoted term, all must match, and the last one may be a prefix so results
+    follow what is being typed. A room is matched on the indexed ``room_id``
+    column rather than by joining messages.
+    """
+    query = 'content : (' + ' '.join(f'"{term}"' for term in terms) + '*)'
+    if room_id is not None:
+        query += f' AND room_id : "{int(room_id)}"'
+    return query
+
+
+def rank_candidates(candidates, terms):
+    """
+    Order ``(id, content)`` candidates by BM25 term frequency and length
+    normalisation, newest first on ties. Each term counts the words it
+    prefixes, approximating the stemmed, prefix-matched index query.
+    """
+    k1, b = 1.2, 0.75
+    patterns = [re.compile(r'\b' + re.escape(term), re.IGNORECASE) for term in terms]
+    lengths = [len(WORD.findall(content)) for _, content in candidates]
+    average_length = sum(lengths) / len(lengths) or 1
+
+    scored = []
+    for (pk, content), length in zip(candidates, lengths):
+        norm = k1 * (1 - b + b * length / average_length)
+        score = 0
+        for pattern in patterns:
+            frequency = len(pattern.findall(content))
+            score += frequency * (k1 + 1) / (frequency + norm)
+        scored.append((-score, -pk))
+    scored.sort()
+    return [-pk for _, pk in scored]
+
+
+def search_message_ids(text, room_id=None, limit=20, offset=0, all_rooms=False):
+    """
+    Return ``(ids, truncated)``: the ids of messages matching ``text``, best
+    match first, and whether more messages matched than were ranked. Without
+    ``room_id`` the search covers every room that has no password, or every
+    room at all with ``all_rooms``.
+    """
+    # Only the newest RANK_WINDOW matches are ranked: both indexes can walk
+    # matches newest first and stop there, so a query for a very common word
+    # costs about the same as one for a rare word. Older matches are not
+    # ranked at all, which the caller is told through ``truncated``
+    window = getattr(settings, 'CHAT_SEARCH_RANK_WINDOW', 1000)
+
+    if connection.vendor == 'sqlite':
+        terms = search_terms(text)
+        if not terms:
+            return [], False
+        # The index is contentless and keyed by negated message ids, so its
+        # rowid order is newest first; candidates are ranked here instead of
+        # with FTS5's bm25(), whose cost grows with every match in the table
+        rooms = '' if room_id is not None or all_rooms else f'JOIN chat_room r ON r.id = m.room_id AND {OPEN_ROOMS}'
+        sql = f"""
+            SELECT m.id, m.content FROM chat_message_fts f
+            JOIN chat_message m ON m.id = -f.rowid
+            {rooms}
+            WHERE chat_message_fts MATCH %s
+            ORDER BY f.rowid
+            LIMIT %s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [fts5_query(terms, room_id), window])
+            candidates = cursor.fetchall()
+        if not candidates:
+            return [], False
+        return rank_candidates(candidates, terms)[offset:offset + limit], len(candidates) >= window
+
+    if room_id is not None:
+        scope, scope_params = 'AND m.room_id = %s', [room_id]
+    else:
+        scope, scope_params = ('' if all_rooms else f'AND {OPEN_ROOMS}'), []
+
+    if connection.vendor == 'postgresql':
+        sql = f"""
+            SELECT w.id, count(*) OVER () FROM (
+                SELECT m.id, m.content FROM chat_message m
+                JOIN chat_room r ON r.id = m.room_id
+                WHERE to_tsvector('{POSTGRES_CONFIG}', m.content) @@ websearch_to_tsquery('{POSTGRES_CONFIG}', %s)
+                    {scope}
+                ORDER BY m.id DESC
+                LIMIT %s
+            ) w, websearch_to_tsquery('{POSTGRES_CONFIG}', %s) query
+            ORDER BY ts_rank(to_tsvector('{POSTGRES_CONFIG}', w.content), query) DESC, w.id DESC
+            LIMIT %s OFFSET %s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [text, *scope_params, window, text, limit, offset])
+            rows = cursor.fetchall()
+            return [row[0] for row in rows], bool(rows) and rows[0][1] >= window
+
+    # No full-text index on this backend: newest substring matches first,
+    # all of them, so nothing is left out
+    queryset = Message.objects.filter(content__icontains=text)
+    if room_id is not None:
+        queryset = queryset.filter(room_id=room_id)
+    elif not all_rooms:
+        queryset = queryset.filter(Q(room__password__isnull=True) | Q(room__password=''))
+    return list(queryset.order_by('-created_at', '-id').values_list('id', flat=True)[offset:offset + limit]), False
+
+
+def search_messages(text, room_id=None, limit=20, offset=0):
+    """Like ``search_message_ids`` but returns the messages, authors loaded."""
+    ids, truncated = search_message_ids(text, room_id=room_id, limit=limit, offset=offset)
+    messages = Message.objects.select_related('user').in_bulk(ids)
+    return [messages[pk] for pk in ids if pk in messages], truncated
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.hashers import make_password, check_password
 from django.contrib.auth.models import Group
+from .hashing import hash_password
 from .models import User, Room, Message
 
 class UserSerializer(serializers.ModelSerializer):
@@ -14,6 +15,14 @@ class UserSerializer(serializers.ModelSerializer):
     def get_groups(self, obj):
         return [group.name for group in obj.groups.all()]
 
+class AuthorSerializer(serializers.ModelSerializer):
+    """Slim user representation embedded in every message."""
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'name', 'avatar']
+        read_only_fields = fields
+
 class UserCreateSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     
@@ -29,7 +38,8 @@ class UserCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         password = validated_data.pop('password')
         user = User(**validated_data)
-        user.set_password(password)
+        # The async registration view hashes on the hashing pool up front
+        user.password = self.context.get('password_hash') or hash_password(password)
         user.save()
         
         # Add user to 'user' group
@@ -41,11 +51,16 @@ class UserCreateSerializer(serializers.ModelSerializer):
 class RoomSerializer(serializers.ModelSerializer):
     created_by = UserSerializer(read_only=True)
     has_password = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Room
-        fields = ['id', 'name', 'password', 'has_password', 'created_by', 'created_at']
-        read_only_fields = ['id', 'created_by', 'created_at']
+        fields = [
+            'id', 'name', 'password', 'has_password', 'created_by', 'created_at',
+            'message_count', 'last_message_at', 'last_message', 'unread_count',
+        ]
+        read_only_fields = ['id', 'created_by', 'created_at', 'message_count', 'last_message_at']
         extra_kwargs = {
             'password': {'write_only': True}
         }
@@ -55,6 +70,20 @@ class RoomSerializer(serializers.ModelSerializer):
             return bool(obj.get('password'))
         return bool(obj.password)
 
+    def get_last_message(self, obj):
+        # Content of password-protected rooms stays behind the grant check
+        if isinstance(obj, dict) or obj.last_message_at is None or obj.password:
+            return None
+        user = obj.last_message_user
+        return {
+            'content': obj.last_message_preview,
+            'user': {'id': user.id, 'username': user.username} if user else None,
+        }
+
+    def get_unread_count(self, obj):
+        # Annotated by chat.read_markers.with_unread_counts for signed-in users
+        return getattr(obj, 'unread_count', None)
+
     def create(self, validated_data):
         password = validated_data.pop('password', None)
         room = Room.objects.create(**validated_data)
@@ -73,9 +102,9 @@ class RoomSerializer(serializers.ModelSerializer):
         return instance
 
 class MessageSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = AuthorSerializer(read_only=True)
     
     class Meta:
         model = Message
-        fields = ['id', 'room', 'user', 'content', 'created_at']
-        read_only_fields = ['id', 'user', 'created_at'] 
\ No newline at end of file
+        fields = ['id', 'room', 'user', 'content', 'created_at', 'nonce']
+        read_only_fields = ['id', 'user', 'created_at', 'nonce'] 
\ No newline at end of file
@@ -0,0 +1,85 @@
+import logging
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import room_id_cache, room_password_cache, user_cache
+from .history_cache import get_recent_messages
+from .models import Message, Room, User
+from .room_stats import record_deleted, record_edited, record_messages
+from .serializers import MessageSerializer
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'CHAT_SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+@receiver(post_save, sender=Room)
+def invalidate_renamed_room(sender, instance, created, **kwargs):
+    room_password_cache.discard(instance.pk)
+    if not created:
+        # The old name is unknown here, so drop every name mapped to this room
+        room_id_cache.discard_value(instance.pk)
+
+
+@receiver(post_delete, sender=Room)
+def invalidate_deleted_room(sender, instance, **kwargs):
+    room_id_cache.discard(instance.name)
+    room_id_cache.discard_value(instance.pk)
+    room_password_cache.discard(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_snapshot(sender, instance, **kwargs):
+    user_cache.discard(instance.pk)
+
+
+@receiver(post_save, sender=Message)
+def update_recent_messages(sender, instance, created, **kwargs):
+    recent_messages = get_recent_messages()
+    if recent_messages is None:
+        return
+    try:
+        if created:
+            recent_messages.append(instance.room_id, MessageSerializer(instance).data)
+        else:
+            recent_messages.invalidate(instance.room_id)
+    except Exception as e:
+        logger.error(f'Error updating recent message cache: {str(e)}')
+
+
+@receiver(post_save, sender=Message)
+def update_room_stats(sender, instance, created, **kwargs):
+    if created:
+        record_messages(instance.room_id, 1, instance)
+    else:
+        record_edited(instance)
+
+
+@receiver(post_delete, sender=Message)
+def update_room_stats_on_delete(sender, instance, origin=None, **kwargs):
+    # Messages deleted along with their room have no stats left to update
+    if isinstance(origin, Room):
+        return
+    record_deleted(instance)
+
+
+@receiver(post_delete, sender=Message)
+def invalidate_recent_messages(sender, instance, **kwargs):
+    recent_messages = get_recent_messages()
+    if recent_messages is None:
+        return
+    try:
+        recent_messages.invalidate(instance.room_id)
+    except Exception as e:
+        logger.error(f'Error invalidating recent message cache: {str(e)}')
@@ -0,0 +1,847 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from chat.archive import archive_room
+from chat.cache import room_id_cache, room_password_cache, user_cache
+from chat.consumers import ROOM_ACCESS_DENIED_CLOSE_CODE
+from chat.grants import issue_room_grant, verify_room_grant
+from chat.hashing import ConfiguredPBKDF2PasswordHasher, HashingPoolSaturated, PasswordHashingPool
+from chat.history_cache import LocalRecentMessages
+from chat.layers import LocalFanoutChannelLayer
+from chat.models import Message, MessageArchiveSegment, Room, User
+from chat.outbound import COALESCE, DISCONNECT, DROP_OLDEST, SLOW_CONSUMER_CLOSE_CODE, OutboundQueue
+from chat.persistence import BufferFull, MessageWriteBuffer, PendingMessage
+from chat.search import search_message_ids
+
+
+class ListQueryCountTests(TestCase):
+    """
+    List endpoints must run the same number of queries for one row as for
+    many: every row below has its own author or creator with their own
+    groups, so a per-row query shows up as a growing count.
+    """
+
+    rows = 20
+
+    def setUp(self):
+        for cache in (user_cache, room_id_cache, room_password_cache):
+            cache.clear()
+        self.group = Group.objects.create(name='member')
+        self.reader = self.make_user('reader')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.reader).access_token}'
+        self.room = Room.objects.create(name='lobby', created_by=self.reader)
+
+    def make_user(self, username):
+        user = User.objects.create(username=username)
+        user.groups.add(self.group)
+        return user
+
+    def count_queries(self, path, data=None):
+        # The first request fills the middleware's user cache
+        self.client.get(path, data)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, data)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def assertQueriesDontGrow(self, path, data, add_rows):
+        for async_reads in (False, True):
+            with self.subTest(async_reads=async_reads), override_settings(CHAT_ASYNC_READ_API=async_reads):
+                count = self.count_queries(path, data)
+                add_rows(async_reads)
+                self.client.get(path, data)
+                with self.assertNumQueries(count):
+                    response = self.client.get(path, data)
+                self.assertEqual(response.status_code, 200, response.content)
+
+    def test_room_list(self):
+        def add_rooms(batch):
+            for i in range(self.rows):
+                creator = self.make_user(f'creator_{batch}_{i}')
+                room = Room.objects.create(name=f'room_{batch}_{i}', created_by=creator)
+                Message.objects.create(room=room, user=creator, content='hello')
+
+        self.assertQueriesDontGrow('/api/rooms/', None, add_rooms)
+
+    def test_room_list_by_activity(self):
+        def add_rooms(batch):
+            for i in range(self.rows):
+                creator = self.make_user(f'creator_{batch}_{i}')
+                room = Room.objects.create(name=f'room_{batch}_{i}', created_by=creator)
+                Message.objects.create(room=room, user=creator, content='hello')
+
+        self.assertQueriesDontGrow('/api/rooms/', {'ordering': 'activity'}, add_rooms)
+
+    def test_message_list(self):
+        Message.objects.create(room=self.room, user=self.reader, content='first')
+
+        def add_messages(batch):
+            for i in range(self.rows):
+                Message.objects.create(room=self.room, user=self.make_user(f'author_{batch}_{i}'), content=f'm{i}')
+
+        self.assertQueriesDontGrow('/api/messages/', {'room_id': self.room.id}, add_messages)
+
+    def test_user_list(self):
+        def add_users(batch):
+            for i in range(self.rows):
+                self.make_user(f'user_{batch}_{i}')
+
+        # The user list has no async endpoint; both passes use the viewset
+        self.assertQueriesDontGrow('/api/users/', None, add_users)
+
+
+class RoomReadTests(TestCase):
+    def setUp(self):
+        for cache in (user_cache, room_id_cache, room_password_cache):
+            cache.clear()
+        self.user = User.objects.create(username='reader')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.room = Room.objects.create(name='lobby', created_by=self.user)
+
+    def test_marks_room_read(self):
+        response = self.client.post(f'/api/rooms/{self.room.id}/read/')
+        self.assertEqual(response.status_code, 204)
+
+    def test_unknown_room_is_not_found(self):
+        for pk in (self.room.id + 1, 'lobby', '1.5'):
+            with self.subTest(pk=pk):
+                response = self.client.post(f'/api/rooms/{pk}/read/')
+                self.assertEqual(response.status_code, 404, response.content)
+
+
+# Cheap hashes keep the password-protected rooms below fast to set up
+@override_settings(CHAT_PASSWORD_HASHING={'ITERATIONS': 1000})
+class RoomGrantTests(TransactionTestCase):
+    """
+    The async views look room passwords up from the database executor's
+    threads, which only see committed rows.
+    """
+
+    def setUp(self):
+        for cache in (user_cache, room_id_cache, room_password_cache):
+            cache.clear()
+        self.user = User.objects.create(username='member')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.room = Room(name='private', created_by=self.user)
+        self.room.set_password('secret')
+        self.room.save()
+        self.room_password = 'secret'
+        self.message = Message.objects.create(room=self.room, user=self.user, content='hidden')
+
+    def get_grant(self, password='secret'):
+        response = self.client.post(f'/api/rooms/{self.room.id}/check_password/', {'password': password})
+        return response.json().get('grant')
+
+    def test_grant_is_issued_for_the_right_password(self):
+        self.assertIsNone(self.get_grant('wrong'))
+        grant = self.get_grant()
+        self.assertTrue(verify_room_grant(grant, self.room.id, self.user.id, self.room.password))
+        # Grants are bound to the room and the user they were issued for
+        self.assertFalse(verify_room_grant(grant, self.room.id + 1, self.user.id, self.room.password))
+        self.assertFalse(verify_room_grant(grant, self.room.id, self.user.id + 1, self.room.password))
+        self.assertFalse(verify_room_grant(grant + 'x', self.room.id, self.user.id, self.room.password))
+
+    def test_history_requires_a_grant(self):
+        for async_reads in (False, True):
+            with self.subTest(async_reads=async_reads), override_settings(CHAT_ASYNC_READ_API=async_reads):
+                path = f'/api/messages/?room_id={self.room.id}'
+                self.assertEqual(self.client.get(path).status_code, 403)
+                response = self.client.get(path, HTTP_X_ROOM_GRANT=self.get_grant())
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([m['content'] for m in response.json()['results']], ['hidden'])
+
+    def test_single_message_requires_a_grant(self):
+        path = f'/api/messages/{self.message.id}/?room_id={self.room.id}'
+        self.assertEqual(self.client.get(path).status_code, 403)
+        self.assertEqual(self.client.patch(path, {'content': 'edited'}, content_type='application/json').status_code, 403)
+        self.assertEqual(self.client.delete(path).status_code, 403)
+        # Without the room the message is not found at all
+        self.assertEqual(self.client.get(f'/api/messages/{self.message.id}/').status_code, 404)
+        response = self.client.get(path, HTTP_X_ROOM_GRANT=self.get_grant())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['content'], 'hidden')
+
+    def test_password_change_revokes_grants(self):
+        for async_reads, password in ((False, 'changed'), (True, 'changed again')):
+            with self.subTest(async_reads=async_reads), override_settings(CHAT_ASYNC_READ_API=async_reads):
+                grant = self.get_grant(self.room_password)
+                path = f'/api/messages/?room_id={self.room.id}'
+                self.assertEqual(self.client.get(path, HTTP_X_ROOM_GRANT=grant).status_code, 200)
+                self.room.set_password(password)
+                self.room.save()
+                self.room_password = password
+                self.assertEqual(self.client.get(path, HTTP_X_ROOM_GRANT=grant).status_code, 403)
+                self.assertEqual(self.client.get(path, HTTP_X_ROOM_GRANT=self.get_grant(password)).status_code, 200)
+
+
+class LocalRecentMessagesTests(SimpleTestCase):
+    """A process-memory buffer goes back to the database once its fill expires."""
+
+    def test_fill_expires_despite_appends(self):
+        recent = LocalRecentMessages(size=10, ttl=5)
+        with mock.patch('chat.history_cache.time.monotonic', return_value=100.0):
+            recent.fill(1, [{'id': 1}], recent.begin_fill(1), complete=True)
+        with mock.patch('chat.history_cache.time.monotonic', return_value=104.0):
+            recent.append(1, {'id': 2})
+            self.assertEqual(recent.get(1, 2), ([{'id': 1}, {'id': 2}], True))
+        with mock.patch('chat.history_cache.time.monotonic', return_value=106.0):
+            self.assertIsNone(recent.get(1, 2))
+        self.assertEqual(recent.bytes, 0)
+
+    def test_no_ttl_keeps_fill(self):
+        recent = LocalRecentMessages(size=10, ttl=None)
+        recent.fill(1, [{'id': 1}], recent.begin_fill(1), complete=True)
+        with mock.patch('chat.history_cache.time.monotonic', return_value=10.0 ** 9):
+            self.assertEqual(recent.get(1, 1), ([{'id': 1}], True))
+
+
+class WebSocketLoadBenchmarkTests(TransactionTestCase):
+    """
+    A small in-process run of ``manage.py bench_ws_load``. Consumers write
+    from the database executor's threads, so the rows must be committed.
+    """
+
+    def test_reports_every_scenario(self):
+        out = StringIO()
+        call_command(
+            'bench_ws_load', rooms=2, clients=4, storm_clients=10, hot_clients=6, senders=1,
+            rate=10, duration=1, stdout=out,
+        )
+        rows = {line.split()[0]: line.split() for line in out.getvalue().splitlines() if line}
+        for scenario in ('connect-storm', 'steady', 'hot-room'):
+            with self.subTest(scenario=scenario):
+                # scenario, conns, failed, conn/s, conn p50, conn p99, sent/s,
+                # recv/s, e2e p50, e2e p99, KiB/conn, errors
+                row = rows[scenario]
+                self.assertEqual(len(row), 12, row)
+                self.assertEqual(row[2], '0', 'connections failed')
+                self.assertEqual(row[11], '0', 'errors')
+                self.assertTrue(row[4].endswith('ms') and row[5].endswith('ms'), row)
+                if scenario != 'connect-storm':
+                    self.assertGreater(float(row[7]), 0, 'nothing delivered')
+                    self.assertTrue(row[8].endswith('ms') and row[9].endswith('ms'), row)
+        self.assertFalse(Room.objects.filter(name__startswith='bench_ws_').exists())
+        self.assertFalse(User.objects.filter(username='bench_ws_user').exists())
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ResumeReplayTests(TransactionTestCase):
+    """
+    Reconnecting with ``last_id`` replays what the client missed, including
+    messages with lower ids that committed after it, and drops the live
+    events for messages the replay already sent.
+    """
+
+    def setUp(self):
+        for cache in (user_cache, room_id_cache, room_password_cache):
+            cache.clear()
+        self.user = User.objects.create(username='resumer')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.room = Room.objects.create(name='resume', created_by=self.user)
+
+    def add_message(self, content, seconds_ago, nonce=None):
+        return Message.objects.create(
+            room=self.room, user=self.user, content=content, nonce=nonce,
+            created_at=timezone.now() - timedelta(seconds=seconds_ago),
+        )
+
+    def test_replays_late_commits_once(self):
+        self.add_message('old', 60)
+        # The client saw 'seen' but not 'late', whose transaction committed
+        # after it despite its lower id
+        self.add_message('late', 3)
+        seen = self.add_message('seen', 2)
+        self.add_message('buffered', 1, nonce='abc123')
+
+        frames = async_to_sync(self.resume)(seen.id)
+        replayed = [frame['content'] for frame in frames[0]]
+        self.assertIn('late', replayed)
+        self.assertIn('buffered', replayed)
+        self.assertNotIn('old', replayed)
+        self.assertEqual([frame['nonce'] for frame in frames[0] if 'nonce' in frame], ['abc123'])
+        live = [frame['content'] for batch in frames[1:] for frame in (batch if isinstance(batch, list) else [batch])]
+        self.assertEqual(live, ['fresh'])
+
+    def test_unknown_last_id_resyncs(self):
+        other = Room.objects.create(name='elsewhere', created_by=self.user)
+        stranger = Message.objects.create(room=other, user=self.user, content='not here')
+        self.add_message('first', 2)
+        self.assertEqual(async_to_sync(self.collect)(stranger.id), [{'type': 'resync', 'last_id': stranger.id}])
+
+    def test_archived_last_id_resyncs(self):
+        archived = self.add_message('ancient', 3600)
+        self.add_message('recent', 1)
+        archive_room(self.room.id, timezone.now() - timedelta(minutes=30))
+        self.assertEqual(async_to_sync(self.collect)(archived.id), [{'type': 'resync', 'last_id': archived.id}])
+
+    def test_replayed_keys_are_dropped_once_live_frames_pass(self):
+        seen = self.add_message('seen', 2)
+        missed = self.add_message('missed', 1)
+        frames = async_to_sync(self.collect)(seen.id, [missed.id, missed.id + 1, missed.id])
+        self.assertEqual([frame['content'] for frame in frames[0]], ['seen', 'missed'])
+        # The first live event for 'missed' is dropped; after a newer one the
+        # replayed keys are gone and nothing more is filtered
+        self.assertEqual([frame['id'] for frame in frames[1:]], [missed.id + 1, missed.id])
+
+    async def collect(self, last_id, live_ids=()):
+        from chat_project.asgi import application
+
+        communicator = WebsocketCommunicator(application, f'/ws/chat/resume/?token={self.token}&last_id={last_id}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        try:
+            frames = [json.loads(await communicator.receive_from())]
+            layer = get_channel_layer()
+            for message_id in live_ids:
+                message = {'id': message_id, 'content': 'live'}
+                await layer.group_send('chat_resume', {
+                    'type': 'chat_message', 'id': message_id, 'text': json.dumps(message),
+                })
+            while not await communicator.receive_nothing():
+                frames.append(json.loads(await communicator.receive_from()))
+        finally:
+            await communicator.disconnect()
+        return frames
+
+    async def resume(self, last_id):
+        from chat_project.asgi import application
+
+        communicator = WebsocketCommunicator(application, f'/ws/chat/resume/?token={self.token}&last_id={last_id}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        try:
+            frames = [json.loads(await communicator.receive_from())]
+            # The write-behind broadcast of the replayed message arrives without an id
+            layer = get_channel_layer()
+            for nonce, content in (('abc123', 'buffered'), ('def456', 'fresh')):
+                message = {'id': None, 'nonce': nonce, 'content': content}
+                await layer.group_send('chat_resume', {
+                    'type': 'chat_message', 'id': None, 'nonce': nonce, 'text': json.dumps(message),
+                })
+            frames.append(json.loads(await communicator.receive_from()))
+            self.assertTrue(await communicator.receive_nothing())
+        finally:
+            await communicator.disconnect()
+        return frames
+
+
+class LocalFanoutChannelLayerTests(SimpleTestCase):
+    """Two workers sharing an in-memory inner layer in place of Redis."""
+
+    def setUp(self):
+        self.inner = InMemoryChannelLayer()
+        self.worker = LocalFanoutChannelLayer(self.inner)
+        self.other_worker = LocalFanoutChannelLayer(self.inner)
+
+    async def join(self, layer, group, count):
+        channels = [await layer.new_channel() for _ in range(count)]
+        for channel in channels:
+            await layer.group_add(group, channel)
+        return channels
+
+    async def receive(self, layer, channel):
+        return await asyncio.wait_for(layer.receive(channel), 1)
+
+    async def assertNothingReceived(self, layer, channel):
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.1)
+
+    async def test_group_send_reaches_every_idle_receiver(self):
+        channels = await self.join(self.worker, 'room', 3)
+        # Each receive() starts while the others already wait on empty queues
+        receivers = [asyncio.ensure_future(self.worker.receive(channel)) for channel in channels]
+        await asyncio.sleep(0)
+        await self.worker.group_send('room', {'type': 'chat.message', 'text': 'hi'})
+        messages = await asyncio.wait_for(asyncio.gather(*receivers), 1)
+        self.assertEqual([message['text'] for message in messages], ['hi'] * 3)
+
+    async def test_one_inner_message_per_remote_worker(self):
+        local = await self.join(self.worker, 'room', 2)
+        remote = await self.join(self.other_worker, 'room', 3)
+        with mock.patch.object(self.inner, 'send', wraps=self.inner.send) as inner_send:
+            await self.worker.group_send('room', {'type': 'chat.message', 'text': 'hi'})
+        self.assertCountEqual(
+            [call.args[0] for call in inner_send.call_args_list],
+            [self.worker.worker_channel, self.other_worker.worker_channel],
+        )
+        for layer, channels in ((self.worker, local), (self.other_worker, remote)):
+            for channel in channels:
+                self.assertEqual((await self.receive(layer, channel))['text'], 'hi')
+
+    async def test_no_echo_to_origin_worker(self):
+        [channel] = await self.join(self.worker, 'room', 1)
+        await self.join(self.other_worker, 'room', 1)
+        await self.worker.group_send('room', {'type': 'chat.message', 'text': 'hi'})
+        self.assertEqual((await self.receive(self.worker, channel))['text'], 'hi')
+        await self.assertNothingReceived(self.worker, channel)
+
+    async def test_direct_send_across_workers(self):
+        await self.worker.new_channel()
+        channel = await self.other_worker.new_channel()
+        await self.worker.send(channel, {'type': 'chat.message', 'text': 'direct'})
+        self.assertEqual((await self.receive(self.other_worker, channel))['text'], 'direct')
+
+    async def test_expired_messages_drop_the_channel(self):
+        [stale, idle] = await self.join(self.worker, 'room', 2)
+        waiting = asyncio.ensure_future(self.worker.receive(idle))
+        await asyncio.sleep(0)
+        await self.worker.send(stale, {'type': 'chat.message', 'text': 'old'})
+        with mock.patch('chat.layers.time.time', return_value=time.time() + self.worker.expiry + 1):
+            self.worker._clean_expired()
+        self.assertNotIn(stale, self.worker.channels)
+        self.assertEqual(list(self.worker.groups['room']), [idle])
+        await self.worker.group_send('room', {'type': 'chat.message', 'text': 'hi'})
+        self.assertEqual((await asyncio.wait_for(waiting, 1))['text'], 'hi')
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CHAT_PASSWORD_HASHING={'ITERATIONS': 1000},
+)
+class RoomGrantWebSocketTests(TransactionTestCase):
+    def setUp(self):
+        for cache in (user_cache, room_id_cache, room_password_cache):
+            cache.clear()
+        self.user = User.objects.create(username='member')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        self.room = Room(name='private', created_by=self.user)
+        self.room.set_password('secret')
+        self.room.save()
+
+    async def connect(self, query=''):
+        from chat_project.asgi import application
+
+        communicator = WebsocketCommunicator(application, f'/ws/chat/private/?token={self.token}{query}')
+        connected, code = await communicator.connect()
+        await communicator.disconnect()
+        return connected, code
+
+    def test_connect_without_grant_is_closed(self):
+        self.assertEqual(async_to_sync(self.connect)(), (False, ROOM_ACCESS_DENIED_CLOSE_CODE))
+        self.assertEqual(async_to_sync(self.connect)('&grant=forged'), (False, ROOM_ACCESS_DENIED_CLOSE_CODE))
+
+    def test_connect_with_grant(self):
+        grant = issue_room_grant(self.room, self.user.id)
+        connected, _ = async_to_sync(self.connect)(f'&grant={grant}')
+        self.assertTrue(connected)
+
+
+class ImportChatTests(TestCase):
+    def import_lines(self, *lines):
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as f:
+            f.write('\n'.join(lines) + '\n')
+        self.addCleanup(os.remove, f.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_chat', f.name, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_imports_users_rooms_and_messages(self):
+        out, _ = self.import_lines(
+            json.dumps({'type': 'user', 'username': 'alice'}),
+            json.dumps({'type': 'room', 'name': 'lobby', 'created_by': 'alice'}),
+            json.dumps({'room': 'lobby', 'user': 'alice', 'content': 'hi', 'created_at': '2024-01-01T00:00:00Z'}),
+            json.dumps({'room': 'lobby', 'user': {'username': 'alice'}, 'content': 'again'}),
+        )
+        self.assertIn('Imported 1 users, 1 rooms and 2 messages', out)
+        room = Room.objects.get(name='lobby')
+        self.assertEqual(room.created_by.username, 'alice')
+        self.assertEqual(room.message_count, 2)
+        self.assertEqual(list(room.messages.order_by('created_at').values_list('content', flat=True)), ['hi', 'again'])
+
+    def test_bad_records_are_skipped(self):
+        out, err = self.import_lines(
+            json.dumps({'type': 'user', 'username': 'alice'}),
+            '{"type": "user", "username": ',
+            json.dumps(['not', 'an', 'object']),
+            json.dumps({'type': 'planet', 'name': 'mars'}),
+            json.dumps({'room': 'nowhere', 'user': 'alice', 'content': 'lost'}),
+            json.dumps({'type': 'user', 'username': 'bob'}),
+        )
+        self.assertIn('Imported 2 users, 0 rooms and 0 messages', out)
+        self.assertIn('skipped 4 records', out)
+        self.assertIn('record 2: JSONDecodeError', err)
+        self.assertIn('expected a JSON object', err)
+        self.assertEqual(User.objects.filter(username__in=['alice', 'bob']).count(), 2)
+
+
+class ArchivedHistoryTests(TestCase):
+    """History pages read across the boundary between the message table and the archive."""
+
+    def setUp(self):
+        for cache in (user_cache, room_id_cache, room_password_cache):
+            cache.clear()
+        self.user = User.objects.create(username='reader')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.room = Room.objects.create(name='lobby', created_by=self.user)
+        start = timezone.now() - timedelta(days=1)
+        # Pairs share a timestamp so the id breaks ties across the boundary too
+        for i in range(10):
+            Message.objects.create(
+                room=self.room, user=self.user, content=f'm{i}', created_at=start + timedelta(minutes=i // 2),
+            )
+        self.archived = archive_room(self.room.id, start + timedelta(minutes=3, seconds=30), segment_size=3)
+
+    def walk(self, path, direction):
+        contents = []
+        while path:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, response.content)
+            body = response.json()
+            page = [message['content'] for message in body['results']]
+            contents = page + contents if direction == 'older' else contents + page
+            path = body[direction]
+        return contents, body
+
+    def test_archive_moves_the_old_messages(self):
+        self.assertEqual(self.archived, 8)
+        self.assertEqual(MessageArchiveSegment.objects.filter(room=self.room).count(), 3)
+        self.assertEqual(list(Message.objects.filter(room=self.room).values_list('content', flat=True)), ['m8', 'm9'])
+        # Archived messages keep counting towards the room's stats
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_count, 10)
+
+    def test_pages_cross_the_boundary_both_ways(self):
+        expected = [f'm{i}' for i in range(10)]
+        for async_reads in (False, True):
+            with self.subTest(async_reads=async_reads), override_settings(CHAT_ASYNC_READ_API=async_reads):
+                older, oldest_page = self.walk(f'/api/messages/?room_id={self.room.id}&page_size=3', 'older')
+                self.assertEqual(older, expected)
+                # Back from the oldest page to the newest with the newer cursors
+                newer, _ = self.walk(oldest_page['newer'], 'newer')
+                self.assertEqual([message['content'] for message in oldest_page['results']] + newer, expected)
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        for cache in (user_cache, room_id_cache, room_password_cache):
+            cache.clear()
+        self.user = User.objects.create(username='searcher')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        self.room = Room.objects.create(name='lobby', created_by=self.user)
+        self.other_room = Room.objects.create(name='other', created_by=self.user)
+        self.private_room = Room.objects.create(name='private', created_by=self.user, password='pbkdf2_sha256$1$x$y')
+
+    def post(self, room, content):
+        return Message.objects.create(room=room, user=self.user, content=content)
+
+    def search(self, text, room=None):
+        ids, _ = search_message_ids(text, room_id=room.id if room else None)
+        return ids
+
+    def test_index_follows_inserts_edits_and_deletes(self):
+        message = self.post(self.room, 'the quick brown fox')
+        self.assertEqual(self.search('quick'), [message.id])
+        message.content = 'a slow green turtle'
+        message.save()
+        self.assertEqual(self.search('quick'), [])
+        self.assertEqual(self.search('turtle'), [message.id])
+        message.delete()
+        self.assertEqual(self.search('turtle'), [])
+
+    def test_search_is_scoped_to_a_room(self):
+        here = self.post(self.room, 'deploy tonight')
+        there = self.post(self.other_room, 'deploy tomorrow')
+        self.assertEqual(self.search('deploy', self.room), [here.id])
+        self.assertEqual(self.search('deploy', self.other_room), [there.id])
+        self.assertCountEqual(self.search('deploy'), [here.id, there.id])
+
+    def test_ranked_best_match_first_with_prefix(self):
+        once = self.post(self.room, 'release notes and other things to read later')
+        twice = self.post(self.room, 'release release')
+        self.assertEqual(self.search('release'), [twice.id, once.id])
+        self.assertEqual(self.search('rel'), [twice.id, once.id])
+
+    def test_global_search_leaves_out_password_rooms(self):
+        public = self.post(self.room, 'secret plans')
+        self.post(self.private_room, 'secret plans')
+        response = self.client.get('/api/messages/search/', {'q': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m['id'] for m in response.json()['results']], [public.id])
+        # The room itself is only searchable with a grant
+        response = self.client.get('/api/messages/search/', {'q': 'secret', 'room_id': self.private_room.id})
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(CHAT_SEARCH_RANK_WINDOW=3)
+    def test_reports_matches_left_unranked(self):
+        for i in range(2):
+            self.post(self.room, f'standup {i}')
+        self.assertFalse(self.client.get('/api/messages/search/', {'q': 'standup'}).json()['truncated'])
+        self.post(self.room, 'standup 2')
+        body = self.client.get('/api/messages/search/', {'q': 'standup'}).json()
+        self.assertTrue(body['truncated'])
+        self.assertEqual(len(body['results']), 3)
+
+
+class OutboundQueueTests(SimpleTestCase):
+    """The send queue against a fake socket that counts frames as the consumer does."""
+
+    def make_queue(self, **kwargs):
+        self.frames = []
+
+        async def send(text):
+            self.frames.append(text)
+            queue.count_sent()
+
+        queue = OutboundQueue(send, **kwargs)
+        self.addCleanup(queue.close)
+        return queue
+
+    async def settle(self):
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    async def test_writer_waits_for_acks(self):
+        queue = self.make_queue(max_unacked=2)
+        queue.start()
+        for i in range(4):
+            queue.put(f'f{i}', i)
+        await self.settle()
+        self.assertEqual(self.frames, ['f0', 'f1'])
+        queue.ack(1)
+        await self.settle()
+        self.assertEqual(self.frames, ['f0', 'f1', 'f2'])
+        # Acks past what was sent don't open the window any further
+        queue.ack(100)
+        self.assertEqual(queue.acked, 3)
+        await self.settle()
+        self.assertEqual(self.frames, ['f0', 'f1', 'f2', 'f3'])
+        self.assertEqual(queue.unacked, 1)
+
+    async def test_drop_oldest(self):
+        queue = self.make_queue(max_size=3, policy=DROP_OLDEST)
+        for i in range(5):
+            queue.put(f'f{i}', i)
+        self.assertEqual((len(queue), queue.dropped), (3, 2))
+        queue.start()
+        await self.settle()
+        self.assertEqual(self.frames, ['f2', 'f3', 'f4'])
+        self.assertEqual(queue.last_id, 4)
+
+    async def test_coalesce_into_one_resync(self):
+        queue = self.make_queue(max_size=3, max_unacked=2, policy=COALESCE)
+        queue.start()
+        # Two frames go out, then the client stops acking
+        for i in range(1, 10):
+            queue.put(f'f{i}', i)
+            await self.settle()
+        self.assertEqual(self.frames, ['f1', 'f2'])
+        self.assertEqual(queue.dropped, 7)
+        queue.ack(2)
+        await self.settle()
+        resyncs = [json.loads(frame) for frame in self.frames[2:]]
+        self.assertEqual(resyncs, [{'type': 'resync', 'last_id': 2}])
+
+    async def test_disconnect(self):
+        overflowed = []
+
+        async def on_overflow(last_id):
+            overflowed.append(last_id)
+
+        queue = self.make_queue(max_size=2, max_unacked=1, policy=DISCONNECT, on_overflow=on_overflow)
+        queue.start()
+        for i in range(1, 5):
+            queue.put(f'f{i}', i)
+            await self.settle()
+        self.assertEqual(overflowed, [1])
+        self.assertEqual(queue.dropped, 3)
+        # Nothing more is queued or sent once the connection is being closed
+        queue.put('late', 5)
+        queue.ack(1)
+        await self.settle()
+        self.assertEqual(self.frames, ['f1'])
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CHAT_SEND_QUEUE={'ENABLED': True, 'MAX_SIZE': 2, 'MAX_UNACKED': 1, 'POLICY': DISCONNECT},
+    CHAT_OUTBOUND_BATCHING={'ENABLED': False},
+)
+class SlowConsumerTests(TransactionTestCase):
+    def setUp(self):
+        for cache in (user_cache, room_id_cache, room_password_cache):
+            cache.clear()
+        self.user = User.objects.create(username='slow')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        Room.objects.create(name='busy', created_by=self.user)
+
+    async def flood(self):
+        from chat_project.asgi import application
+
+        communicator = WebsocketCommunicator(application, f'/ws/chat/busy/?ack=1&token={self.token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        layer = get_channel_layer()
+        for i in range(1, 6):
+            message = {'id': i, 'content': f'm{i}'}
+            await layer.group_send('chat_busy', {'type': 'chat_message', 'id': i, 'text': json.dumps(message)})
+        frames = []
+        while True:
+            output = await communicator.receive_output(1)
+            if output['type'] == 'websocket.close':
+                return frames, output['code']
+            frames.append(json.loads(output['text']))
+
+    def test_unacked_client_is_disconnected_with_resume_hint(self):
+        frames, code = async_to_sync(self.flood)()
+        self.assertEqual(code, SLOW_CONSUMER_CLOSE_CODE)
+        self.assertEqual(frames, [{'id': 1, 'content': 'm1'}, {'type': 'resume', 'last_id': 1}])
+
+
+@override_settings(CHAT_PASSWORD_HASHING={'ITERATIONS': 1000, 'RETRY_AFTER': 3})
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        for cache in (user_cache, room_id_cache, room_password_cache):
+            cache.clear()
+        self.user = User.objects.create(username='hasher', password=make_password('secret'))
+
+    def saturated_pool(self):
+        """A one-thread pool with no queue, kept busy until the test ends."""
+        pool = PasswordHashingPool(workers=1, max_queue=0)
+        release = threading.Event()
+        pool.submit(release.wait)
+        self.addCleanup(release.set)
+        return pool
+
+    def login(self, password='secret'):
+        return self.client.post(
+            '/api/users/login/', {'username': 'hasher', 'password': password}, content_type='application/json',
+        )
+
+    def test_hasher_uses_configured_iterations(self):
+        self.assertEqual(ConfiguredPBKDF2PasswordHasher().iterations, 1000)
+        with override_settings(CHAT_PASSWORD_HASHING={'ITERATIONS': 1234}):
+            self.assertEqual(ConfiguredPBKDF2PasswordHasher().iterations, 1234)
+            self.assertTrue(make_password('secret').startswith('pbkdf2_sha256$1234$'))
+
+    def test_pool_rejects_work_beyond_its_queue(self):
+        pool = PasswordHashingPool(workers=1, max_queue=1)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        running, queued = pool.submit(release.wait), pool.submit(release.wait)
+        with self.assertRaises(HashingPoolSaturated):
+            pool.submit(release.wait)
+        release.set()
+        running.result(1), queued.result(1)
+        self.assertEqual(pool.call(make_password, 'again')[:14], 'pbkdf2_sha256$')
+
+    def test_saturated_login_is_429_with_retry_after(self):
+        with mock.patch('chat.views.get_hashing_pool', return_value=self.saturated_pool()):
+            response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_saturated_room_password_check_is_429_with_retry_after(self):
+        room = Room(name='private', created_by=self.user)
+        room.set_password('secret')
+        room.save()
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(self.user).access_token}'
+        with mock.patch('chat.views.get_hashing_pool', return_value=self.saturated_pool()):
+            response = self.client.post(f'/api/rooms/{room.id}/check_password/', {'password': 'secret'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_login_rehashes_at_the_configured_cost(self):
+        self.assertIn('$1000$', self.user.password)
+        with override_settings(CHAT_PASSWORD_HASHING={'ITERATIONS': 2000}):
+            self.assertEqual(self.login('wrong').status_code, 401)
+            self.user.refresh_from_db()
+            self.assertIn('$1000$', self.user.password)
+            self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertIn('$2000$', self.user.password)
+        self.assertTrue(self.user.check_password('secret'))
+
+
+class MessageWriteBufferTests(SimpleTestCase):
+    def pending(self, nonce):
+        return PendingMessage(
+            room_id=1, user_id=1, content='hi', created_at=timezone.now(), nonce=nonce, reply_channel=None,
+        )
+
+    async def test_full_buffer_rejects_messages(self):
+        buffer = MessageWriteBuffer(batch_size=10, flush_interval=60, max_queue=2)
+        buffer.enqueue(self.pending('a'))
+        buffer.enqueue(self.pending('b'))
+        with self.assertRaises(BufferFull):
+            buffer.enqueue(self.pending('c'))
+        self.assertEqual(len(buffer), 2)
+        buffer._cancel_timer()
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CHAT_WRITE_BEHIND={'ENABLED': True, 'FLUSH_INTERVAL': 0.01},
+)
+class WriteBehindTests(TransactionTestCase):
+    """
+    With write-behind on, messages are broadcast before they are saved; the
+    sender hears about it when the buffer is full or the batch write fails.
+    """
+
+    def setUp(self):
+        for cache in (user_cache, room_id_cache, room_password_cache):
+            cache.clear()
+        self.user = User.objects.create(username='writer')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        Room.objects.create(name='buffered', created_by=self.user)
+        # A fresh process-wide buffer for each test
+        patcher = mock.patch('chat.persistence._buffer', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def send(self, content):
+        from chat_project.asgi import application
+
+        communicator = WebsocketCommunicator(application, f'/ws/chat/buffered/?token={self.token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        try:
+            await communicator.send_to(text_data=json.dumps({'type': 'chat_message', 'content': content}))
+            frames = []
+            # Wait out the flush so a persist_failed frame has time to arrive
+            while not await communicator.receive_nothing(timeout=0.5):
+                frames.append(json.loads(await communicator.receive_from()))
+        finally:
+            await communicator.disconnect()
+        return frames
+
+    def test_message_is_saved_after_broadcast(self):
+        frames = async_to_sync(self.send)('kept')
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]['content'], 'kept')
+        self.assertTrue(Message.objects.filter(content='kept', nonce=frames[0]['nonce']).exists())
+
+    def test_failed_write_is_reported_to_sender(self):
+        with mock.patch.object(Message.objects, 'bulk_create', side_effect=DatabaseError('disk I/O error')):
+            frames = async_to_sync(self.send)('lost')
+        broadcast, error = frames
+        self.assertEqual(broadcast['content'], 'lost')
+        self.assertEqual(error, {'type': 'error', 'error': 'Message could not be saved', 'nonce': broadcast['nonce']})
+        self.assertFalse(Message.objects.filter(content='lost').exists())
+
+    @override_settings(CHAT_WRITE_BEHIND={'ENABLED': True, 'MAX_QUEUE': 0})
+    def test_full_buffer_rejects_message(self):
+        frames = async_to_sync(self.send)('dropped')
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]['type'], 'error')
+        self.assertEqual(frames[0]['error'], 'Server is busy, message was not sent')
+        self.assertFalse(Message.objects.filter(content='dropped').exists())
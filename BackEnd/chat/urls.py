@@ -1,7 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
-from .views import UserViewSet, RoomViewSet, MessageViewSet
+from .views import (
+    UserViewSet, RoomViewSet, MessageViewSet, login, me, messages, metrics, register, room_detail, rooms,
+)
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
@@ -9,6 +11,17 @@ router.register(r'rooms', RoomViewSet)
 router.register(r'messages', MessageViewSet)
 
 urlpatterns = [
+    # Async, pool-backed password endpoints; listed before the router so
+    # they take precedence over the viewset routes
+    path('users/login/', login, name='login'),
+    path('users/register/', register, name='register'),
+    # Async read endpoints (see chat.views.rooms); writes fall through to
+    # the viewsets
+    path('users/me/', me, name='user-me'),
+    path('rooms/', rooms, name='room-list'),
+    path('rooms/<int:pk>/', room_detail, name='room-detail'),
+    path('messages/', messages, name='message-list'),
     path('', include(router.urls)),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('metrics/', metrics, name='metrics'),
 ] 
\ No newline at end of file
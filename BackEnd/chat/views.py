@@ -2,13 +2,30 @@ from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from .models import Room, Message, User
 from rest_framework import viewsets, permissions, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import NotFound, PermissionDenied, Throttled
+from rest_framework.request import Request
 from rest_framework.response import Response
 from .serializers import RoomSerializer, MessageSerializer, UserSerializer, UserCreateSerializer
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from django.contrib.auth.hashers import check_password
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
+from django.contrib.auth.hashers import make_password
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
 from rest_framework_simplejwt.tokens import RefreshToken
+from django.conf import settings
 from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models import F, Q
+from .export import aiterate, export_rows, ndjson_chunks
+from .grants import aroom_access_allowed, get_grant_ttl, issue_room_grant, room_access_allowed
+from .hashing import HashingPoolSaturated, get_hashing_pool, get_hashing_settings, hash_password, verify_password
+from .history_cache import get_recent_messages
+from .metrics import registry
+from .pagination import AFTER, MessageKeysetPagination, MessageSearchPagination, decode_cursor
+from .read_markers import mark_read, with_unread_counts
+from .search import search_messages
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -38,13 +55,122 @@ def index(request):
         'rooms': rooms
     })
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    return Response(registry.snapshot())
+
+def token_pair(user):
+    refresh = RefreshToken.for_user(user)
+    return {
+        'access': str(refresh.access_token),
+        'refresh': str(refresh),
+    }
+
+def check_user_password(user, raw_password):
+    """
+    Verify a password on the hashing pool from a synchronous view, saving the
+    rehashed password when the stored one was made at another cost.
+    """
+    try:
+        valid, upgraded = get_hashing_pool().call(verify_password, raw_password, user.password)
+    except HashingPoolSaturated:
+        raise Throttled(wait=get_hashing_settings()['RETRY_AFTER'])
+    if valid and upgraded:
+        user.password = upgraded
+        user.save(update_fields=['password'])
+    return valid
+
+def set_user_password(user, raw_password):
+    try:
+        user.password = hash_password(raw_password)
+    except HashingPoolSaturated:
+        raise Throttled(wait=get_hashing_settings()['RETRY_AFTER'])
+
+def hashing_saturated_response():
+    retry_after = get_hashing_settings()['RETRY_AFTER']
+    response = JsonResponse(
+        {'error': 'Too many sign-in attempts in progress, please retry shortly'},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+def parse_json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+async def login(request):
+    """
+    Async login: the password is checked on the bounded hashing pool, so a
+    burst of logins neither blocks the worker nor queues without limit.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    data = parse_json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return JsonResponse({'error': 'Please provide both username and password'}, status=400)
+
+    user = await User.objects.filter(username=username).afirst()
+    if user is not None:
+        try:
+            valid, upgraded = await get_hashing_pool().run(verify_password, password, user.password)
+        except HashingPoolSaturated:
+            return hashing_saturated_response()
+        if valid:
+            if upgraded:
+                # Stored at an outdated cost; keep the hash made with the configured one
+                user.password = upgraded
+                await user.asave(update_fields=['password'])
+            user_data = await sync_to_async(lambda: UserSerializer(user).data)()
+            return JsonResponse({'user': user_data, 'tokens': token_pair(user)})
+
+    return JsonResponse({'error': 'Invalid credentials'}, status=401)
+
+login.csrf_exempt = True
+
+async def register(request):
+    """Async registration, hashing the new password on the bounded pool."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    data = parse_json_body(request)
+    if data is None:
+        return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+    logger.info(f"Attempting to create user with username: {data.get('username')}")
+
+    serializer = UserCreateSerializer(data=data, context={})
+    if not await sync_to_async(serializer.is_valid)():
+        logger.error(f"User creation failed: {serializer.errors}")
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        serializer.context['password_hash'] = await get_hashing_pool().run(
+            make_password, serializer.validated_data['password']
+        )
+    except HashingPoolSaturated:
+        return hashing_saturated_response()
+
+    user = await sync_to_async(serializer.save)()
+    user_data = await sync_to_async(lambda: serializer.data)()
+    logger.info(f"User created successfully: {user.username}")
+    return JsonResponse({'user': user_data, 'tokens': token_pair(user)}, status=status.HTTP_201_CREATED)
+
+register.csrf_exempt = True
+
 class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+    queryset = User.objects.prefetch_related('groups')
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
 
     def get_permissions(self):
-        if self.action in ['create', 'login']:
+        if self.action == 'create':
             return [AllowAny()]
         return [IsAuthenticated()]
 
@@ -57,44 +183,18 @@ class UserViewSet(viewsets.ModelViewSet):
         logger.info(f"Attempting to create user with username: {request.data.get('username')}")
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
-            refresh = RefreshToken.for_user(user)
+            try:
+                user = serializer.save()
+            except HashingPoolSaturated:
+                raise Throttled(wait=get_hashing_settings()['RETRY_AFTER'])
             logger.info(f"User created successfully: {user.username}")
             return Response({
                 'user': serializer.data,
-                'tokens': {
-                    'access': str(refresh.access_token),
-                    'refresh': str(refresh),
-                }
+                'tokens': token_pair(user),
             }, status=status.HTTP_201_CREATED)
         logger.error(f"User creation failed: {serializer.errors}")
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=False, methods=['post'])
-    def login(self, request):
-        username = request.data.get('username')
-        password = request.data.get('password')
-        
-        if not username or not password:
-            return Response({'error': 'Please provide both username and password'}, status=400)
-            
-        # Try to get user directly from database
-        try:
-            user = User.objects.get(username=username)
-            if user.check_password(password):
-                refresh = RefreshToken.for_user(user)
-                return Response({
-                    'user': UserSerializer(user).data,
-                    'tokens': {
-                        'access': str(refresh.access_token),
-                        'refresh': str(refresh)
-                    }
-                })
-        except User.DoesNotExist:
-            pass
-            
-        return Response({'error': 'Invalid credentials'}, status=401)
-
     @action(detail=False, methods=['post'])
     def logout(self, request):
         try:
@@ -129,9 +229,9 @@ class UserViewSet(viewsets.ModelViewSet):
         data = request.data.copy()
         if 'password' in data:
             current_password = data.pop('current_password', None)
-            if not current_password or not user.check_password(current_password):
+            if not current_password or not check_user_password(user, current_password):
                 return Response({'error': 'Current password is incorrect'}, status=status.HTTP_400_BAD_REQUEST)
-            user.set_password(data.pop('password'))
+            set_user_password(user, data.pop('password'))
 
         serializer = UserSerializer(user, data=data, partial=True)
         if serializer.is_valid():
@@ -152,41 +252,318 @@ class UserViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Current password and new password are required'}, 
                           status=status.HTTP_400_BAD_REQUEST)
 
-        if not user.check_password(current_password):
+        if not check_user_password(user, current_password):
             return Response({'error': 'Current password is incorrect'}, 
                           status=status.HTTP_400_BAD_REQUEST)
 
-        user.set_password(new_password)
+        set_user_password(user, new_password)
         user.save()
         return Response({'message': 'Password changed successfully'})
 
 class RoomViewSet(viewsets.ModelViewSet):
-    queryset = Room.objects.all()
+    queryset = Room.objects.select_related('created_by', 'last_message_user').prefetch_related('created_by__groups')
     serializer_class = RoomSerializer
     permission_classes = [AllowAny]
 
+    access_grant = None
+
+    def get_queryset(self):
+        return room_queryset(self.request.query_params.get('ordering'), self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        # The creator already knows the password, so let them straight in
+        if self.access_grant:
+            response.data['grant'] = self.access_grant
+            response.data['grant_expires_in'] = get_grant_ttl()
+        return response
+
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        room = serializer.save(created_by=self.request.user)
+        if room.password:
+            self.access_grant = issue_room_grant(room, self.request.user.id)
 
     @action(detail=True, methods=['post'])
     def check_password(self, request, pk=None):
         room = self.get_object()
         password = request.data.get('password')
-        if room.check_password(password):
-            return Response({'success': True})
+        try:
+            valid = get_hashing_pool().call(room.check_password, password)
+        except HashingPoolSaturated:
+            raise Throttled(wait=get_hashing_settings()['RETRY_AFTER'])
+        if valid:
+            # The slow password hash runs once; the grant is checked from then on
+            return Response({
+                'success': True,
+                'grant': issue_room_grant(room, request.user.id),
+                'grant_expires_in': get_grant_ttl(),
+            })
         return Response({'success': False}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
+    def export(self, request, pk=None):
+        """
+        Stream the room's full history as NDJSON, oldest first. ``?cursor=``
+        (the ``cursor`` of the last line received) resumes an interrupted
+        export; ``?compress=gzip`` compresses the stream.
+        """
+        room = self.get_object()
+        grant = request.headers.get('X-Room-Grant') or request.query_params.get('grant')
+        if not room_access_allowed(room.id, request.user.id, grant):
+            raise PermissionDenied('A valid room access grant is required for this room')
+        position = None
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            created_at, message_id, direction = decode_cursor(cursor)
+            if direction != AFTER:
+                raise NotFound('Invalid cursor')
+            position = (created_at, message_id)
+        compress = request.query_params.get('compress') == 'gzip'
+
+        chunks = ndjson_chunks(export_rows(room.id, position), compress=compress)
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiterate(chunks)
+        response = StreamingHttpResponse(chunks, content_type='application/gzip' if compress else 'application/x-ndjson')
+        filename = f'room-{room.id}.ndjson' + ('.gz' if compress else '')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def read(self, request, pk=None):
+        # The route accepts any pk; a non-numeric one would fail in int()
+        if not str(pk).isdigit() or not mark_read(request.user.id, int(pk)):
+            raise NotFound('Room not found')
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def unread(self, request):
+        # Everything the sidebar needs, in a single query
+        rows = with_unread_counts(Room.objects.all(), request.user.id).order_by(
+            F('last_message_at').desc(nulls_last=True), '-id'
+        ).values('id', 'name', 'password', 'message_count', 'unread_count', 'last_message_at')
+        return Response([
+            {
+                'id': row['id'],
+                'name': row['name'],
+                'has_password': bool(row['password']),
+                'message_count': row['message_count'],
+                'unread_count': row['unread_count'],
+                'last_message_at': row['last_message_at'],
+            }
+            for row in rows
+        ])
+
 class MessageViewSet(viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [AllowAny]
+    pagination_class = MessageKeysetPagination
+
+    allowed_room_id = None
+
+    def check_room_access(self, room_id):
+        # list() checks before get_queryset() does; verify the grant once
+        if room_id == self.allowed_room_id:
+            return
+        grant = self.request.headers.get('X-Room-Grant') or self.request.query_params.get('grant')
+        if not room_access_allowed(room_id, self.request.user.id, grant):
+            raise PermissionDenied('A valid room access grant is required for this room')
+        self.allowed_room_id = room_id
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        self.check_room_access(serializer.validated_data['room'].id)
+        with transaction.atomic():
+            serializer.save(user=self.request.user)
 
-    def get_queryset(self):
-        queryset = Message.objects.all()
-        room_id = self.request.query_params.get('room_id', None)
+    def perform_update(self, serializer):
+        # A message may only be moved into a room the user could post to
+        if 'room' in serializer.validated_data:
+            self.check_room_access(serializer.validated_data['room'].id)
+        serializer.save()
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            return Response({'error': 'Provide a search query with ?q='}, status=status.HTTP_400_BAD_REQUEST)
+        room_id = request.query_params.get('room_id', '')
+        if room_id and not room_id.isdigit():
+            return Response({'error': 'Invalid room_id'}, status=status.HTTP_400_BAD_REQUEST)
+        room_id = int(room_id) if room_id else None
         if room_id is not None:
-            queryset = queryset.filter(room_id=room_id)
-        return queryset.order_by('created_at') 
\ No newline at end of file
+            self.check_room_access(room_id)
+
+        paginator = MessageSearchPagination()
+        page = paginator.paginate_search(
+            lambda limit, offset: search_messages(text, room_id=room_id, limit=limit, offset=offset),
+            request,
+        )
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    def list(self, request, *args, **kwargs):
+        recent_messages = get_recent_messages()
+        room_id = request.query_params.get('room_id', '')
+        if room_id.isdigit():
+            self.check_room_access(int(room_id))
+        if recent_messages is None or not room_id.isdigit() or 'cursor' in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        # The newest page of a room can come straight from the ring buffer
+        room_id = int(room_id)
+        page_size = self.paginator.get_page_size(request)
+        try:
+            cached = recent_messages.get(room_id, page_size)
+            token = recent_messages.begin_fill(room_id) if cached is None else None
+        except Exception as e:
+            logger.error(f'Recent message cache unavailable: {str(e)}')
+            return super().list(request, *args, **kwargs)
+        if cached is not None:
+            results, exhaustive = cached
+            return self.paginator.get_paginated_response(
+                self.paginator.paginate_cached(request, results, has_more=not exhaustive)
+            )
+
+        response = super().list(request, *args, **kwargs)
+        try:
+            recent_messages.fill(room_id, response.data['results'], token, complete=not response.data['older'])
+        except Exception as e:
+            logger.error(f'Error filling recent message cache: {str(e)}')
+        return response
+
+    def get_queryset(self):
+        # Every action reads through here, so a room's messages, including
+        # single ones by id, are only reachable after its grant check
+        room_id = self.request.query_params.get('room_id')
+        if room_id is None:
+            return message_queryset()
+        if not room_id.isdigit():
+            raise NotFound('Room not found')
+        self.check_room_access(int(room_id))
+        return message_queryset(int(room_id))
+
+def room_queryset(ordering=None, user=None):
+    queryset = RoomViewSet.queryset.all()
+    if user is not None and user.is_authenticated:
+        queryset = with_unread_counts(queryset, user.id)
+    if ordering == 'activity':
+        # Most recently active first, from the stats kept on each room
+        queryset = queryset.order_by(F('last_message_at').desc(nulls_last=True), '-id')
+    return queryset
+
+def message_queryset(room_id=None):
+    queryset = Message.objects.select_related('user')
+    if room_id is not None:
+        queryset = queryset.filter(room_id=room_id)
+    else:
+        # Messages of password-protected rooms are only listed per room,
+        # behind a grant check
+        queryset = queryset.filter(Q(room__password__isnull=True) | Q(room__password=''))
+    return queryset.order_by('created_at')
+
+# Async versions of the hot read endpoints. GET requests are served on the
+# event loop, with queries going through Django's async ORM, so reads don't
+# each hold a sync worker thread; every other method (and every request when
+# CHAT_ASYNC_READ_API is off) is handed to the viewset as before.
+
+room_list_view = sync_to_async(RoomViewSet.as_view({'get': 'list', 'post': 'create'}))
+room_detail_view = sync_to_async(RoomViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+}))
+message_list_view = sync_to_async(MessageViewSet.as_view({'get': 'list', 'post': 'create'}))
+user_me_view = sync_to_async(UserViewSet.as_view({'get': 'me'}))
+
+def api_response(data, status=status.HTTP_200_OK):
+    # Same compact encoding as DRF's JSONRenderer
+    return JsonResponse(data, status=status, safe=False, json_dumps_params={'separators': (',', ':')})
+
+def serve_async(request):
+    return request.method == 'GET' and getattr(settings, 'CHAT_ASYNC_READ_API', True)
+
+async def call_recent_messages(recent_messages, method, *args):
+    # The in-process buffer is only memory; Redis is network I/O
+    if recent_messages.blocking:
+        return await sync_to_async(getattr(recent_messages, method), thread_sensitive=False)(*args)
+    return getattr(recent_messages, method)(*args)
+
+async def rooms(request):
+    if not serve_async(request):
+        return await room_list_view(request)
+    room_list = [room async for room in room_queryset(request.GET.get('ordering'), request._user)]
+    return api_response(RoomSerializer(room_list, many=True, context={'request': request}).data)
+
+rooms.csrf_exempt = True
+
+async def room_detail(request, pk):
+    if not serve_async(request):
+        return await room_detail_view(request, pk=pk)
+    room = await room_queryset(user=request._user).filter(pk=pk).afirst()
+    if room is None:
+        return api_response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    return api_response(RoomSerializer(room, context={'request': request}).data)
+
+room_detail.csrf_exempt = True
+
+async def messages(request):
+    room_id = request.GET.get('room_id', '')
+    if not serve_async(request) or (room_id and not room_id.isdigit()):
+        return await message_list_view(request)
+
+    if room_id:
+        room_id = int(room_id)
+        grant = request.headers.get('X-Room-Grant') or request.GET.get('grant')
+        # request._user is set by AuthenticationLoggingMiddleware
+        if not await aroom_access_allowed(room_id, request._user.id, grant):
+            return api_response(
+                {'detail': 'A valid room access grant is required for this room'},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+    paginator = MessageKeysetPagination()
+    page_request = Request(request)
+    recent_messages = get_recent_messages() if room_id and 'cursor' not in request.GET else None
+    token = None
+    if recent_messages is not None:
+        try:
+            cached = await call_recent_messages(recent_messages, 'get', room_id, paginator.get_page_size(page_request))
+            if cached is None:
+                token = await call_recent_messages(recent_messages, 'begin_fill', room_id)
+            else:
+                results, exhaustive = cached
+                paginator.paginate_cached(page_request, results, has_more=not exhaustive)
+                return api_response(paginated_body(paginator, results))
+        except Exception as e:
+            logger.error(f'Recent message cache unavailable: {str(e)}')
+            recent_messages = None
+
+    try:
+        page = await paginator.apaginate_queryset(message_queryset(room_id or None), page_request)
+    except NotFound as e:
+        return api_response({'detail': str(e.detail)}, status=status.HTTP_404_NOT_FOUND)
+    body = paginated_body(paginator, MessageSerializer(page, many=True, context={'request': request}).data)
+
+    if recent_messages is not None:
+        try:
+            await call_recent_messages(
+                recent_messages, 'fill', room_id, body['results'], token, not body['older'],
+            )
+        except Exception as e:
+            logger.error(f'Error filling recent message cache: {str(e)}')
+    return api_response(body)
+
+messages.csrf_exempt = True
+
+def paginated_body(paginator, results):
+    return {
+        'older': paginator.get_older_link(),
+        'newer': paginator.get_newer_link(),
+        'results': results,
+    }
+
+async def me(request):
+    if not serve_async(request):
+        return await user_me_view(request)
+    user = request._user
+    logger.info(f"Fetching current user info for: {user.username}")
+    return api_response(await sync_to_async(lambda: UserSerializer(user, context={'request': request}).data)())
+
+me.csrf_exempt = True
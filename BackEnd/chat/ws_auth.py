@@ -0,0 +1,81 @@
+import logging
+import time
+from urllib.parse import parse_qs
+
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .cache import get_cached_user, user_cache
+from .db_executor import chat_database_sync_to_async
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class ChatPrincipal:
+    """The little a chat connection needs to know about its user."""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    __slots__ = ('id', 'username')
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.username
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticates WebSocket connections from the ``token`` query parameter.
+
+    The access token's signature and expiry are verified once, the user is
+    looked up through the shared user snapshot cache, and a ``ChatPrincipal``
+    (or ``AnonymousUser``) is put in ``scope['user']``. The time the
+    handshake started is kept in ``scope['connect_started']`` so consumers
+    can report connect latency.
+    """
+
+    async def __call__(self, scope, receive, send):
+        started = time.perf_counter()
+        scope = dict(scope, connect_started=started)
+        scope['user'] = await self.authenticate(scope)
+        registry.histogram('ws.auth_ms').observe((time.perf_counter() - started) * 1000)
+        return await super().__call__(scope, receive, send)
+
+    async def authenticate(self, scope):
+        query_params = parse_qs(scope.get('query_string', b'').decode())
+        token = query_params.get('token', [None])[0]
+        if not token:
+            return AnonymousUser()
+
+        try:
+            user_id = AccessToken(token).get(api_settings.USER_ID_CLAIM)
+        except TokenError as e:
+            logger.warning(f'Rejected WebSocket token: {str(e)}')
+            return AnonymousUser()
+        if user_id is None:
+            return AnonymousUser()
+
+        # A cache hit avoids the thread hop entirely
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await chat_database_sync_to_async(get_cached_user)(user_id)
+        if user is None or not user.is_active:
+            logger.warning(f'User not found for id: {user_id}')
+            return AnonymousUser()
+        return ChatPrincipal(user.id, user.username)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return JWTAuthMiddleware(inner)
@@ -82,17 +82,78 @@ ASGI_APPLICATION = 'chat_project.asgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# CHAT_DB_PROFILE picks the database: 'sqlite' (the default) or 'postgres'.
+# Both keep connections open for CONN_MAX_AGE seconds so the chat database
+# threads (see CHAT_DB_EXECUTOR) reuse theirs instead of reconnecting per call
+CHAT_DB_PROFILE = os.environ.get('CHAT_DB_PROFILE', 'sqlite')
+
+if CHAT_DB_PROFILE == 'postgres':
+    # Django 4.2 with psycopg2 has no built-in pool: each thread keeps one
+    # persistent connection, health-checked before reuse, so the pool size is
+    # bounded by the worker threads. Put PgBouncer in front for more clients,
+    # with CHAT_DB_PGBOUNCER=true for transaction pooling mode
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'chat'),
+            'USER': os.environ.get('POSTGRES_USER', 'chat'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': int(os.environ.get('CHAT_DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('CHAT_DB_PGBOUNCER', 'false').lower() == 'true',
+            'OPTIONS': {
+                'connect_timeout': 5,
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            # Adds Django 5.1's transaction_mode option (see chat.backends.sqlite3)
+            'ENGINE': 'chat.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # A file rather than the default shared-cache memory database,
+            # whose table locks fail at once instead of waiting for the
+            # timeout below when consumers write from several threads
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+            'CONN_MAX_AGE': int(os.environ.get('CHAT_DB_CONN_MAX_AGE', 60)),
+            'OPTIONS': {
+                # Seconds a writer waits for the file lock before "database is locked"
+                'timeout': 20,
+                # Atomic blocks take the write lock up front, so the wait above
+                # applies to them too
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
     }
+
+# PRAGMAs applied to every new SQLite connection (see chat.signals). WAL lets
+# readers run alongside the single writer, and synchronous=NORMAL is durable
+# across application crashes in WAL mode while syncing far less often
+CHAT_SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('CHAT_SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.environ.get('CHAT_SQLITE_SYNCHRONOUS', 'normal'),
+    'busy_timeout': 20000,  # milliseconds
+    'cache_size': -20000,  # KiB
+    'temp_store': 'memory',
 }
 
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
+# PBKDF2 at CHAT_PASSWORD_HASHING['ITERATIONS']; hashes made at another cost
+# are upgraded on the next successful login
+PASSWORD_HASHERS = [
+    'chat.hashing.ConfiguredPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -151,6 +212,137 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Single-process in-memory layer for development and benchmarks (see
+# `manage.py bench_ws_load --spawn-daphne`); it does not reach other workers
+if os.environ.get('CHAT_CHANNEL_LAYER') == 'memory':
+    CHANNEL_LAYERS['default'] = {'BACKEND': 'channels.layers.InMemoryChannelLayer'}
+
+# Deliver to consumers in this process directly and use Redis only once per
+# remote worker with members in the group (see chat.layers)
+if os.environ.get('CHAT_LOCAL_FANOUT', 'false').lower() == 'true':
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'chat.layers.LocalFanoutChannelLayer',
+        'CONFIG': {
+            'inner': CHANNEL_LAYERS['default'],
+            'capacity': 1500,
+            'expiry': 10,
+        },
+    }
+
+# Process-wide room name -> id cache used by the chat consumers
+CHAT_ROOM_CACHE_SIZE = 10000
+CHAT_ROOM_CACHE_TTL = 300  # seconds
+
+# Lifetime of the signed grant issued after a successful room password check;
+# connects and history reads verify the grant instead of the password
+CHAT_ROOM_GRANT_TTL = 12 * 60 * 60  # seconds
+
+# Password hashing runs on a bounded pool of WORKERS threads with room for
+# MAX_QUEUE waiting hashes; beyond that login/registration answer 429 with
+# Retry-After: RETRY_AFTER (see chat.hashing)
+CHAT_PASSWORD_HASHING = {
+    'WORKERS': int(os.environ.get('CHAT_HASH_WORKERS', 4)),
+    'MAX_QUEUE': int(os.environ.get('CHAT_HASH_MAX_QUEUE', 32)),
+    'ITERATIONS': int(os.environ.get('CHAT_PASSWORD_ITERATIONS', 600000)),
+    'RETRY_AFTER': 1,  # seconds
+}
+
+# Short-lived cache of authenticated users keyed by id, so token-authenticated
+# API requests don't each load the user row (see chat.cache.get_cached_user)
+CHAT_USER_CACHE_ENABLED = True
+CHAT_USER_CACHE_SIZE = 10000
+CHAT_USER_CACHE_TTL = 60  # seconds
+
+# Thread pool the chat consumers run their database calls on, with per-call
+# wait/run histograms under db.* in /api/metrics/. With ADMISSION_CONTROL,
+# connects are refused (close 1013 plus a retry hint) while more than
+# MAX_QUEUE_DEPTH calls are waiting (see chat.db_executor)
+CHAT_DB_EXECUTOR = {
+    'ENABLED': True,
+    'WORKERS': int(os.environ.get('CHAT_DB_WORKERS', 8)),
+    'ADMISSION_CONTROL': os.environ.get('CHAT_DB_ADMISSION_CONTROL', 'false').lower() == 'true',
+    'MAX_QUEUE_DEPTH': int(os.environ.get('CHAT_DB_MAX_QUEUE_DEPTH', 100)),
+    'RETRY_AFTER': 2,  # seconds
+}
+
+# Write-behind message persistence: broadcast immediately and store chat
+# messages in batches (see chat.persistence)
+CHAT_WRITE_BEHIND = {
+    'ENABLED': os.environ.get('CHAT_WRITE_BEHIND', 'false').lower() == 'true',
+    'BATCH_SIZE': int(os.environ.get('CHAT_WRITE_BEHIND_BATCH_SIZE', 100)),
+    'FLUSH_INTERVAL': float(os.environ.get('CHAT_WRITE_BEHIND_FLUSH_INTERVAL', 0.05)),
+    'MAX_QUEUE': int(os.environ.get('CHAT_WRITE_BEHIND_MAX_QUEUE', 10000)),
+}
+
+# Coalesce chat messages that arrive within WINDOW seconds of each other into
+# a single JSON array frame per connection (see chat.outbound)
+CHAT_OUTBOUND_BATCHING = {
+    'ENABLED': os.environ.get('CHAT_OUTBOUND_BATCHING', 'false').lower() == 'true',
+    'WINDOW': float(os.environ.get('CHAT_OUTBOUND_BATCH_WINDOW', 0.015)),
+    'MAX_BATCH': int(os.environ.get('CHAT_OUTBOUND_MAX_BATCH', 50)),
+}
+
+# Bounded per-connection send queue for clients that acknowledge the frames
+# they receive (?ack=1). At most MAX_UNACKED frames are in flight to a client;
+# POLICY decides what happens when a slow client lets MAX_SIZE more pile up:
+# 'drop_oldest', 'coalesce' (replace the backlog with a resync hint) or
+# 'disconnect' (close with a resume hint)
+CHAT_SEND_QUEUE = {
+    'ENABLED': True,
+    'MAX_SIZE': int(os.environ.get('CHAT_SEND_QUEUE_MAX_SIZE', 1000)),
+    'MAX_UNACKED': int(os.environ.get('CHAT_SEND_QUEUE_MAX_UNACKED', 200)),
+    'POLICY': os.environ.get('CHAT_SEND_QUEUE_POLICY', 'drop_oldest'),
+}
+
+# Resume-from-cursor: clients reconnecting with ?last_id= get the messages
+# they missed replayed in chunks; beyond the maximum they are told to resync
+CHAT_RESUME_CHUNK_SIZE = 100
+CHAT_RESUME_MAX_MESSAGES = 1000
+# Seconds before the client's last message the replay starts, for messages
+# that committed after it despite being older; the client drops duplicates
+CHAT_RESUME_LOOKBACK = 10
+
+# Keyset-paginated message history (/api/messages/?room_id=)
+CHAT_MESSAGE_PAGE_SIZE = 50
+CHAT_MESSAGE_MAX_PAGE_SIZE = 200
+
+# Rows fetched per database round trip by the streaming NDJSON room export
+# (/api/rooms/<id>/export/ and `manage.py export_chat`)
+CHAT_EXPORT_CHUNK_SIZE = 2000
+
+# Tiered retention: `manage.py archive_messages` moves messages older than
+# RETENTION_DAYS into compressed per-room segments of SEGMENT_SIZE messages,
+# which room history pagination reads transparently (see chat.archive)
+CHAT_ARCHIVE = {
+    'RETENTION_DAYS': int(os.environ.get('CHAT_ARCHIVE_RETENTION_DAYS', 180)),
+    'SEGMENT_SIZE': 1000,
+    'COMPRESSION_LEVEL': 6,
+}
+
+# Ranked full-text message search (/api/messages/search/?q=), backed by an
+# FTS5 table on SQLite or a GIN tsvector index on Postgres (see chat.search)
+CHAT_SEARCH_PAGE_SIZE = 20
+CHAT_SEARCH_MAX_PAGE_SIZE = 100
+CHAT_SEARCH_MAX_RESULTS = 1000
+# Only the newest RANK_WINDOW matches of a query are ranked, which keeps
+# searches for very common words as fast as for rare ones
+CHAT_SEARCH_RANK_WINDOW = 1000
+
+# Ring buffer of each room's newest serialized messages, used to answer
+# "latest page" history requests without the database. Kept in process
+# memory, or in Redis and shared by all workers when REDIS_URL is set. A
+# process-memory buffer misses other workers' messages, so it is refilled
+# TTL seconds after each fill; run more than one worker only with Redis
+CHAT_RECENT_MESSAGES = {
+    'ENABLED': os.environ.get('CHAT_RECENT_MESSAGES', 'false').lower() == 'true',
+    'SIZE': 200,
+    'MAX_ROOMS': 1000,
+    'MAX_BYTES': 32 * 1024 * 1024,
+    'TTL': int(os.environ.get('CHAT_RECENT_MESSAGES_TTL', 5)),
+    'REDIS_URL': os.environ.get('CHAT_RECENT_MESSAGES_REDIS_URL'),
+    'REDIS_TTL': 3600,
+}
+
 # Logging configuration
 LOGGING = {
     'version': 1,
@@ -214,6 +406,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'x-room-grant',
 ]
 
 # REST Framework settings
@@ -33,7 +33,10 @@ export default function ChatPage() {
     isConnected,
     newMessage,
     setNewMessage,
-    sendMessage
+    sendMessage,
+    hasOlderMessages,
+    isLoadingOlder,
+    loadOlderMessages
   } = useChat({ room: selectedRoom, onError: setError });
 
   useEffect(() => {
@@ -125,6 +128,9 @@ export default function ChatPage() {
           newMessage={newMessage}
           onNewMessageChange={setNewMessage}
           onSendMessage={handleSendMessage}
+          hasOlderMessages={hasOlderMessages}
+          isLoadingOlder={isLoadingOlder}
+          onLoadOlder={loadOlderMessages}
         />
       </div>
 
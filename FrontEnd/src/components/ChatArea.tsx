@@ -1,5 +1,5 @@
 import { useRef, useEffect } from 'react';
-import { Message, Room, User } from '@/lib/api';
+import { Message, Room, User, messageKey } from '@/lib/api';
 
 interface ChatAreaProps {
   room: Room | null;
@@ -8,6 +8,9 @@ interface ChatAreaProps {
   newMessage: string;
   onNewMessageChange: (message: string) => void;
   onSendMessage: (e: React.FormEvent) => Promise<void>;
+  hasOlderMessages: boolean;
+  isLoadingOlder: boolean;
+  onLoadOlder: () => void;
 }
 
 export function ChatArea({
@@ -16,14 +19,36 @@ export function ChatArea({
   currentUser,
   newMessage,
   onNewMessageChange,
-  onSendMessage
+  onSendMessage,
+  hasOlderMessages,
+  isLoadingOlder,
+  onLoadOlder
 }: ChatAreaProps) {
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  const listRef = useRef<HTMLDivElement>(null);
+  const lastKey = useRef<string | null>(null);
+  const scrollHeight = useRef(0);
 
   useEffect(() => {
-    messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
+    const list = listRef.current;
+    const key = messages.length ? messageKey(messages[messages.length - 1]) : null;
+    if (list && key !== null && key === lastKey.current) {
+      // Earlier messages were prepended; keep the same ones in view
+      list.scrollTop += list.scrollHeight - scrollHeight.current;
+    } else {
+      messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
+    }
+    lastKey.current = key;
+    scrollHeight.current = list ? list.scrollHeight : 0;
   }, [messages]);
 
+  // Scrolling to the top loads the previous page
+  const handleScroll = () => {
+    if (listRef.current && listRef.current.scrollTop === 0 && hasOlderMessages && !isLoadingOlder) {
+      onLoadOlder();
+    }
+  };
+
   if (!room) {
     return (
       <div className="flex-1 flex items-center justify-center text-gray-500">
@@ -38,10 +63,22 @@ export function ChatArea({
         <h2 className="text-xl font-bold">{room.name}</h2>
       </div>
 
-      <div className="flex-1 overflow-y-auto p-4">
+      <div ref={listRef} onScroll={handleScroll} className="flex-1 overflow-y-auto p-4">
+        {hasOlderMessages && (
+          <div className="mb-4 text-center">
+            <button
+              type="button"
+              onClick={onLoadOlder}
+              disabled={isLoadingOlder}
+              className="text-sm text-blue-500 hover:underline disabled:text-gray-400"
+            >
+              {isLoadingOlder ? 'Loading...' : 'Load earlier messages'}
+            </button>
+          </div>
+        )}
         {messages.map((message) => (
           <div
-            key={message.id}
+            key={messageKey(message)}
             className={`mb-4 ${
               message.user.id === currentUser?.id ? 'text-right' : ''
             }`}
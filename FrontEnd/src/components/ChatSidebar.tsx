@@ -61,6 +61,9 @@ export function ChatSidebar({
             {room.has_password && !createdRoomIds.includes(room.id) && (
               <span className="ml-2 text-yellow-500">🔒</span>
             )}
+            {selectedRoom?.id !== room.id && !!room.unread_count && (
+              <span className="ml-2 px-2 text-xs rounded-full bg-blue-500">{room.unread_count}</span>
+            )}
           </div>
         ))}
       </div>
@@ -1,6 +1,6 @@
 import { useEffect, useRef, useState } from 'react';
 import { useRouter } from 'next/navigation';
-import { Message, Room, getMessages } from '@/lib/api';
+import { Message, Room, getMessages, getRoomGrant, messageKey } from '@/lib/api';
 
 interface UseChatProps {
   room: Room | null;
@@ -14,6 +14,22 @@ export function useChat({ room, onError }: UseChatProps) {
   const [newMessage, setNewMessage] = useState('');
   const ws = useRef<WebSocket | null>(null);
   const reconnectAttempts = useRef(0);
+  // Highest message id seen in this room; sent on reconnect so the server
+  // only replays what was missed instead of us refetching the whole history
+  const lastMessageId = useRef<number | null>(null);
+  // Keys of the messages shown; a resume replays some we already have
+  const seenKeys = useRef<Set<string>>(new Set());
+  // Cursor of the page before the oldest message shown, null at the start
+  // of the room's history
+  const olderCursor = useRef<string | null>(null);
+  const [hasOlderMessages, setHasOlderMessages] = useState(false);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
+  // Delay the server asked for before reconnecting when it was overloaded
+  const retryAfter = useRef<number | null>(null);
+  // Frames received on the current connection, acknowledged to the server so
+  // it can hold back frames when we fall behind instead of buffering them
+  const framesReceived = useRef(0);
+  const ackTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
   const maxReconnectAttempts = 5;
   const reconnectDelay = 1000;
 
@@ -23,7 +39,11 @@ export function useChat({ room, onError }: UseChatProps) {
     try {
       const response = await getMessages(room.id);
       if (response.success) {
+        seenKeys.current = new Set(response.data.map(messageKey));
         setMessages(response.data);
+        setOlderCursor(response.older ?? null);
+        trackLastMessageId(response.data);
+        markRead();
       } else {
         if (onError) onError('Failed to fetch messages');
       }
@@ -33,7 +53,91 @@ export function useChat({ room, onError }: UseChatProps) {
     }
   };
 
-  const connectToRoom = () => {
+  const setOlderCursor = (cursor: string | null) => {
+    olderCursor.current = cursor;
+    setHasOlderMessages(cursor !== null);
+  };
+
+  // Prepend the page before the oldest message shown
+  const loadOlderMessages = async () => {
+    const cursor = olderCursor.current;
+    if (!room || cursor === null || isLoadingOlder) return;
+
+    setIsLoadingOlder(true);
+    try {
+      const response = await getMessages(room.id, cursor);
+      // Ignore the page if the room changed or the history was reloaded meanwhile
+      if (olderCursor.current !== cursor) return;
+      if (response.success) {
+        const older = response.data.filter((message) => !seenKeys.current.has(messageKey(message)));
+        older.forEach((message) => seenKeys.current.add(messageKey(message)));
+        setMessages((prev) => [...older, ...prev]);
+        setOlderCursor(response.older ?? null);
+      } else {
+        if (onError) onError('Failed to fetch messages');
+      }
+    } catch (error) {
+      console.error('Error fetching messages:', error);
+      if (onError) onError('Error fetching messages');
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  };
+
+  const readTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
+
+  // Tell the server everything so far has been seen, for unread counts; at
+  // most once a second so busy rooms don't turn every frame into a write
+  const markRead = () => {
+    if (readTimer.current) return;
+    readTimer.current = setTimeout(() => {
+      readTimer.current = null;
+      if (ws.current && ws.current.readyState === WebSocket.OPEN && document.visibilityState === 'visible') {
+        ws.current.send(JSON.stringify({ type: 'read' }));
+      }
+    }, 1000);
+  };
+
+  const sendAck = () => {
+    if (ackTimer.current) {
+      clearTimeout(ackTimer.current);
+      ackTimer.current = null;
+    }
+    if (ws.current && ws.current.readyState === WebSocket.OPEN) {
+      ws.current.send(JSON.stringify({ type: 'ack', frames: framesReceived.current }));
+    }
+  };
+
+  // Ack every 20 frames, or shortly after the last one in a quiet room
+  const ackFrame = () => {
+    framesReceived.current++;
+    if (framesReceived.current % 20 === 0) {
+      sendAck();
+    } else if (!ackTimer.current) {
+      ackTimer.current = setTimeout(sendAck, 250);
+    }
+  };
+
+  const trackLastMessageId = (received: Message[]) => {
+    for (const message of received) {
+      if (message.id != null && (lastMessageId.current === null || message.id > lastMessageId.current)) {
+        lastMessageId.current = message.id;
+      }
+    }
+  };
+
+  const handleControlFrame = (data: { type: string; error?: string; retry_after?: number }) => {
+    if (data.type === 'retry') {
+      retryAfter.current = data.retry_after ?? null;
+    } else if (data.type === 'resync') {
+      // Messages were dropped while we were behind; reload the history
+      fetchOldMessages();
+    } else if (data.type === 'error') {
+      if (onError && data.error) onError(data.error);
+    }
+  };
+
+  const connectToRoom = (resume = false) => {
     if (!room) return;
 
     // Close existing connection if any
@@ -49,7 +153,16 @@ export function useChat({ room, onError }: UseChatProps) {
 
     // Get WebSocket URL from environment variable or use default
     const wsUrl = process.env.NEXT_PUBLIC_WS_URL || 'ws://localhost:8002';
-    const wsEndpoint = `${wsUrl}/ws/chat/${room.name}/?token=${encodeURIComponent(accessToken)}`;
+    const resumeFrom = resume ? lastMessageId.current : null;
+    const grant = getRoomGrant(room.id);
+    framesReceived.current = 0;
+    if (ackTimer.current) {
+      clearTimeout(ackTimer.current);
+      ackTimer.current = null;
+    }
+    const wsEndpoint = `${wsUrl}/ws/chat/${room.name}/?ack=1&token=${encodeURIComponent(accessToken)}` +
+      (grant ? `&grant=${encodeURIComponent(grant)}` : '') +
+      (resumeFrom !== null ? `&last_id=${resumeFrom}` : '');
     console.log('Connecting to WebSocket:', {
       wsUrl,
       roomName: room.name,
@@ -64,15 +177,32 @@ export function useChat({ room, onError }: UseChatProps) {
       setIsConnected(true);
       reconnectAttempts.current = 0;
       if (onError) onError('');
-      // Fetch old messages when connected
-      fetchOldMessages();
+      // Fetch old messages on first connect; a resumed connection replays
+      // the missed messages over the socket instead
+      if (resumeFrom === null) {
+        fetchOldMessages();
+      }
     };
 
     ws.current.onmessage = (event) => {
+      ackFrame();
       try {
         const data = JSON.parse(event.data);
         console.log('Received message:', data);
-        setMessages((prev) => [...prev, data]);
+        if (!Array.isArray(data) && data.type) {
+          handleControlFrame(data);
+          return;
+        }
+        // Busy rooms may deliver several messages in one array frame
+        const received = (Array.isArray(data) ? data : [data]).filter((message: Message) => {
+          const key = messageKey(message);
+          if (seenKeys.current.has(key)) return false;
+          seenKeys.current.add(key);
+          return true;
+        });
+        trackLastMessageId(received);
+        if (received.length) setMessages((prev) => [...prev, ...received]);
+        markRead();
       } catch (error) {
         console.error('Error parsing WebSocket message:', error);
       }
@@ -83,19 +213,28 @@ export function useChat({ room, onError }: UseChatProps) {
       setIsConnected(false);
 
       // Handle specific close codes
-      if (event.code === 1006) {
-        // Abnormal closure - try to reconnect
+      if (event.code === 1006 || event.code === 4008) {
+        // Abnormal closure, or 4008 when the server dropped a slow client - try to reconnect
         console.log('Attempting to reconnect...');
         reconnectAttempts.current++;
         if (reconnectAttempts.current < maxReconnectAttempts) {
-          setTimeout(connectToRoom, reconnectDelay * reconnectAttempts.current);
+          setTimeout(() => connectToRoom(true), reconnectDelay * reconnectAttempts.current);
         } else {
           if (onError) onError('Failed to connect to chat server');
         }
+      } else if (event.code === 1013) {
+        // Server busy - come back after the hinted delay, with some jitter so
+        // rejected clients don't all return at once
+        const delay = (retryAfter.current ?? reconnectDelay / 1000) * 1000 * (1 + Math.random());
+        retryAfter.current = null;
+        setTimeout(() => connectToRoom(lastMessageId.current !== null), delay);
       } else if (event.code === 1008) {
         // Policy violation - token might be invalid
         console.error('Token might be invalid');
         router.push('/auth/login');
+      } else if (event.code === 4003) {
+        // Password-protected room without a valid (or with an expired) grant
+        if (onError) onError('Room password required');
       }
     };
 
@@ -131,6 +270,9 @@ export function useChat({ room, onError }: UseChatProps) {
 
   // Connect to room when room changes
   useEffect(() => {
+    lastMessageId.current = null;
+    seenKeys.current = new Set();
+    setOlderCursor(null);
     if (room) {
       connectToRoom();
     }
@@ -146,6 +288,9 @@ export function useChat({ room, onError }: UseChatProps) {
     isConnected,
     newMessage,
     setNewMessage,
-    sendMessage
+    sendMessage,
+    hasOlderMessages,
+    isLoadingOlder,
+    loadOlderMessages
   };
 } 
\ No newline at end of file
@@ -11,16 +11,33 @@ export interface Room {
   name: string;
   created_at: string;
   has_password?: boolean;
+  message_count?: number;
+  last_message_at?: string | null;
+  last_message?: { content: string; user: User | null } | null;
+  unread_count?: number | null;
 }
 
 export interface Message {
-  id: number;
+  id: number | null;
+  // Set on messages broadcast before they were saved, whose live frames have no id
+  nonce?: string | null;
   content: string;
   user: User;
   room: number;
   created_at: string;
 }
 
+// Identifies a message across live frames, resume replays and history pages
+export function messageKey(message: Message): string {
+  return message.nonce ? `n:${message.nonce}` : `i:${message.id}`;
+}
+
+export interface MessagePage {
+  older: string | null;
+  newer: string | null;
+  results: Message[];
+}
+
 // API base URL
 const API_BASE_URL = 'http://localhost:8002/api';
 
@@ -31,7 +48,7 @@ async function fetchAPI<T>(endpoint: string, options: RequestInit = {}): Promise
   
   // Don't try to refresh token for login, register, or token refresh endpoints
   const isAuthEndpoint = endpoint === '/users/login/' || 
-                         endpoint === '/users/' || 
+                         endpoint === '/users/register/' || 
                          endpoint === '/token/refresh/';
   
   // Log the request details for debugging
@@ -132,24 +149,53 @@ export async function getRoom(id: number): Promise<{ success: boolean; data: Roo
   return fetchAPI<Room>(`/rooms/${id}/`);
 }
 
+// Signed, short-lived grants for password-protected rooms, kept for the
+// browser session and sent instead of the password on every read/connect
+interface RoomGrant {
+  grant?: string;
+  grant_expires_in?: number;
+}
+
+export function getRoomGrant(roomId: number): string | null {
+  return sessionStorage.getItem(`room_grant_${roomId}`);
+}
+
+function storeRoomGrant(roomId: number, { grant }: RoomGrant) {
+  if (grant) {
+    sessionStorage.setItem(`room_grant_${roomId}`, grant);
+  }
+}
+
 export async function createRoom(name: string, password?: string): Promise<{ success: boolean; data: Room }> {
-  return fetchAPI<Room>('/rooms/', {
+  const response = await fetchAPI<Room & RoomGrant>('/rooms/', {
     method: 'POST',
     body: JSON.stringify({ name, password }),
   });
+  storeRoomGrant(response.data.id, response.data);
+  return response;
 }
 
 export async function verifyRoomPassword(roomId: number, password: string): Promise<{ success: boolean; data: boolean }> {
-  return fetchAPI<boolean>(`/rooms/${roomId}/verify-password/`, {
+  const response = await fetchAPI<{ success: boolean } & RoomGrant>(`/rooms/${roomId}/check_password/`, {
     method: 'POST',
     body: JSON.stringify({ password }),
   });
+  storeRoomGrant(roomId, response.data);
+  return { success: response.success && response.data.success, data: response.data.success };
 }
 
 // Message API functions
-export async function getMessages(roomId: number): Promise<{ success: boolean; data: Message[] }> {
+// Returns the newest page of a room's history, oldest message first; pass a
+// page's `older` cursor to walk further back
+export async function getMessages(roomId: number, cursor?: string): Promise<{ success: boolean; data: Message[]; older?: string | null }> {
   try {
-    return await fetchAPI<Message[]>(`/messages/?room_id=${roomId}`);
+    const query = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+    const grant = getRoomGrant(roomId);
+    const response = await fetchAPI<MessagePage>(`/messages/?room_id=${roomId}${query}`, {
+      headers: grant ? { 'X-Room-Grant': grant } : {},
+    });
+    const older = response.data.older ? new URL(response.data.older).searchParams.get('cursor') : null;
+    return { success: response.success, data: response.data.results, older };
   } catch (error) {
     console.error('Error fetching messages:', error);
     return { success: false, data: [] };
@@ -200,7 +246,7 @@ export async function login(username: string, password: string): Promise<{ succe
 }
 
 export async function register(username: string, password: string): Promise<{ success: boolean; data: { user: User; tokens: { access: string; refresh: string } } }> {
-  const response = await fetchAPI<{ user: User; tokens: { access: string; refresh: string } }>('/users/', {
+  const response = await fetchAPI<{ user: User; tokens: { access: string; refresh: string } }>('/users/register/', {
     method: 'POST',
     body: JSON.stringify({ username, password }),
   });